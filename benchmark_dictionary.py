@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+
+import morfeusz2
+
+import dict_helpers
+
+# CONSTANTS
+BENCHMARK_RESULTS_FILENAME = "benchmark_results_{}.json"
+BENCHMARK_BASE_ENTRIES = 5000
+BENCHMARK_SCALES = [1, 5, 10]
+# Machine-translated items per corpus entry, roughly the ratio of the real corpora
+BENCHMARK_MACHINE_TRANSLATED_RATIO = 0.2
+
+# Share of each kind of entry in the synthetic corpus, modelled on the Polish Kaikki extract
+SYNTHETIC_ENTRY_KINDS = [
+    ("noun", 0.45),
+    ("verb", 0.2),
+    ("adj", 0.15),
+    ("adv", 0.05),
+    ("derived", 0.1),
+    ("ignored", 0.05),
+]
+SYNTHETIC_NOUNS = [
+    "pies", "kot", "dom", "stół", "okno", "ręka", "głowa", "miasto", "rzeka", "drzewo", "książka", "szkoła",
+    "samochód", "kobieta", "mężczyzna", "dziecko", "słowo", "noc", "dzień", "woda", "ogień", "ziemia", "niebo",
+    "morze", "góra", "las", "pole", "droga", "ulica", "praca", "rok", "czas", "człowiek", "ptak", "koń", "ryba",
+    "chleb", "mleko", "serce", "oko", "ucho", "noga", "matka", "ojciec", "brat", "siostra", "przyjaciel", "wieś",
+]
+SYNTHETIC_VERBS = [
+    "robić", "pisać", "czytać", "mówić", "iść", "jechać", "mieć", "widzieć", "słyszeć", "jeść", "pić", "spać",
+    "myśleć", "kochać", "pracować", "grać", "śpiewać", "tańczyć", "płakać", "biegać", "pływać", "kupować",
+    "sprzedawać", "otwierać", "zamykać", "gotować", "szukać", "pytać", "rysować", "liczyć",
+]
+SYNTHETIC_VERB_PREFIXES = ["", "po", "za", "prze", "wy", "do", "od", "roz", "przy", "na", "u", "s"]
+SYNTHETIC_ADJECTIVES = [
+    "dobry", "zły", "duży", "mały", "nowy", "stary", "młody", "zielony", "czerwony", "biały", "czarny", "ciepły",
+    "zimny", "szybki", "wolny", "ładny", "brzydki", "wysoki", "niski", "długi", "krótki", "mądry", "głupi", "łatwy",
+]
+SYNTHETIC_ADVERBS = ["szybko", "wolno", "dobrze", "źle", "często", "rzadko", "dziś", "jutro", "zawsze", "nigdy"]
+SYNTHETIC_IGNORED_POS = ["name", "character", "punct"]
+SYNTHETIC_GLOSSES = [
+    "dog", "house", "table", "to write", "to read", "good", "quickly", "river", "tree", "book", "school", "night",
+    "water", "fire", "mountain", "forest", "road", "work", "time", "heart", "mother", "friend", "bread", "to sing",
+]
+SYNTHETIC_SENSE_TAGS = ["colloquial", "figuratively", "archaic", "transitive", "intransitive", "pejorative"]
+SYNTHETIC_ASPECT_TAGS = ["perfective", "imperfective", "frequentative"]
+SYNTHETIC_SUFFIXES = ["ek", "ka", "ik", "ość", "nik", "ówka", "arz", "isko"]
+# Share of headwords taken as is from the word lists above, the rest are made-up variations of them
+SYNTHETIC_REAL_WORD_SHARE = 0.3
+
+
+def pick_synthetic_headword(rng, words, real_word_share=SYNTHETIC_REAL_WORD_SHARE):
+    """
+    Real words give Morfeusz actual inflection tables to generate, while the made-up ones
+    (which Morfeusz doesn't recognise) keep the headwords varied at any corpus size
+    """
+    word = rng.choice(words)
+    if rng.random() >= real_word_share:
+        word += rng.choice(SYNTHETIC_SUFFIXES) + str(rng.randrange(1000))
+    return word
+
+
+def generate_synthetic_senses(rng, form_of=None):
+    senses = []
+    for _ in range(rng.randint(1, 4)):
+        sense = {"glosses": [" ".join(rng.sample(SYNTHETIC_GLOSSES, rng.randint(1, 3)))]}
+        if rng.random() < 0.3:
+            sense["tags"] = [rng.choice(SYNTHETIC_SENSE_TAGS)]
+        if form_of:
+            sense["form_of"] = [form_of]
+        senses.append(sense)
+    return senses
+
+
+def generate_synthetic_entry(rng):
+    """
+    Generates a single corpus entry with the structure of the Kaikki extract
+    """
+    kind = rng.choices(
+        [kind for kind, _ in SYNTHETIC_ENTRY_KINDS], weights=[weight for _, weight in SYNTHETIC_ENTRY_KINDS]
+    )[0]
+    if kind == "verb":
+        headword = rng.choice(SYNTHETIC_VERB_PREFIXES) + pick_synthetic_headword(rng, SYNTHETIC_VERBS)
+        entry = {"pos": "verb", "word": headword, "senses": generate_synthetic_senses(rng)}
+        if rng.random() < 0.6:
+            aspect_tag = rng.choice(SYNTHETIC_ASPECT_TAGS)
+            aspect_form = rng.choice(SYNTHETIC_VERB_PREFIXES[1:]) + rng.choice(SYNTHETIC_VERBS)
+            entry["heads"] = [{"a": aspect_tag[0], "template_name": "pl-verb"}]
+            entry["forms"] = [{"form": aspect_form, "tags": [aspect_tag]}]
+        return entry
+    if kind == "noun":
+        headword = pick_synthetic_headword(rng, SYNTHETIC_NOUNS)
+        entry = {"pos": "noun", "word": headword, "senses": generate_synthetic_senses(rng)}
+        if rng.random() < 0.2:
+            entry["forms"] = [{"form": headword + "ek", "tags": ["diminutive"]}]
+        return entry
+    if kind == "adj":
+        return {
+            "pos": "adj",
+            "word": pick_synthetic_headword(rng, SYNTHETIC_ADJECTIVES),
+            "senses": generate_synthetic_senses(rng),
+        }
+    if kind == "adv":
+        return {
+            "pos": "adv",
+            "word": pick_synthetic_headword(rng, SYNTHETIC_ADVERBS),
+            "senses": generate_synthetic_senses(rng),
+        }
+    if kind == "derived":
+        base_word = rng.choice(SYNTHETIC_NOUNS)
+        return {
+            "pos": "noun",
+            "word": base_word + rng.choice(SYNTHETIC_SUFFIXES),
+            "senses": generate_synthetic_senses(rng, form_of=base_word),
+        }
+    return {
+        "pos": rng.choice(SYNTHETIC_IGNORED_POS),
+        "word": rng.choice(SYNTHETIC_NOUNS).capitalize(),
+        "senses": generate_synthetic_senses(rng),
+    }
+
+
+def count_machine_translated_items(entries_count):
+    return int(entries_count * BENCHMARK_MACHINE_TRANSLATED_RATIO)
+
+
+def generate_synthetic_corpus(directory, entries_count, seed=0):
+    """
+    Writes a synthetic corpus and machine-translated corpus of the given size to the directory,
+    under the file names the build reads. The same seed always gives the same corpora
+    """
+    rng = random.Random(seed)
+    headwords = []
+    with open(os.path.join(directory, dict_helpers.CORPUS_FILENAME), "w", encoding="utf-8") as myfile:
+        for _ in range(entries_count):
+            entry = generate_synthetic_entry(rng)
+            headwords.append(entry["word"])
+            myfile.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    with open(
+        os.path.join(directory, dict_helpers.MACHINE_TRANSLATED_CORPUS_FILENAME), "w", encoding="utf-8"
+    ) as myfile:
+        for _ in range(count_machine_translated_items(entries_count)):
+            # About half of the machine-translated items duplicate a Wiktionary headword
+            if rng.random() < 0.5:
+                headword = rng.choice(headwords)
+            else:
+                headword = pick_synthetic_headword(rng, SYNTHETIC_NOUNS, 0)
+            item = {
+                "entry": headword,
+                "abbr_pos": rng.choice(list(dict_helpers.SGJP_MORPH_CATEGORY_MAPPING)),
+                "translation": rng.choice(SYNTHETIC_GLOSSES + [headword]),
+            }
+            myfile.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def run_benchmark(entries_count, jobs=1, chunk_jobs=1, seed=0):
+    """
+    Builds the dictionary from a fresh synthetic corpus in a temporary directory, timing every stage.
+    Inflections are always generated from scratch, so the inflection timings aren't skewed by a warm cache
+    """
+    stages = {}
+
+    def record(stage_name, start_time, items):
+        seconds = time.perf_counter() - start_time
+        stages[stage_name] = {
+            "seconds": round(seconds, 4),
+            "items": items,
+            "items_per_second": round(items / seconds, 1) if seconds else None,
+        }
+        print("{}: {:.2f}s for {} items".format(stage_name, seconds, items))
+
+    current_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        generate_synthetic_corpus(temp_dir, entries_count, seed)
+        os.chdir(temp_dir)
+        try:
+            start_time = time.perf_counter()
+            corpus = list(dict_helpers.load_corpus())
+            record("load", start_time, len(corpus))
+
+            start_time = time.perf_counter()
+            lemmas, _ = dict_helpers.extract_head_words(corpus)
+            record("extract", start_time, len(corpus))
+            del corpus
+
+            start_time = time.perf_counter()
+            lemmas = dict_helpers.add_machine_translated_lemmas(dict_helpers.read_machine_translated_corpus(), lemmas)
+            record("merge", start_time, count_machine_translated_items(entries_count))
+
+            start_time = time.perf_counter()
+            sorted_lemmas, lemma_verb_dict = dict_helpers.sort_and_number_lemmas(lemmas)
+            record("sort", start_time, len(sorted_lemmas))
+
+            start_time = time.perf_counter()
+            dict_helpers.link_lemmas(sorted_lemmas)
+            record("link", start_time, len(sorted_lemmas))
+
+            inflection_cache_path = os.path.join(temp_dir, dict_helpers.INFLECTION_CACHE_FILENAME)
+            start_time = time.perf_counter()
+            iform_counts, _ = dict_helpers.count_derived_forms(
+                (lemma.headword for lemma in sorted_lemmas), inflection_cache_path, jobs
+            )
+            record("inflect", start_time, len(iform_counts))
+
+            start_time = time.perf_counter()
+            build_stats = dict_helpers.render_html_dictionary(
+                sorted_lemmas, lemma_verb_dict, iform_counts, True, inflection_cache_path, False, chunk_jobs,
+                dict_helpers.DICT_CHUNK_IFORM_BUDGET
+            )
+            record("render", start_time, len(sorted_lemmas))
+        finally:
+            os.chdir(current_dir)
+
+    return {
+        "entries": entries_count,
+        "lemmas": len(sorted_lemmas),
+        "iforms": sum(iform_counts.values()),
+        "chunks": build_stats["chunks_count"],
+        "total_seconds": round(sum(stage["seconds"] for stage in stages.values()), 4),
+        "stages": stages,
+    }
+
+
+def run_benchmarks(scales=BENCHMARK_SCALES, base_entries=BENCHMARK_BASE_ENTRIES, jobs=1, chunk_jobs=1, seed=0):
+    runs = []
+    for scale in scales:
+        print("Benchmarking {}x ({} entries)...".format(scale, base_entries * scale))
+        run = run_benchmark(base_entries * scale, jobs, chunk_jobs, seed)
+        run["scale"] = scale
+        runs.append(run)
+    return {
+        "git_hash": dict_helpers.fetch_current_git_hash(),
+        "python_version": platform.python_version(),
+        "morfeusz_version": morfeusz2.__version__,
+        "cpu_count": os.cpu_count(),
+        "base_entries": base_entries,
+        "jobs": jobs,
+        "chunk_jobs": chunk_jobs,
+        "seed": seed,
+        "runs": runs,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times every build stage on synthetic corpora of growing size")
+    parser.add_argument(
+        "--scales", type=int, nargs="+", default=BENCHMARK_SCALES,
+        help="corpus sizes to benchmark, as multiples of --base-entries"
+    )
+    parser.add_argument(
+        "--base-entries", type=int, default=BENCHMARK_BASE_ENTRIES,
+        help="number of corpus entries at 1x"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=1,
+        help="number of worker processes used to generate inflected forms"
+    )
+    parser.add_argument(
+        "--chunk-jobs", type=int, default=1,
+        help="number of worker processes rendering and writing HTML chunks concurrently"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic corpus generator")
+    parser.add_argument(
+        "--output",
+        help="file the JSON results are written to, by default one named after the current commit"
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scales, args.base_entries, args.jobs, args.chunk_jobs, args.seed)
+    output_filename = args.output or BENCHMARK_RESULTS_FILENAME.format(results["git_hash"])
+    with open(output_filename, "w", encoding="utf-8") as myfile:
+        myfile.write(json.dumps(results, indent=1))
+    print("Results written to {}".format(output_filename))
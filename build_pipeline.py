@@ -0,0 +1,656 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import copy
+import cProfile
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import dict_helpers
+import lemma_snapshot
+import stardict_writer
+
+# CONSTANTS
+BUILD_CHECKPOINT_DIR = "build_checkpoints"
+BUILD_CHECKPOINT_FILENAME = "{}.pickle"
+# Bump whenever the structure of the checkpointed build state changes
+BUILD_CHECKPOINT_VERSION = 2
+BUILD_CODE_FILENAMES = [dict_helpers.__file__, __file__]
+PROFILE_STAGE_FILENAME = "dictionary_profile_{}_{}.prof"
+PROFILE_MEMORY_FILENAME = "dictionary_memory_{}.json"
+PROFILE_TOP_ALLOCATIONS = 20
+DICTIONARY_COVER_FILENAME = "PL_EN_dict.jpeg"
+# Stats recorded for each side of an output comparison
+COMPARISON_STATS = ("html_bytes", "entries_count", "kindlegen_seconds", "mobi_bytes")
+
+VARIANTS_DIR = "variants"
+KINDLEGEN_JOBS = 2
+# Stages of a single build relying on its sorted lemmas, which a variants build keeps per variant
+VARIANTS_UNSUPPORTED_OPTIONS = (
+    "compare_html_modes", "compare_headword_grouping", "write_snapshot", "make_stardict_dict"
+)
+
+# state_keys are the keys of the build state that the stage sets or changes, the only ones its checkpoint holds
+BuildStage = namedtuple("BuildStage", ["name", "fingerprint_inputs", "run", "is_complete", "state_keys"])
+# A flavor of the dictionary, built from the same corpora with a different selection of lemmas
+DictionaryVariant = namedtuple("DictionaryVariant", ["name", "machine_translated", "derived_only"])
+DICTIONARY_VARIANTS = {
+    variant.name: variant for variant in [
+        DictionaryVariant("default", machine_translated=True, derived_only=False),
+        DictionaryVariant("no_mt", machine_translated=False, derived_only=False),
+        DictionaryVariant("derived", machine_translated=True, derived_only=True),
+        DictionaryVariant("no_mt_derived", machine_translated=False, derived_only=True),
+    ]
+}
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    """
+    Runs the enclosed build steps from another directory, all the build output file names being relative
+    """
+    current_dir = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(current_dir)
+
+
+def fingerprint_code(filenames=BUILD_CODE_FILENAMES):
+    code_hash = hashlib.sha1()
+    for filename in filenames:
+        with open(filename, "rb") as myfile:
+            code_hash.update(myfile.read())
+    return code_hash.hexdigest()
+
+
+class DictionaryBuild(object):
+    """
+    The dictionary build modelled as a sequence of named stages. The state after every stage
+    is checkpointed to disk together with a fingerprint of all the inputs up to that stage,
+    so that a rerun resumes from the last completed stage whose inputs haven't changed
+    """
+    keep_derived_only = False
+
+    def __init__(
+        self, create_with_stats=False, make_mobi_dict=False, jobs=1, inflection_cache_path=None,
+        incremental=False, chunk_jobs=1, chunk_iform_budget=dict_helpers.DICT_CHUNK_IFORM_BUDGET,
+        checkpoint_dir=BUILD_CHECKPOINT_DIR, resume=True, profile=False,
+        html_mode=dict_helpers.HTML_TEMPLATE_MODE_DEFAULT, compare_html_modes=False, group_headwords=False,
+        compare_headword_grouping=False, write_snapshot=False, make_stardict_dict=False
+    ):
+        super(DictionaryBuild, self).__init__()
+        self.create_with_stats = create_with_stats
+        self.make_mobi_dict = make_mobi_dict
+        self.jobs = jobs
+        self.inflection_cache_path = inflection_cache_path
+        self.incremental = incremental
+        self.chunk_jobs = chunk_jobs
+        self.chunk_iform_budget = chunk_iform_budget
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
+        self.profile = profile
+        self.html_mode = html_mode
+        self.compare_html_modes = compare_html_modes
+        self.group_headwords = group_headwords
+        self.compare_headword_grouping = compare_headword_grouping
+        self.write_snapshot = write_snapshot
+        self.make_stardict_dict = make_stardict_dict
+        self.stage_times = {}
+        self.stage_memory = {}
+
+    @property
+    def stages(self):
+        stages = [
+            BuildStage(
+                "extract",
+                lambda: [
+                    dict_helpers.fingerprint_file(dict_helpers.CORPUS_FILENAME),
+                    self.create_with_stats,
+                    self.keep_derived_only,
+                ],
+                self.run_extract,
+                self.is_extract_complete,
+                ("lemmas", "discarded_entries", "discarded_entries_filename"),
+            ),
+            BuildStage(
+                "merge",
+                lambda: [dict_helpers.fingerprint_file(dict_helpers.MACHINE_TRANSLATED_CORPUS_FILENAME)],
+                self.run_merge,
+                None,
+                ("lemmas",),
+            ),
+            BuildStage("sort", lambda: [], self.run_sort, None, ("sorted_lemmas", "lemma_verb_dict")),
+            # Links are set on the lemmas themselves
+            BuildStage("link", lambda: [], self.run_link, None, ("sorted_lemmas", "link_counts")),
+            BuildStage(
+                "inflect",
+                lambda: [dict_helpers.fetch_inflection_cache_key(), self.inflection_cache_path],
+                self.run_inflect,
+                None,
+                ("iform_counts", "inflection_cache_counts"),
+            ),
+            BuildStage(
+                "render",
+                lambda: [
+                    dict_helpers.fetch_build_fingerprint(self.html_mode, self.group_headwords), self.chunk_iform_budget
+                ],
+                self.run_render,
+                self.is_render_complete,
+                ("build_stats",),
+            ),
+        ]
+        if self.make_mobi_dict:
+            stages.append(
+                BuildStage(
+                    "kindlegen",
+                    lambda: [dict_helpers.fingerprint_file(dict_helpers.KINDLEGEN_PATH)],
+                    self.run_kindlegen,
+                    self.is_kindlegen_complete,
+                    ("kindlegen",),
+                )
+            )
+        if self.make_stardict_dict:
+            stages.append(
+                BuildStage(
+                    "stardict",
+                    lambda: [fingerprint_code([stardict_writer.__file__])],
+                    self.run_stardict,
+                    self.is_stardict_complete,
+                    ("stardict",),
+                )
+            )
+        if self.compare_html_modes:
+            stages.append(
+                BuildStage(
+                    "compare_html_modes",
+                    lambda: [dict_helpers.fingerprint_file(dict_helpers.KINDLEGEN_PATH)],
+                    self.run_compare_html_modes,
+                    None,
+                    ("html_modes",),
+                )
+            )
+        if self.compare_headword_grouping:
+            stages.append(
+                BuildStage(
+                    "compare_headword_grouping",
+                    lambda: [dict_helpers.fingerprint_file(dict_helpers.KINDLEGEN_PATH)],
+                    self.run_compare_headword_grouping,
+                    None,
+                    ("headword_grouping",),
+                )
+            )
+        # Last, so that toggling it never invalidates the checkpoints of the other stages
+        if self.write_snapshot:
+            stages.append(
+                BuildStage(
+                    "snapshot",
+                    lambda: [fingerprint_code([lemma_snapshot.__file__])],
+                    self.run_snapshot,
+                    self.is_snapshot_complete,
+                    (),
+                )
+            )
+        return stages
+
+    def run_extract(self, state):
+        if self.create_with_stats:
+            state["discarded_entries_filename"] = dict_helpers.DISCARDED_ENTRIES_FILENAME.format(
+                dict_helpers.fetch_current_git_hash()
+            )
+        state["lemmas"], state["discarded_entries"] = dict_helpers.extract_head_words(
+            dict_helpers.load_corpus(), state.get("discarded_entries_filename"), self.keep_derived_only
+        )
+
+    def is_extract_complete(self, state):
+        """
+        The discarded entries are written next to the stats under the current commit,
+        so a checkpoint made under another commit has to be redone
+        """
+        if not self.create_with_stats:
+            return True
+        return state["discarded_entries_filename"] == dict_helpers.DISCARDED_ENTRIES_FILENAME.format(
+            dict_helpers.fetch_current_git_hash()
+        ) and os.path.exists(state["discarded_entries_filename"])
+
+    def run_merge(self, state):
+        machine_translated_corpus = dict_helpers.read_machine_translated_corpus()
+        state["lemmas"] = dict_helpers.add_machine_translated_lemmas(machine_translated_corpus, state["lemmas"])
+
+    def run_sort(self, state):
+        state["sorted_lemmas"], state["lemma_verb_dict"] = dict_helpers.sort_and_number_lemmas(state.pop("lemmas"))
+
+    def run_link(self, state):
+        state["link_counts"] = dict_helpers.link_lemmas(state["sorted_lemmas"])
+
+    def run_inflect(self, state):
+        state["iform_counts"], state["inflection_cache_counts"] = dict_helpers.count_derived_forms(
+            (lemma.headword for lemma in state["sorted_lemmas"]), self.build_cache_path, self.jobs
+        )
+
+    def run_snapshot(self, state):
+        lemma_snapshot.write_lemma_snapshot(
+            state["sorted_lemmas"], lemma_snapshot.LEMMA_SNAPSHOT_FILENAME, self.build_cache_path
+        )
+
+    def is_snapshot_complete(self, state):
+        return lemma_snapshot.check_lemma_snapshot_is_current(with_inflections=True)
+
+    def run_render(self, state):
+        state["build_stats"] = dict_helpers.render_html_dictionary(
+            state["sorted_lemmas"], state["lemma_verb_dict"], state["iform_counts"], True, self.build_cache_path,
+            self.incremental, self.chunk_jobs, self.chunk_iform_budget, self.html_mode, self.group_headwords
+        )
+
+    def is_render_complete(self, state):
+        chunk_filenames = [
+            dict_helpers.DICTIONARY_HTML_FILENAME.format(chunk_no)
+            for chunk_no in range(1, state["build_stats"]["chunks_count"] + 1)
+        ]
+        return all(os.path.exists(filename) for filename in chunk_filenames + [dict_helpers.DICTIONARY_OPF_FILENAME])
+
+    def run_kindlegen(self, state):
+        state["kindlegen"] = dict_helpers.run_kindlegen()
+
+    def is_kindlegen_complete(self, state):
+        return os.path.exists(os.path.splitext(dict_helpers.DICTIONARY_OPF_FILENAME)[0] + ".mobi")
+
+    def run_stardict(self, state):
+        state["stardict"] = stardict_writer.write_stardict_dictionary(
+            state["sorted_lemmas"], state["lemma_verb_dict"], self.build_cache_path
+        )
+
+    def is_stardict_complete(self, state):
+        return all(
+            os.path.exists(stardict_writer.STARDICT_BASENAME + extension)
+            for extension in (".ifo", ".idx", ".dict.dz", ".syn")
+        )
+
+    def run_compare_html_modes(self, state):
+        """
+        Builds the dictionary with the other template mode, to compare output size and kindlegen time of both modes
+        """
+        other_mode = next(mode for mode in dict_helpers.HTML_TEMPLATE_MODES if mode != self.html_mode)
+        state["html_modes"] = {other_mode: self.render_comparison_build(state, other_mode, self.group_headwords)}
+
+    def run_compare_headword_grouping(self, state):
+        """
+        Builds the dictionary with headword grouping toggled, to compare entry counts, output size,
+        kindlegen time and .mobi size with and without it
+        """
+        other_layout = "ungrouped" if self.group_headwords else "grouped"
+        state["headword_grouping"] = {
+            other_layout: self.render_comparison_build(state, self.html_mode, not self.group_headwords)
+        }
+
+    def render_comparison_build(self, state, html_mode, group_headwords):
+        """
+        Renders the dictionary with other output options in a scratch directory (and compiles it too
+        when building the .mobi file), leaving the actual build untouched. Returns its size and timing stats
+        """
+        cache_path = os.path.abspath(self.build_cache_path)
+        kindlegen_path = os.path.abspath(dict_helpers.KINDLEGEN_PATH)
+        cover_filename = os.path.abspath(DICTIONARY_COVER_FILENAME)
+        with tempfile.TemporaryDirectory() as temp_dir, working_directory(temp_dir):
+            build_stats = dict_helpers.render_html_dictionary(
+                state["sorted_lemmas"], state["lemma_verb_dict"], state["iform_counts"], True, cache_path,
+                False, self.chunk_jobs, self.chunk_iform_budget, html_mode, group_headwords
+            )
+            if self.make_mobi_dict:
+                if os.path.exists(cover_filename):
+                    shutil.copy(cover_filename, temp_dir)
+                build_stats.update(dict_helpers.run_kindlegen(kindlegen_path=kindlegen_path))
+        return {key: value for key, value in build_stats.items() if key in COMPARISON_STATS}
+
+    def checkpoint_filename(self, stage):
+        return os.path.join(self.checkpoint_dir, BUILD_CHECKPOINT_FILENAME.format(stage.name))
+
+    def read_checkpoint(self, stage, fingerprint, with_changes=True):
+        """
+        Returns the checkpoint of the stage, if the stage was completed with the same inputs.
+        The state changes come after a small header in the file, they are only unpickled if asked for
+        """
+        if not os.path.exists(self.checkpoint_filename(stage)):
+            return None
+        with open(self.checkpoint_filename(stage), "rb") as myfile:
+            checkpoint = pickle.load(myfile)
+            if checkpoint["fingerprint"] != fingerprint:
+                return None
+            if with_changes:
+                checkpoint["changes"] = pickle.load(myfile)
+        return checkpoint
+
+    def write_checkpoint(self, stage, fingerprint, state):
+        """
+        Saves what the stage set or changed in the state, together with the keys of the whole state,
+        the rest being restored from the checkpoints of the stages before it
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        checkpoint_filename = self.checkpoint_filename(stage)
+        header = {"fingerprint": fingerprint, "state_keys": sorted(state), "changed_keys": list(stage.state_keys)}
+        with open(checkpoint_filename + ".tmp", "wb") as myfile:
+            pickle.dump(header, myfile, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(
+                {key: state[key] for key in stage.state_keys if key in state}, myfile, protocol=pickle.HIGHEST_PROTOCOL
+            )
+        os.replace(checkpoint_filename + ".tmp", checkpoint_filename)
+
+    def restore_state(self, stages, fingerprints, stage_index):
+        """
+        Rebuilds the state saved after a stage from its checkpoint and the ones before it, newest first,
+        only unpickling the changes of a checkpoint if some of them are still part of the state.
+        Returns None unless all these checkpoints are valid
+        """
+        state = {}
+        missing_keys = None
+        for i in reversed(range(stage_index + 1)):
+            checkpoint = self.read_checkpoint(stages[i], fingerprints[i], with_changes=False)
+            if checkpoint is None:
+                return None
+            if missing_keys is None:
+                missing_keys = set(checkpoint["state_keys"])
+            if missing_keys.intersection(checkpoint["changed_keys"]):
+                changes = self.read_checkpoint(stages[i], fingerprints[i])["changes"]
+                for key in missing_keys.intersection(changes):
+                    state[key] = changes[key]
+                missing_keys.difference_update(changes)
+        if missing_keys:
+            return None
+        return state
+
+    def fingerprint_stages(self, stages):
+        """
+        Chains the inputs of every stage with the ones of all the stages before it
+        """
+        fingerprints = []
+        previous_fingerprint = json.dumps([BUILD_CHECKPOINT_VERSION, fingerprint_code()])
+        for stage in stages:
+            stage_inputs = [previous_fingerprint, stage.name, stage.fingerprint_inputs()]
+            previous_fingerprint = hashlib.sha1(json.dumps(stage_inputs).encode("utf-8")).hexdigest()
+            fingerprints.append(previous_fingerprint)
+        return fingerprints
+
+    def find_resume_point(self, stages, fingerprints):
+        """
+        Finds the last stage with a valid checkpoint whose outputs, as well as the outputs of all the stages
+        before it, are still there. Returns its index and the saved state
+        """
+        if not self.resume:
+            return -1, {}
+        i = len(stages) - 1
+        while i >= 0:
+            state = self.restore_state(stages, fingerprints, i)
+            if state is None:
+                i -= 1
+                continue
+            incomplete_index = next(
+                (
+                    j for j, stage in enumerate(stages[:i + 1])
+                    if stage.is_complete and not stage.is_complete(state)
+                ),
+                None
+            )
+            if incomplete_index is None:
+                return i, state
+            # The build has to restart from the earliest stage whose outputs are missing
+            i = incomplete_index - 1
+        return -1, {}
+
+    def run(self):
+        stages = self.stages
+        with dict_helpers.build_inflection_cache_path(self.inflection_cache_path) as self.build_cache_path:
+            fingerprints = self.fingerprint_stages(stages)
+            resume_index, state = self.find_resume_point(stages, fingerprints)
+            for i, stage in enumerate(stages):
+                if i <= resume_index:
+                    print("Stage {}: resumed from checkpoint".format(stage.name))
+                    self.stage_times[stage.name] = None
+                    continue
+                start_time = time.perf_counter()
+                previous_keys = set(state)
+                if self.profile:
+                    self.run_profiled_stage(stage, state)
+                else:
+                    stage.run(state)
+                self.stage_times[stage.name] = round(time.perf_counter() - start_time, 2)
+                print("Stage {}: {:.2f}s".format(stage.name, self.stage_times[stage.name]))
+                undeclared_keys = set(state) - previous_keys - set(stage.state_keys)
+                if undeclared_keys:
+                    raise Exception("Stage {} set undeclared state keys: {}".format(
+                        stage.name, ", ".join(sorted(undeclared_keys))
+                    ))
+                self.write_checkpoint(stage, fingerprints[i], state)
+        inflection_cache_counts = self.fetch_inflection_cache_counts(state)
+        if inflection_cache_counts:
+            print("Inflection cache hits: {hits}, misses: {misses}".format(**inflection_cache_counts))
+        if self.profile:
+            self.write_memory_profile()
+        if self.create_with_stats:
+            self.write_stats(state)
+        return state
+
+    def fetch_inflection_cache_counts(self, state):
+        """
+        The inflection cache hits and misses of this build, None when the inflect stage was resumed from a checkpoint
+        """
+        if self.inflection_cache_path and self.stage_times.get("inflect") is not None:
+            return state["inflection_cache_counts"]
+        return None
+
+    def run_profiled_stage(self, stage, state):
+        """
+        Runs a stage under cProfile and tracemalloc. The CPU profile is dumped in the standard pstats format
+        (readable by pstats, snakeviz etc.), the peak memory and top allocation sites are kept for the
+        memory report. Only this process is profiled, not the worker processes
+        """
+        profiler = cProfile.Profile()
+        tracemalloc.start()
+        profiler.enable()
+        try:
+            stage.run(state)
+        finally:
+            profiler.disable()
+            _, peak_memory = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        profiler.dump_stats(PROFILE_STAGE_FILENAME.format(dict_helpers.fetch_current_git_hash(), stage.name))
+        self.stage_memory[stage.name] = {
+            "peak_bytes": peak_memory,
+            "top_allocations": [
+                {"site": str(statistic.traceback[0]), "bytes": statistic.size, "count": statistic.count}
+                for statistic in snapshot.statistics("lineno")[:PROFILE_TOP_ALLOCATIONS]
+            ],
+        }
+        print("Stage {}: peak memory {:.1f} MB".format(stage.name, peak_memory / 2 ** 20))
+
+    def write_memory_profile(self):
+        with open(
+            PROFILE_MEMORY_FILENAME.format(dict_helpers.fetch_current_git_hash()), "w", encoding="utf-8"
+        ) as myfile:
+            myfile.write(json.dumps(self.stage_memory, indent=1))
+
+    def write_stats(self, state):
+        build_stats = dict(state["build_stats"])
+        dict_lines = build_stats.pop("dict_lines")
+        build_stats["stage_times"] = self.stage_times
+        build_stats["cross_references"] = state["link_counts"]
+        if self.profile:
+            build_stats["stage_peak_memory"] = {
+                stage_name: memory["peak_bytes"] for stage_name, memory in self.stage_memory.items()
+            }
+        if self.fetch_inflection_cache_counts(state):
+            build_stats["inflection_cache"] = self.fetch_inflection_cache_counts(state)
+        if "kindlegen" in state:
+            build_stats.update(state["kindlegen"])
+        if "stardict" in state:
+            build_stats.update(state["stardict"])
+        current_build_stats = {key: value for key, value in build_stats.items() if key in COMPARISON_STATS}
+        if "html_modes" in state:
+            build_stats["html_modes"] = dict(state["html_modes"], **{self.html_mode: current_build_stats})
+        if "headword_grouping" in state:
+            current_layout = "grouped" if self.group_headwords else "ungrouped"
+            build_stats["headword_grouping"] = dict(state["headword_grouping"], **{current_layout: current_build_stats})
+        dict_helpers.write_dict_stats(state["sorted_lemmas"], state["discarded_entries"], dict_lines, build_stats)
+
+
+class DictionaryVariantsBuild(DictionaryBuild):
+    """
+    Builds several variants of the dictionary in one run, each in its own directory under VARIANTS_DIR.
+    The corpus is loaded and the inflections are generated once for all variants, only the lemma
+    selection, rendering and kindlegen run per variant. The kindlegen runs are concurrent, the variants
+    are rendered one after the other though: rendering changes the working directory of the process and
+    already spreads each variant over chunk_jobs worker processes
+    """
+    keep_derived_only = True
+
+    def __init__(
+        self, variants, create_with_stats=False, make_mobi_dict=False, kindlegen_jobs=KINDLEGEN_JOBS,
+        checkpoint_dir=os.path.join(VARIANTS_DIR, BUILD_CHECKPOINT_DIR), **kwargs
+    ):
+        unsupported_options = [option for option in VARIANTS_UNSUPPORTED_OPTIONS if kwargs.get(option)]
+        if unsupported_options:
+            raise Exception("Options not supported when building variants: {}".format(", ".join(unsupported_options)))
+        super(DictionaryVariantsBuild, self).__init__(
+            create_with_stats, make_mobi_dict, checkpoint_dir=checkpoint_dir, **kwargs
+        )
+        self.variants = variants
+        self.kindlegen_jobs = kindlegen_jobs
+
+    @property
+    def stages(self):
+        """
+        The stages of a single build, with the sorting and linking done per variant by the select stage
+        """
+        stages = [
+            stage._replace(state_keys=()) if stage.name == "merge" else stage
+            for stage in super(DictionaryVariantsBuild, self).stages if stage.name not in ("sort", "link")
+        ]
+        stages.insert(2, BuildStage("select", lambda: [list(self.variants)], self.run_select, None, ("variants",)))
+        return stages
+
+    def variant_dir(self, variant):
+        return os.path.join(VARIANTS_DIR, variant.name)
+
+    def run_merge(self, state):
+        """
+        Nothing to do yet, the machine-translated corpus is streamed into every variant that includes it
+        by the select stage. The stage is kept so that its checkpoint tracks the machine-translated corpus
+        """
+
+    def run_select(self, state):
+        """
+        Builds the sorted and linked lemmas of every variant from the shared extraction. The lemmas are copied,
+        since their dictionary IDs and links differ from one variant to the other
+        """
+        lemmas = state.pop("lemmas")
+        state["variants"] = {}
+        for variant in self.variants:
+            print("Selecting lemmas for variant {}...".format(variant.name))
+            discarded_entries = dict(state["discarded_entries"])
+            if variant.derived_only:
+                discarded_entries[dict_helpers.DISCARDED_DERIVED_VARNAME + "_count"] = 0
+            variant_lemmas = [
+                copy.copy(lemma) for lemma in lemmas if variant.derived_only or not lemma.is_only_derived_form
+            ]
+            if variant.machine_translated:
+                variant_lemmas = dict_helpers.add_machine_translated_lemmas(
+                    dict_helpers.read_machine_translated_corpus(), variant_lemmas
+                )
+            sorted_lemmas, lemma_verb_dict = dict_helpers.sort_and_number_lemmas(variant_lemmas)
+            state["variants"][variant.name] = {
+                "sorted_lemmas": sorted_lemmas,
+                "lemma_verb_dict": lemma_verb_dict,
+                "link_counts": dict_helpers.link_lemmas(sorted_lemmas),
+                "discarded_entries": discarded_entries,
+            }
+
+    def run_inflect(self, state):
+        """
+        Generates the inflections of the headwords of all variants at once
+        """
+        state["iform_counts"], state["inflection_cache_counts"] = dict_helpers.count_derived_forms(
+            (
+                lemma.headword
+                for variant_state in state["variants"].values() for lemma in variant_state["sorted_lemmas"]
+            ),
+            self.build_cache_path,
+            self.jobs
+        )
+
+    def run_render(self, state):
+        cache_path = os.path.abspath(self.build_cache_path)
+        state["build_stats"] = {}
+        for variant in self.variants:
+            print("Rendering variant {}...".format(variant.name))
+            variant_state = state["variants"][variant.name]
+            os.makedirs(self.variant_dir(variant), exist_ok=True)
+            with working_directory(self.variant_dir(variant)):
+                state["build_stats"][variant.name] = dict_helpers.render_html_dictionary(
+                    variant_state["sorted_lemmas"], variant_state["lemma_verb_dict"], state["iform_counts"], True,
+                    cache_path, self.incremental, self.chunk_jobs, self.chunk_iform_budget, self.html_mode,
+                    self.group_headwords
+                )
+
+    def is_render_complete(self, state):
+        for variant in self.variants:
+            if not os.path.isdir(self.variant_dir(variant)):
+                return False
+            with working_directory(self.variant_dir(variant)):
+                if not super(DictionaryVariantsBuild, self).is_render_complete(
+                    {"build_stats": state["build_stats"][variant.name]}
+                ):
+                    return False
+        return True
+
+    def run_kindlegen(self, state):
+        """
+        Compiles the variants concurrently, with at most kindlegen_jobs kindlegen processes at a time.
+        Rendering is over by then, so no worker process gets forked while the kindlegen threads run
+        """
+        kindlegen_path = os.path.abspath(dict_helpers.KINDLEGEN_PATH)
+        with ThreadPoolExecutor(self.kindlegen_jobs) as executor:
+            kindlegen_runs = {}
+            for variant in self.variants:
+                if os.path.exists(DICTIONARY_COVER_FILENAME):
+                    shutil.copy(DICTIONARY_COVER_FILENAME, self.variant_dir(variant))
+                kindlegen_runs[variant.name] = executor.submit(
+                    dict_helpers.run_kindlegen, kindlegen_path=kindlegen_path, working_dir=self.variant_dir(variant)
+                )
+        state["kindlegen"] = {
+            variant_name: kindlegen_run.result() for variant_name, kindlegen_run in kindlegen_runs.items()
+        }
+
+    def is_kindlegen_complete(self, state):
+        for variant in self.variants:
+            if not os.path.isdir(self.variant_dir(variant)):
+                return False
+            with working_directory(self.variant_dir(variant)):
+                if not super(DictionaryVariantsBuild, self).is_kindlegen_complete(state):
+                    return False
+        return True
+
+    def write_stats(self, state):
+        """
+        Writes the stats of every variant to its own directory
+        """
+        for variant in self.variants:
+            variant_state = state["variants"][variant.name]
+            build_stats = dict(state["build_stats"][variant.name])
+            dict_lines = build_stats.pop("dict_lines")
+            build_stats["variant"] = variant._asdict()
+            build_stats["stage_times"] = self.stage_times
+            build_stats["cross_references"] = variant_state["link_counts"]
+            if self.fetch_inflection_cache_counts(state):
+                build_stats["inflection_cache"] = self.fetch_inflection_cache_counts(state)
+            build_stats.update(state.get("kindlegen", {}).get(variant.name, {}))
+            with working_directory(self.variant_dir(variant)):
+                dict_helpers.write_dict_stats(
+                    variant_state["sorted_lemmas"], variant_state["discarded_entries"], dict_lines, build_stats
+                )
@@ -0,0 +1,165 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+
+from tqdm import tqdm
+
+from dict_helpers import CORPUS_FILENAME, CORPUS_HEADWORD_STR, CORPUS_MORPH_CAT_STR, fingerprint_file
+
+# CONSTANTS
+CORPUS_INDEX_FILENAME = CORPUS_FILENAME + ".idx"
+CORPUS_INDEX_MAGIC = b"PLIX"
+CORPUS_INDEX_VERSION = 2
+# Magic, version, corpus fingerprint (to detect a stale index), number of records
+CORPUS_INDEX_HEADER = struct.Struct("<4sI20sI")
+# Key offset and length within the key blob, entry offset and length within the corpus
+CORPUS_INDEX_RECORD = struct.Struct("<IHQI")
+CORPUS_INDEX_KEY_SEPARATOR = b"\t"
+
+
+def build_index_key(headword, pos=""):
+    return headword.encode("utf-8") + CORPUS_INDEX_KEY_SEPARATOR + pos.encode("utf-8")
+
+
+def build_corpus_index(corpus_filename=CORPUS_FILENAME, index_filename=CORPUS_INDEX_FILENAME):
+    """
+    Scans the corpus once and writes a compact index of the byte offset of every entry, as a table of
+    fixed-size records sorted by headword and POS, followed by the keys themselves
+    """
+    entries = []
+    with open(corpus_filename, "rb") as myfile, tqdm(
+        total=os.path.getsize(corpus_filename), unit="B", unit_scale=True, desc="Indexing corpus..."
+    ) as progress_bar:
+        offset = 0
+        for line in myfile:
+            progress_bar.update(len(line))
+            if line.strip():
+                entry = json.loads(line)
+                key = build_index_key(entry[CORPUS_HEADWORD_STR], entry.get(CORPUS_MORPH_CAT_STR, ""))
+                entries.append((key, offset, len(line.rstrip(b"\r\n"))))
+            offset += len(line)
+    entries.sort()
+
+    corpus_fingerprint = bytes.fromhex(fingerprint_file(corpus_filename))
+    key_offset = 0
+    with open(index_filename + ".tmp", "wb") as myfile:
+        myfile.write(CORPUS_INDEX_HEADER.pack(
+            CORPUS_INDEX_MAGIC, CORPUS_INDEX_VERSION, corpus_fingerprint, len(entries)
+        ))
+        for key, entry_offset, entry_length in entries:
+            myfile.write(CORPUS_INDEX_RECORD.pack(key_offset, len(key), entry_offset, entry_length))
+            key_offset += len(key)
+        for key, _, _ in entries:
+            myfile.write(key)
+    os.replace(index_filename + ".tmp", index_filename)
+    return len(entries)
+
+
+def check_corpus_index_is_current(corpus_filename=CORPUS_FILENAME, index_filename=CORPUS_INDEX_FILENAME):
+    if not os.path.exists(index_filename):
+        return False
+    with open(index_filename, "rb") as myfile:
+        header = myfile.read(CORPUS_INDEX_HEADER.size)
+    if len(header) < CORPUS_INDEX_HEADER.size:
+        return False
+    magic, version, corpus_fingerprint, _ = CORPUS_INDEX_HEADER.unpack(header)
+    return (
+        magic == CORPUS_INDEX_MAGIC and version == CORPUS_INDEX_VERSION
+        and corpus_fingerprint.hex() == fingerprint_file(corpus_filename)
+    )
+
+
+class CorpusIndex(object):
+    """
+    Random access to corpus entries by headword (and optionally POS). Both the index and the corpus
+    are memory-mapped, lookups are a binary search over the sorted index records, so only the pages
+    holding the requested entries are ever read
+    """
+    def __init__(self, corpus_filename=CORPUS_FILENAME, index_filename=CORPUS_INDEX_FILENAME):
+        super(CorpusIndex, self).__init__()
+        if not check_corpus_index_is_current(corpus_filename, index_filename):
+            raise Exception("{} is missing or out of date with {}, rebuild it".format(index_filename, corpus_filename))
+        with open(index_filename, "rb") as myfile:
+            self.index_map = mmap.mmap(myfile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.records_count = CORPUS_INDEX_HEADER.unpack_from(self.index_map)[-1]
+        self.keys_start = CORPUS_INDEX_HEADER.size + self.records_count * CORPUS_INDEX_RECORD.size
+        with open(corpus_filename, "rb") as myfile:
+            self.corpus_map = mmap.mmap(myfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.records_count
+
+    def close(self):
+        self.index_map.close()
+        self.corpus_map.close()
+
+    def read_record(self, position):
+        key_offset, key_length, entry_offset, entry_length = CORPUS_INDEX_RECORD.unpack_from(
+            self.index_map, CORPUS_INDEX_HEADER.size + position * CORPUS_INDEX_RECORD.size
+        )
+        key_start = self.keys_start + key_offset
+        return self.index_map[key_start:key_start + key_length], entry_offset, entry_length
+
+    def find_offsets(self, headword, pos=None):
+        """
+        Returns the (offset, length) of all the corpus entries for the headword, in the given POS if any
+        """
+        key_prefix = build_index_key(headword, pos or "")
+        low = 0
+        high = self.records_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.read_record(middle)[0] < key_prefix:
+                low = middle + 1
+            else:
+                high = middle
+        offsets = []
+        for position in range(low, self.records_count):
+            key, entry_offset, entry_length = self.read_record(position)
+            # Without a POS, the prefix "headword<TAB>" matches the entries in every POS
+            matches = key == key_prefix if pos else key.startswith(key_prefix)
+            if not matches:
+                break
+            offsets.append((entry_offset, entry_length))
+        return offsets
+
+    def find(self, headword, pos=None):
+        """
+        Returns the decoded corpus entries for the headword, in the given POS if any
+        """
+        return [
+            json.loads(self.corpus_map[entry_offset:entry_offset + entry_length])
+            for entry_offset, entry_length in self.find_offsets(headword, pos)
+        ]
+
+
+def open_corpus_index(corpus_filename=CORPUS_FILENAME, index_filename=CORPUS_INDEX_FILENAME):
+    """
+    Opens the corpus index, (re)building it first if it is missing or out of date with the corpus
+    """
+    if not check_corpus_index_is_current(corpus_filename, index_filename):
+        build_corpus_index(corpus_filename, index_filename)
+    return CorpusIndex(corpus_filename, index_filename)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Looks up raw corpus entries by headword through the offset index")
+    parser.add_argument("headwords", nargs="*", help="headwords to look up")
+    parser.add_argument("--pos", help="only return entries with this part of speech")
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the index even if it is up to date")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        build_corpus_index()
+    with open_corpus_index() as corpus_index:
+        for headword in args.headwords:
+            for entry in corpus_index.find(headword, args.pos):
+                print(json.dumps(entry, ensure_ascii=False, indent=1))
@@ -0,0 +1,120 @@
+import argparse
+from collections import Counter
+import json
+import os
+import re
+
+import dict_helpers
+from lookup_service import load_dictionary_lookup, load_dictionary_lookup_from_snapshot
+
+# CONSTANTS
+COVERAGE_FILENAME = "coverage_{}_{}.json"
+# Runs of letters, optionally joined by hyphens (f.e. "biało-czerwony")
+TOKEN_PATTERN = re.compile(r"[^\W\d_]+(?:-[^\W\d_]+)*")
+COVERAGE_REPORT_TOP_WORDS = 100
+
+
+def build_form_index(dictionary_lookup):
+    """
+    Maps every headword and inflected form to the headwords it resolves to, in dictionary order
+    """
+    form_index = {}
+    for headword in dictionary_lookup.lemmas_by_headword:
+        form_index[headword] = [headword]
+    for form, headwords in dictionary_lookup.headwords_by_iform.items():
+        resolved = form_index.setdefault(form, [])
+        for headword in headwords:
+            if headword not in resolved:
+                resolved.append(headword)
+    return {form: tuple(headwords) for form, headwords in form_index.items()}
+
+
+def resolve_token(token, form_index):
+    """
+    Looks a token up as written, then lowercased (f.e. at the start of a sentence)
+    """
+    headwords = form_index.get(token)
+    if headwords is None and not token.islower():
+        headwords = form_index.get(token.lower())
+    return headwords or ()
+
+
+def analyze_text_coverage(text, form_index, top_words=COVERAGE_REPORT_TOP_WORDS):
+    """
+    Tokenizes the text and resolves every distinct token once against the form index.
+    Reports coverage over all tokens and over distinct ones, the most frequent missing words and
+    the most frequent forms that resolve to more than one headword
+    """
+    token_counts = Counter(TOKEN_PATTERN.findall(text))
+    tokens_count = sum(token_counts.values())
+    missing = Counter()
+    ambiguous = Counter()
+    ambiguous_headwords = {}
+    for token, count in token_counts.items():
+        headwords = resolve_token(token, form_index)
+        if not headwords:
+            missing[token] = count
+        elif len(headwords) > 1:
+            ambiguous[token] = count
+            ambiguous_headwords[token] = headwords
+
+    def percentage(part, total):
+        return round(100 * part / total, 2) if total else 0.0
+
+    return {
+        "tokens_count": tokens_count,
+        "unique_tokens_count": len(token_counts),
+        "covered_tokens_percentage": percentage(tokens_count - sum(missing.values()), tokens_count),
+        "covered_unique_tokens_percentage": percentage(len(token_counts) - len(missing), len(token_counts)),
+        "ambiguous_tokens_percentage": percentage(sum(ambiguous.values()), tokens_count),
+        "missing_count": len(missing),
+        "ambiguous_count": len(ambiguous),
+        "top_missing": [{"word": word, "count": count} for word, count in missing.most_common(top_words)],
+        "top_ambiguous": [
+            {"word": word, "count": count, "headwords": list(ambiguous_headwords[word])}
+            for word, count in ambiguous.most_common(top_words)
+        ],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures how much of a plain text the dictionary can look up")
+    parser.add_argument("texts", nargs="+", help="UTF-8 plain text files to analyze")
+    parser.add_argument(
+        "--jobs", type=int, default=1,
+        help="number of worker processes used to generate inflected forms"
+    )
+    parser.add_argument(
+        "--inflection-cache", default=dict_helpers.INFLECTION_CACHE_FILENAME,
+        help="SQLite file caching generated inflections between builds"
+    )
+    parser.add_argument(
+        "--top-words", type=int, default=COVERAGE_REPORT_TOP_WORDS,
+        help="number of missing and ambiguous words listed in the report"
+    )
+    parser.add_argument(
+        "--no-snapshot", action="store_true",
+        help="reprocess the corpora instead of loading the lemma snapshot"
+    )
+    args = parser.parse_args()
+
+    if args.no_snapshot:
+        dictionary_lookup = load_dictionary_lookup(args.inflection_cache, args.jobs)
+    else:
+        dictionary_lookup = load_dictionary_lookup_from_snapshot(
+            inflection_cache_path=args.inflection_cache, jobs=args.jobs
+        )
+    form_index = build_form_index(dictionary_lookup)
+    git_hash = dict_helpers.fetch_current_git_hash()
+    for text_filename in args.texts:
+        with open(text_filename, "r", encoding="utf-8") as myfile:
+            coverage = analyze_text_coverage(myfile.read(), form_index, args.top_words)
+        output_filename = COVERAGE_FILENAME.format(os.path.splitext(os.path.basename(text_filename))[0], git_hash)
+        with open(output_filename, "w", encoding="utf-8") as myfile:
+            myfile.write(json.dumps(coverage, ensure_ascii=False, indent=1))
+        print("{}: {}% of tokens, {}% of distinct tokens covered, report written to {}".format(
+            text_filename,
+            coverage["covered_tokens_percentage"],
+            coverage["covered_unique_tokens_percentage"],
+            output_filename
+        ))
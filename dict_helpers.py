@@ -1,17 +1,38 @@
 from collections import defaultdict, namedtuple
-import functools
+import contextlib
+import multiprocessing
 import morfeusz2
+import gzip
+import hashlib
+import itertools
 import json
+import os
+import re
+import sqlite3
+import unicodedata
 from tqdm import tqdm
 import subprocess
+import tempfile
+import time
+import traceback
 
 # CONSTANTS
 CORPUS_FILENAME = "kaikki.org-dictionary-Polish.json"
-MACHINE_TRANSLATED_CORPUS_FILENAME = "machine_translated_corpus.json"
+MACHINE_TRANSLATED_CORPUS_FILENAME = "machine_translated_corpus.jsonl"
+# Single JSON array format the machine-translated corpus used to be distributed in
+LEGACY_MACHINE_TRANSLATED_CORPUS_FILENAME = "machine_translated_corpus.json"
+JSON_STREAM_READ_SIZE = 1024 * 1024
+# Bytes hashed from both the start and the end of a file to fingerprint its content
+FILE_FINGERPRINT_SAMPLE_SIZE = 1024 * 1024
 DICTIONARY_HTML_FILENAME = "PL_EN_dict{}.html"
+DICTIONARY_OPF_FILENAME = "PL_EN_dict.opf"
+KINDLEGEN_PATH = "./kindlegen"
+# Reference locale whose collation polish_sort_key() reproduces without needing it installed
 LOCALE_NAME = "pl_PL.utf8"
 STATS_FILENAME = "dictionary_stats_{}.json"
-DISCARDED_ENTRIES_FILENAME = "discarded_entries_{}.json"
+INFLECTION_CACHE_FILENAME = "inflection_cache.sqlite"
+DISCARDED_ENTRIES_FILENAME = "discarded_entries_{}.jsonl.gz"
+BUILD_MANIFEST_FILENAME = "build_manifest.json"
 DISCARDED_INVALID_POS_VARNAME = "excluded_pos"
 DISCARDED_DERIVED_VARNAME = "entry_is_only_derived"
 CORPUS_MORPH_CAT_VERB_STR = "verb"
@@ -57,6 +78,40 @@ MORFEUSZ_BAD_QUALIFS = [
 
 MORFEUSZ_UNKNOWN_WORD_TAG = "ign"
 
+# Only generation is used, leaving analysis out makes loading the dictionary an order of magnitude faster
+MORFEUSZ_OPTIONS = {"expand_tags": False, "praet": "composite", "analyse": False}
+
+Definition = namedtuple("Definition", ["definition", "derived", "derived_from"])
+# A link from an entry to another headword, as found in the corpus
+CrossReference = namedtuple("CrossReference", ["kind", "headword", "tag"])
+# A cross-reference pointing at a specific entry, target_id is empty if none was found
+ResolvedLink = namedtuple("ResolvedLink", ["kind", "tag", "headword", "target_id"])
+CROSS_REFERENCE_ASPECT = "aspect"
+CROSS_REFERENCE_DERIVED_FROM = "derived_from"
+# Corpus form tags that link an entry to another headword
+CROSS_REFERENCE_FORM_TAGS = ("diminutive", "augmentative")
+# All the markup an HTML dictionary chunk is made of, see READABLE_HTML_TEMPLATES and COMPACT_HTML_TEMPLATES
+HtmlTemplates = namedtuple(
+    "HtmlTemplates",
+    [
+        "body_header", "body_footer", "entry_separator", "entry", "inflection", "definition", "verb_aspect",
+        "cross_reference", "grouped_entry", "entry_section",
+    ]
+)
+HTML_TEMPLATE_MODE_READABLE = "readable"
+HTML_TEMPLATE_MODE_COMPACT = "compact"
+# What kindlegen gets unless asked otherwise, whichever the entry point
+HTML_TEMPLATE_MODE_DEFAULT = HTML_TEMPLATE_MODE_COMPACT
+CROSS_REFERENCE_LABELS = {
+    "diminutive": "diminutive form",
+    "augmentative": "augmentative form",
+    CROSS_REFERENCE_DERIVED_FROM: "form of",
+}
+
+GeneratedEntry = namedtuple(
+    "GeneratedEntry", ["generated_form", "base_form", "tags", "frequency", "qualifiers"]
+)
+
 CORPUS_INFLECTED_FORM_STR = "form_of"
 CORPUS_MORPH_CAT_STR = "pos"
 CORPUS_HEADWORD_STR = "word"
@@ -69,8 +124,85 @@ SGJP_MORPH_CATEGORY_MAPPING = {
     "cz.": "verb",
     "przym.": "adj"
 }
+DICTIONARY_BODY_TEMPLATE = """
+    <html xmlns:math="http://exslt.org/math" xmlns:svg="http://www.w3.org/2000/svg"
+    xmlns:tl="https://kindlegen.s3.amazonaws.com/AmazonKindlePublishingGuidelines.pdf"
+    xmlns:saxon="http://saxon.sf.net/" xmlns:xs="http://www.w3.org/2001/XMLSchema"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xmlns:cx="https://kindlegen.s3.amazonaws.com/AmazonKindlePublishingGuidelines.pdf"
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:mbp="https://kindlegen.s3.amazonaws.com/AmazonKindlePublishingGuidelines.pdf"
+    xmlns:mmc="https://kindlegen.s3.amazonaws.com/AmazonKindlePublishingGuidelines.pdf"
+    xmlns:idx="https://kindlegen.s3.amazonaws.com/AmazonKindlePublishingGuidelines.pdf">
+    <head><meta http-equiv="Content-Type" content="text/html; charset=utf-8"></head>
+    <body>
+    <mbp:frameset>{dict_body}</mbp:frameset>
+    </body>
+    """
+
+DICTIONARY_OPF_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="Polski-English-Wiktionary-v0">
+
+<metadata xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:opf="http://www.idpf.org/2007/opf">
+    <!-- Title and language. -->
+    <dc:title>Polski → English (v. 2.1)</dc:title>
+    <dc:language>pl</dc:language>
+</metadata>
+
+<manifest>
+    <!-- Specify the names of the HTML file(s) and the cover image (JPEG or GIF). -->
+{manifest_items}
+    <item id="DictCover" media-type="image/jpeg" href="PL_EN_dict.jpeg"/>
+</manifest>
+
+<!-- linear reading order -->
+<spine toc="My_Table_of_Contents">
+{spine_items}
+</spine>
+
+<!-- Necessary for creating dictionaries.
+https://s3.amazonaws.com/kindlegen/AmazonKindlePublishingGuidelines.pdf#page=71 -->
+<x-metadata>
+    <!-- Specify the dictionary I/O languages. -->
+    <DictionaryInLanguage>pl</DictionaryInLanguage>
+    <DictionaryOutLanguage>en</DictionaryOutLanguage>
+    <DefaultLookupIndex>Polish</DefaultLookupIndex>
+</x-metadata>
+
+</package>
+"""
+DICTIONARY_OPF_MANIFEST_ITEM_TEMPLATE = \
+    """    <item id="DictBody{chunk_no}" media-type="application/xhtml+xml" href="{filename}"></item>"""
+DICTIONARY_OPF_SPINE_ITEM_TEMPLATE = """    <itemref idref="DictBody{chunk_no}"/>"""
+
+DICTIONARY_BODY_HEADER, DICTIONARY_BODY_FOOTER = DICTIONARY_BODY_TEMPLATE.split("{dict_body}")
+DICTIONARY_ENTRY_SEPARATOR = "<hr>"
+
+POLISH_ALPHABET = "aąbcćdeęfghijklłmnńoópqrsśtuvwxyzźż"
+COLLATION_DIGIT_WEIGHT_START = 0x30
+COLLATION_LETTER_WEIGHT_START = 0x100
+COLLATION_OTHER_WEIGHT_START = 0x1000
+COLLATION_NO_ACCENT = "\x01"
+COLLATION_LOWER_CASE = "\x01"
+COLLATION_UPPER_CASE = "\x02"
+
 MACHINE_TRANSLATED_MESSAGE = "<div><i>Translation generated with Google Cloud Translate API</i></div>"
 SAFE_DICT_CHUNK = 10000
+# Inflected forms (plus one per entry) per HTML chunk, keeps chunk sizes even whatever the mix of
+# verbs with large inflection tables and nouns with small ones
+DICT_CHUNK_IFORM_BUDGET = 150000
+HTML_WRITE_BUFFER_SIZE = 1024 * 1024
+# Per-process state of the chunk rendering workers, see init_chunk_worker()
+CHUNK_WORKER_STATE = {}
+# The Morfeusz instance of this process, only created on first use by get_morfeusz()
+MORFEUSZ_STATE = {"options": dict(MORFEUSZ_OPTIONS), "instance": None}
+INFLECTION_WORKER_BATCH = 64
+# Bump whenever generate_headword_derived_forms() starts producing different output
+INFLECTION_CACHE_VERSION = 1
+INFLECTION_CACHE_QUERY_BATCH = 500
+INFLECTION_CACHE_TIMEOUT = 300
+# Bump whenever the HTML rendering code changes in a way the templates don't reflect
+BUILD_MANIFEST_VERSION = 1
 
 
 def chunks(lst, n):
@@ -79,48 +211,121 @@ def chunks(lst, n):
         yield lst[i:i + n]
 
 
+def fetch_collation_weights(char):
+    """
+    Computes the (primary, secondary, tertiary) collation weights of a single character,
+    modelled on glibc's pl_PL collation:
+    * primary: digits, then the Polish alphabet (with ą, ć, ę, ł, ń, ó, ś, ź, ż as separate letters),
+      then letters from other scripts; spaces and punctuation are ignored
+    * secondary: accents on letters outside the Polish alphabet (é sorts with e)
+    * tertiary: case, lower case before upper case
+    """
+    lower_char = char.lower()
+    case_weight = COLLATION_LOWER_CASE if char == lower_char else COLLATION_UPPER_CASE
+    if lower_char in POLISH_ALPHABET and len(lower_char) == 1:
+        primary = chr(COLLATION_LETTER_WEIGHT_START + POLISH_ALPHABET.index(lower_char))
+        return primary, COLLATION_NO_ACCENT, case_weight
+    if char.isdigit():
+        primary = chr(COLLATION_DIGIT_WEIGHT_START + unicodedata.digit(char, 0))
+        return primary, COLLATION_NO_ACCENT, COLLATION_LOWER_CASE
+    decomposed = unicodedata.normalize("NFD", lower_char)
+    if len(decomposed) > 1 and decomposed[0] in POLISH_ALPHABET:
+        primary, _, _ = fetch_collation_weights(decomposed[0])
+        return primary, decomposed[1:], case_weight
+    if char.isalnum():
+        primary = "".join(
+            chr(min(COLLATION_OTHER_WEIGHT_START + ord(lower), 0x10FFFF)) for lower in lower_char
+        )
+        return primary, COLLATION_NO_ACCENT, case_weight
+    return "", "", ""
+
+
+class CollationLevelTable(dict):
+    """
+    str.translate() table lazily mapping characters to their weights at a single collation level
+    """
+    def __init__(self, level):
+        super(CollationLevelTable, self).__init__()
+        self.level = level
+
+    def __missing__(self, codepoint):
+        weight = fetch_collation_weights(chr(codepoint))[self.level]
+        self[codepoint] = weight
+        return weight
+
+
+COLLATION_TABLES = [CollationLevelTable(level) for level in range(3)]
+
+
+def polish_sort_key(word):
+    """
+    Precomputed sort key ordering words as strcoll() does under the Polish locale:
+    compares letters first, then accents, then case, then the raw string as a tie-breaker
+    """
+    return (
+        word.translate(COLLATION_TABLES[0]),
+        word.translate(COLLATION_TABLES[1]),
+        word.translate(COLLATION_TABLES[2]),
+        word,
+    )
+
+
 def sort_headwords(word_list):
     """
     Make sure a list of words is put in proper ascending
-    alphabetical order based on specified locale
+    alphabetical order based on Polish collation
     """
-    import locale
-    locale.setlocale(locale.LC_COLLATE, LOCALE_NAME)
-    return sorted(word_list, key=functools.cmp_to_key(locale.strcoll))
+    return sorted(word_list, key=polish_sort_key)
 
 
 def sort_lemmas(lemmas):
     """
-    An ugly way of ensuring sorting of Lemma objects according to locale
+    Sorts Lemma objects by headword according to Polish collation, one key per lemma
     """
-    import locale
-    locale.setlocale(locale.LC_COLLATE, LOCALE_NAME)
-    return sorted(lemmas, key=lambda lemma: functools.cmp_to_key(locale.strcoll)(lemma.headword))
+    return sorted(lemmas, key=lambda lemma: polish_sort_key(lemma.headword))
 
 
-def load_corpus():
+def load_corpus(filename=CORPUS_FILENAME):
     """
-    Loads the Kaikki Wiktionary extract into JSON object
+    Lazily loads the Kaikki Wiktionary extract, yielding one decoded JSON entry per line.
+    The file is never held in memory as a whole, progress is reported in bytes read
     """
-    corpus_data = []
-    with open(CORPUS_FILENAME, encoding="utf-8") as myfile:
-        for line in tqdm(myfile.readlines(), desc="Loading corpus..."):
-            json_version = json.loads(line)
-            corpus_data.append(json_version)
-    return corpus_data
+    with open(filename, "rb") as myfile, tqdm(
+        total=os.path.getsize(filename), unit="B", unit_scale=True, desc="Loading corpus..."
+    ) as progress_bar:
+        for line in myfile:
+            progress_bar.update(len(line))
+            if not line.strip():
+                continue
+            yield json.loads(line)
 
 
 class Lemma(object):
-    """Class encapsulating all required data for a dictionary entry"""
-    def __init__(self, headword, morph_cat, meanings, dictionary_id, raw_corpus_entry, machine_translated=""):
+    """
+    Class encapsulating all required data for a dictionary entry. Only the fields used for
+    rendering are kept, so that hundreds of thousands of instances stay cheap to hold in memory
+    """
+    __slots__ = (
+        "headword", "morph_cat", "definitions", "dictionary_id", "aspect_form", "aspect_tag", "machine_translated",
+        "cross_references", "links"
+    )
+
+    def __init__(
+        self, headword, morph_cat, meanings, dictionary_id, aspect_form="", aspect_tag="", machine_translated="",
+        cross_references=()
+    ):
         super(Lemma, self).__init__()
         self.headword = headword
         self.morph_cat = morph_cat
-        self.meanings = meanings
-        self.raw_corpus_entry = raw_corpus_entry
+        self.definitions = extract_definitions(meanings)
         self.dictionary_id = dictionary_id
-        self.inflected_forms = []
+        self.aspect_form = aspect_form
+        self.aspect_tag = aspect_tag
         self.machine_translated = machine_translated
+        # Diminutives, augmentatives and base forms, the other aspect is kept separately above
+        self.cross_references = cross_references
+        # Set by link_lemmas(), None until the lemma has been linked
+        self.links = None
 
     DICTIONARY_GENERIC_ENTRY_TEMPLATE = """
     <idx:entry name="Polish" scriptable="yes" spell="yes">
@@ -130,7 +335,7 @@ class Lemma(object):
     </idx:orth>
     <div><i>{morph}</i></div>
     <div><ol>{definitions}</ol></div>
-    {verb_aspect}
+    {cross_references}
     {machine_translated}
     </idx:short>
     </idx:entry>
@@ -148,88 +353,46 @@ class Lemma(object):
     <div>{aspect_tag} form: <a href="{other_id}">{other_aspect_headword}</a></div>
     """
 
-    MORFEUSZ_OBJ = morfeusz2.Morfeusz(expand_tags=False, praet='composite')
+    DICTIONARY_CROSS_REFERENCE_ENTRY_TEMPLATE = """
+    <div>{label}: <a href="{other_id}">{other_headword}</a></div>
+    """
 
-    @property
-    def definitions(self):
-        definitions = []
-        for meaning in self.meanings:
-            definition = meaning.get(CORPUS_DEFINITION_STR, [])
-            # TODO: check what exactly appears here
-            if not definition:
-                continue
-            form_of = meaning.get(CORPUS_INFLECTED_FORM_STR, [])
-            definitions.append(
-                {
-                    "definition": definition[0],
-                    "derived": bool(form_of),
-                    "derived_from": (form_of[0] if form_of else form_of)
-                }
-            )
-        return definitions
+    # All the lemmas of a headword in a single entry, see generate_headword_html_entry()
+    DICTIONARY_GROUPED_ENTRY_TEMPLATE = """
+    <idx:entry name="Polish" scriptable="yes" spell="yes">
+    <idx:short>
+    <idx:orth><b>{word}</b>
+    {inflection_entries}
+    </idx:orth>
+    {sections}
+    </idx:short>
+    </idx:entry>
+    """
+
+    DICTIONARY_ENTRY_SECTION_TEMPLATE = """
+    <a id="{entry_id}"></a>
+    <div><i>{morph}</i></div>
+    <div><ol>{definitions}</ol></div>
+    {cross_references}
+    {machine_translated}
+    """
 
     @property
     def is_only_derived_form(self):
-        return all([definition["derived"] for definition in self.definitions])
+        return all(definition.derived for definition in self.definitions)
 
     def generate_derived_forms(self):
-        derived_words_check = set()
-        derived_words = []
-
-        if len(self.headword.split(" ")) > 1:
-            # Only lemmas made by a single word for now
-            return []
-
-        GeneratedEntry = namedtuple(
-            "GeneratedEntry", ["generated_form", "base_form", "tags", "frequency", "qualifiers"]
-        )
-
-        generated = self.MORFEUSZ_OBJ.generate(self.headword)
-        generated_named = [GeneratedEntry(*element) for element in generated]
-
-        for generated_word in generated_named:
-            keep = True
-            split_tags = generated_word.tags.split(":")
-
-            for tag in split_tags:
-                # Skip anything that Morfeusz doesn't recognise - we can reuse it later to refine
-                # the head words
-                if tag == MORFEUSZ_UNKNOWN_WORD_TAG:
-                    keep = False
-                    continue
-                # Skip tags for abbreviation, non-accepted forms, etc.
-                if tag in MORFEUSZ_TAGS_TO_IGNORE:
-                    keep = False
-                    continue
-
-            # Skip certain qualifiers that don't lead to useful derived forms
-            for qualif in MORFEUSZ_BAD_QUALIFS:
-                if qualif in generated_word.qualifiers:
-                    keep = False
-                    continue
-
-            # Add anything that made it to this point to the inflected entries,
-            # making sure only unique values are added as Morfeusz has a tendency to
-            # generate tons of duplicates
-            if generated_word.generated_form not in derived_words_check and keep:
-                # There seems to be something non-deterministic or environment- or version-dependent
-                # in the way in which these 'm' tags are produced so getting rid of them
-                tags_to_keep = [tag for tag in split_tags if tag not in ("m1", "m2", "m3")]
-                tags_to_keep_formatted = ":".join(tags_to_keep)
-                derived_words_check.add(generated_word.generated_form)
-                derived_words.append(
-                    {"derived_form": generated_word.generated_form, "tags": tags_to_keep_formatted}
-                )
+        return generate_headword_derived_forms(self.headword)
 
-        return sorted(derived_words, key=lambda x: x["derived_form"])
-
-    def generate_derived_html_iforms(self):
+    def generate_derived_html_iforms(self, derived_forms=None, templates=None):
+        templates = templates or READABLE_HTML_TEMPLATES
         derived_iforms = []
-        derived_forms = self.generate_derived_forms()
+        if derived_forms is None:
+            derived_forms = self.generate_derived_forms()
         if derived_forms:
             derived_iforms.append("<idx:infl>")
             derived_iforms.extend([
-                self.DICTIONARY_ENTRY_INFLECTION_TEMPLATE.format(
+                templates.inflection.format(
                     word=derived_form["derived_form"],
                     inflection_type=derived_form["tags"]
                 ) for derived_form in derived_forms
@@ -237,53 +400,84 @@ class Lemma(object):
             derived_iforms.append("</idx:infl>")
         return derived_iforms
 
-    def generate_definitions_html_list(self):
+    def generate_definitions_html_list(self, templates=None):
+        templates = templates or READABLE_HTML_TEMPLATES
         definitions_html_list = []
         for definition in self.definitions:
             definitions_html_list.append(
-                self.DICTIONARY_DEFINITIONS_ENTRY_TEMPLATE.format(definition=definition["definition"])
+                templates.definition.format(definition=definition.definition)
             )
         return definitions_html_list
 
     def find_alternative_aspect_data(self):
-        if self.morph_cat == CORPUS_MORPH_CAT_VERB_STR:
-            other_aspect = self.raw_corpus_entry.get("forms", [])
-            if other_aspect:
-                form = other_aspect[0].get("form")
-                tag = other_aspect[0].get("tags", [])
-                if form and tag:
-                    tag = tag[0]
-                    return form, tag
-        return "", ""
+        return self.aspect_form, self.aspect_tag
 
     def find_alternative_aspect(self, lemma_verb_dict={}):
         alternative_aspect_id = ""
         form, tag = self.find_alternative_aspect_data()
         if form and tag:
-            alternative_aspect_lemma = lemma_verb_dict.get(form)
-            if alternative_aspect_lemma:
-                alternative_aspect_id = alternative_aspect_lemma.dictionary_id
+            alternative_aspect_id = lemma_verb_dict.get(form, "")
         return form, tag, alternative_aspect_id
 
-    def generate_lemma_html_entry(self, lemma_verb_dict={}):
-        verb_aspect_str = ""
-        form, tag, alternative_aspect_id = self.find_alternative_aspect(
-            lemma_verb_dict
-        )
+    def iterate_cross_references(self):
+        if self.aspect_form and self.aspect_tag:
+            yield CrossReference(CROSS_REFERENCE_ASPECT, self.aspect_form, self.aspect_tag)
+        yield from self.cross_references
+
+    def find_links(self, lemma_verb_dict={}):
+        """
+        Returns the resolved cross-references of the lemma. Lemmas that didn't go through
+        link_lemmas() only get their other aspect resolved, through the verb lookup
+        """
+        if self.links is not None:
+            return self.links
+        form, tag, alternative_aspect_id = self.find_alternative_aspect(lemma_verb_dict)
         if form and tag:
-            verb_aspect_str = self.DICTIONARY_VERB_ASPECT_ENTRY_TEMPLATE.format(
-                aspect_tag=tag,
-                other_id=alternative_aspect_id,
-                other_aspect_headword=form,
-            )
+            return (ResolvedLink(CROSS_REFERENCE_ASPECT, tag, form, alternative_aspect_id),)
+        return ()
+
+    def generate_cross_references_html(self, lemma_verb_dict={}, templates=None):
+        templates = templates or READABLE_HTML_TEMPLATES
+        cross_references_html = []
+        for link in self.find_links(lemma_verb_dict):
+            if link.kind == CROSS_REFERENCE_ASPECT:
+                cross_references_html.append(
+                    templates.verb_aspect.format(
+                        aspect_tag=link.tag,
+                        other_id=link.target_id,
+                        other_aspect_headword=link.headword,
+                    )
+                )
+            # Other links are only shown if they lead somewhere
+            elif link.target_id:
+                cross_references_html.append(
+                    templates.cross_reference.format(
+                        label=CROSS_REFERENCE_LABELS[link.kind],
+                        other_id=link.target_id,
+                        other_headword=link.headword,
+                    )
+                )
+        return "".join(cross_references_html)
 
-        return self.DICTIONARY_GENERIC_ENTRY_TEMPLATE.format(
+    def generate_lemma_html_entry(self, lemma_verb_dict={}, derived_forms=None, templates=None):
+        templates = templates or READABLE_HTML_TEMPLATES
+        return templates.entry.format(
             entry_id=self.dictionary_id,
             word=self.headword,
             morph=self.morph_cat.capitalize(),
-            definitions="".join(self.generate_definitions_html_list()),
-            inflection_entries="".join(self.generate_derived_html_iforms()),
-            verb_aspect=verb_aspect_str,
+            definitions="".join(self.generate_definitions_html_list(templates)),
+            inflection_entries="".join(self.generate_derived_html_iforms(derived_forms, templates)),
+            cross_references=self.generate_cross_references_html(lemma_verb_dict, templates),
+            machine_translated=self.machine_translated
+        )
+
+    def generate_lemma_html_section(self, lemma_verb_dict={}, templates=None):
+        templates = templates or READABLE_HTML_TEMPLATES
+        return templates.entry_section.format(
+            entry_id=self.dictionary_id,
+            morph=self.morph_cat.capitalize(),
+            definitions="".join(self.generate_definitions_html_list(templates)),
+            cross_references=self.generate_cross_references_html(lemma_verb_dict, templates),
             machine_translated=self.machine_translated
         )
 
@@ -295,6 +489,252 @@ class Lemma(object):
         )
 
 
+def generate_headword_html_entry(lemmas, lemma_verb_dict={}, derived_forms=None, templates=None):
+    """
+    Renders all the lemmas of a headword as a single entry with one section per lemma, so that
+    the inflected forms of the headword are generated and indexed once. A lone lemma gets its usual entry
+    """
+    templates = templates or READABLE_HTML_TEMPLATES
+    if len(lemmas) == 1:
+        return lemmas[0].generate_lemma_html_entry(lemma_verb_dict, derived_forms, templates)
+    return templates.grouped_entry.format(
+        word=lemmas[0].headword,
+        inflection_entries="".join(lemmas[0].generate_derived_html_iforms(derived_forms, templates)),
+        sections="".join(lemma.generate_lemma_html_section(lemma_verb_dict, templates) for lemma in lemmas),
+    )
+
+
+def group_lemmas_by_headword(sorted_lemmas):
+    """
+    Groups the lemmas sharing a headword, which sorting puts next to each other
+    """
+    return [list(group) for _, group in itertools.groupby(sorted_lemmas, key=lambda lemma: lemma.headword)]
+
+
+def compact_html_template(template):
+    """
+    Drops the indentation and line breaks between tags and placeholders, which only make
+    the readable templates readable, and collapses any other whitespace run into a single space
+    """
+    template = re.sub(r"\s+", " ", template.strip())
+    return re.sub(r"([>}]) ([<{])", r"\1\2", template)
+
+
+READABLE_HTML_TEMPLATES = HtmlTemplates(
+    body_header=DICTIONARY_BODY_HEADER,
+    body_footer=DICTIONARY_BODY_FOOTER,
+    entry_separator=DICTIONARY_ENTRY_SEPARATOR,
+    entry=Lemma.DICTIONARY_GENERIC_ENTRY_TEMPLATE,
+    inflection=Lemma.DICTIONARY_ENTRY_INFLECTION_TEMPLATE,
+    definition=Lemma.DICTIONARY_DEFINITIONS_ENTRY_TEMPLATE,
+    verb_aspect=Lemma.DICTIONARY_VERB_ASPECT_ENTRY_TEMPLATE,
+    cross_reference=Lemma.DICTIONARY_CROSS_REFERENCE_ENTRY_TEMPLATE,
+    grouped_entry=Lemma.DICTIONARY_GROUPED_ENTRY_TEMPLATE,
+    entry_section=Lemma.DICTIONARY_ENTRY_SECTION_TEMPLATE,
+)
+# Compiled once from the readable templates, so that both always render the same markup.
+# Entries still end with a line break, which keeps the output diffable at a byte per entry
+COMPACT_HTML_TEMPLATES = HtmlTemplates(
+    *compact_html_template(DICTIONARY_BODY_TEMPLATE).split("{dict_body}"),
+    *[compact_html_template(template) for template in READABLE_HTML_TEMPLATES[2:]]
+)._replace(entry_separator=DICTIONARY_ENTRY_SEPARATOR + "\n")
+HTML_TEMPLATE_MODES = {
+    HTML_TEMPLATE_MODE_READABLE: READABLE_HTML_TEMPLATES,
+    HTML_TEMPLATE_MODE_COMPACT: COMPACT_HTML_TEMPLATES,
+}
+
+
+def generate_headword_derived_forms(headword):
+    """
+    Generates all the inflected forms of a headword that should point to its dictionary entry
+    """
+    derived_words_check = set()
+    derived_words = []
+
+    if len(headword.split(" ")) > 1:
+        # Only lemmas made by a single word for now
+        return []
+
+    generated = get_morfeusz().generate(headword)
+    generated_named = [GeneratedEntry(*element) for element in generated]
+
+    for generated_word in generated_named:
+        keep = True
+        split_tags = generated_word.tags.split(":")
+
+        for tag in split_tags:
+            # Skip anything that Morfeusz doesn't recognise - we can reuse it later to refine
+            # the head words
+            if tag == MORFEUSZ_UNKNOWN_WORD_TAG:
+                keep = False
+                continue
+            # Skip tags for abbreviation, non-accepted forms, etc.
+            if tag in MORFEUSZ_TAGS_TO_IGNORE:
+                keep = False
+                continue
+
+        # Skip certain qualifiers that don't lead to useful derived forms
+        for qualif in MORFEUSZ_BAD_QUALIFS:
+            if qualif in generated_word.qualifiers:
+                keep = False
+                continue
+
+        # Add anything that made it to this point to the inflected entries,
+        # making sure only unique values are added as Morfeusz has a tendency to
+        # generate tons of duplicates
+        if generated_word.generated_form not in derived_words_check and keep:
+            # There seems to be something non-deterministic or environment- or version-dependent
+            # in the way in which these 'm' tags are produced so getting rid of them
+            tags_to_keep = [tag for tag in split_tags if tag not in ("m1", "m2", "m3")]
+            tags_to_keep_formatted = ":".join(tags_to_keep)
+            derived_words_check.add(generated_word.generated_form)
+            derived_words.append(
+                {"derived_form": generated_word.generated_form, "tags": tags_to_keep_formatted}
+            )
+
+    return sorted(derived_words, key=lambda x: x["derived_form"])
+
+
+def get_morfeusz():
+    """
+    Returns the Morfeusz instance of this process, loading its dictionary on first use,
+    so that code that never inflects anything doesn't pay for it
+    """
+    if MORFEUSZ_STATE["instance"] is None:
+        MORFEUSZ_STATE["instance"] = morfeusz2.Morfeusz(**MORFEUSZ_STATE["options"])
+    return MORFEUSZ_STATE["instance"]
+
+
+def configure_morfeusz(**options):
+    """
+    Overrides MORFEUSZ_OPTIONS for this process (f.e. dict_name or dict_path to use another dictionary),
+    the Morfeusz instance is recreated with them on next use. Worker processes forked afterwards
+    inherit the configuration
+    """
+    MORFEUSZ_STATE["options"] = dict(MORFEUSZ_OPTIONS, **options)
+    MORFEUSZ_STATE["instance"] = None
+
+
+def init_inflection_worker():
+    """
+    Gives every inflection worker process its own Morfeusz instance, created on first use
+    with the configuration inherited from the parent process
+    """
+    MORFEUSZ_STATE["instance"] = None
+
+
+def fetch_inflection_cache_key():
+    """
+    Identifies everything that the generated inflections depend on: Morfeusz version,
+    dictionary and options, and the filters applied to its output
+    """
+    key_data = {
+        "cache_version": INFLECTION_CACHE_VERSION,
+        "morfeusz_version": morfeusz2.__version__,
+        "morfeusz_dict_id": get_morfeusz().dict_id(),
+        "morfeusz_options": MORFEUSZ_STATE["options"],
+        "tags_to_ignore": MORFEUSZ_TAGS_TO_IGNORE,
+        "bad_qualifs": MORFEUSZ_BAD_QUALIFS,
+        "unknown_word_tag": MORFEUSZ_UNKNOWN_WORD_TAG,
+    }
+    return hashlib.sha1(json.dumps(key_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class InflectionCache(object):
+    """
+    Persistent single-file SQLite store of the derived forms generated for each headword.
+    The whole cache is dropped when the cache key (see fetch_inflection_cache_key) changes
+    """
+    def __init__(self, filename=INFLECTION_CACHE_FILENAME, cache_key=None):
+        super(InflectionCache, self).__init__()
+        self.cache_key = cache_key or fetch_inflection_cache_key()
+        self.hits = 0
+        self.misses = 0
+        # Several chunk workers may share the cache file, so wait on locks rather than failing
+        self.connection = sqlite3.connect(filename, timeout=INFLECTION_CACHE_TIMEOUT)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS inflections (headword TEXT PRIMARY KEY, derived_forms TEXT)"
+        )
+        stored_key = self.connection.execute(
+            "SELECT value FROM metadata WHERE name = 'cache_key'"
+        ).fetchone()
+        if stored_key is None or stored_key[0] != self.cache_key:
+            self.connection.execute("DELETE FROM inflections")
+            self.connection.execute(
+                "INSERT OR REPLACE INTO metadata (name, value) VALUES ('cache_key', ?)", (self.cache_key,)
+            )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    @property
+    def counts(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def get_many(self, headwords):
+        found = {}
+        for batch in chunks(headwords, INFLECTION_CACHE_QUERY_BATCH):
+            rows = self.connection.execute(
+                "SELECT headword, derived_forms FROM inflections WHERE headword IN ({})".format(
+                    ", ".join("?" * len(batch))
+                ),
+                batch
+            )
+            for headword, derived_forms in rows:
+                found[headword] = [
+                    {"derived_form": derived_form, "tags": tags} for derived_form, tags in json.loads(derived_forms)
+                ]
+        self.hits += len(found)
+        self.misses += len(headwords) - len(found)
+        return found
+
+    def put_many(self, derived_forms_by_headword):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO inflections (headword, derived_forms) VALUES (?, ?)",
+            (
+                (
+                    headword,
+                    json.dumps([[form["derived_form"], form["tags"]] for form in derived_forms], ensure_ascii=False)
+                ) for headword, derived_forms in derived_forms_by_headword.items()
+            )
+        )
+        self.connection.commit()
+
+
+def generate_derived_forms_by_headword(headwords, pool=None, cache=None):
+    """
+    Generates derived forms for each unique headword, spreading the Morfeusz calls
+    across the worker processes of the pool if one is given. Results are collected
+    in input order, so the output doesn't depend on the number of workers.
+    Headwords found in the cache (if any) skip Morfeusz altogether
+    """
+    unique_headwords = list(dict.fromkeys(headwords))
+    cached = cache.get_many(unique_headwords) if cache is not None else {}
+    missing_headwords = [headword for headword in unique_headwords if headword not in cached]
+    if pool is None:
+        generated = map(generate_headword_derived_forms, missing_headwords)
+    else:
+        generated = pool.imap(
+            generate_headword_derived_forms, missing_headwords, chunksize=INFLECTION_WORKER_BATCH
+        )
+    generated = dict(zip(missing_headwords, generated))
+    if cache is not None and generated:
+        cache.put_many(generated)
+    return {
+        headword: cached[headword] if headword in cached else generated[headword]
+        for headword in unique_headwords
+    }
+
+
 def extract_corpus_entry_data(corpus_entry):
     morph_cat = corpus_entry[CORPUS_MORPH_CAT_STR]
     meanings = corpus_entry.get(CORPUS_MEANINGS_STR, [])
@@ -302,6 +742,58 @@ def extract_corpus_entry_data(corpus_entry):
     return morph_cat, meanings, word
 
 
+def extract_definitions(meanings):
+    """
+    Normalises corpus senses into an immutable tuple of definitions, once per lemma
+    """
+    definitions = []
+    for meaning in meanings:
+        definition = meaning.get(CORPUS_DEFINITION_STR, [])
+        # TODO: check what exactly appears here
+        if not definition:
+            continue
+        form_of = meaning.get(CORPUS_INFLECTED_FORM_STR, [])
+        definitions.append(
+            Definition(
+                definition=definition[0],
+                derived=bool(form_of),
+                derived_from=(form_of[0] if form_of else "")
+            )
+        )
+    return tuple(definitions)
+
+
+def extract_alternative_aspect_data(corpus_entry):
+    """
+    Finds the linked perfective/imperfective/frequentative form of a verb, if any
+    """
+    if corpus_entry[CORPUS_MORPH_CAT_STR] == CORPUS_MORPH_CAT_VERB_STR:
+        other_aspect = corpus_entry.get("forms", [])
+        if other_aspect:
+            form = other_aspect[0].get("form")
+            tag = other_aspect[0].get("tags", [])
+            if form and tag:
+                return form, tag[0]
+    return "", ""
+
+
+def extract_cross_references(corpus_entry, definitions):
+    """
+    Finds the diminutives and augmentatives of an entry, and the headwords its derived senses are forms of
+    """
+    cross_references = []
+    for form in corpus_entry.get("forms", []):
+        for tag in form.get("tags", []):
+            if tag in CROSS_REFERENCE_FORM_TAGS and form.get("form"):
+                cross_references.append(CrossReference(tag, form["form"], tag))
+    derived_from_headwords = dict.fromkeys(
+        definition.derived_from for definition in definitions if definition.derived_from
+    )
+    for headword in derived_from_headwords:
+        cross_references.append(CrossReference(CROSS_REFERENCE_DERIVED_FROM, headword, ""))
+    return tuple(cross_references)
+
+
 def check_lemma_is_invalid(lemma):
     if lemma.morph_cat in WIKTIONARY_HEAD_WORD_TYPES_TO_IGNORE:
         return DISCARDED_INVALID_POS_VARNAME
@@ -313,64 +805,117 @@ def check_lemma_is_invalid(lemma):
 
 def build_verb_lemma_dictionary(lemma_list):
     """
-    This is used to find and generate entries for linked perfective/imperfective/iterative forms.
+    This is used to find and generate entries for linked perfective/imperfective/iterative forms
+    of lemmas that haven't been through link_lemmas().
     Note that there are multiple verbs in the dictionary that have more than one entry with the
     same headword, so this'll always be a best guess.
+    Only the dictionary IDs are kept, so that the lookup is cheap to ship to worker processes
     """
     verb_lemma_dict = {}
     for lemma in lemma_list:
         if lemma.morph_cat == CORPUS_MORPH_CAT_VERB_STR:
-            verb_lemma_dict[lemma.headword] = lemma
+            verb_lemma_dict[lemma.headword] = lemma.dictionary_id
     return verb_lemma_dict
 
 
 def build_lemma_from_corpus_entry(corpus_entry, dictionary_id=0):
     morph_cat, meanings, headword = extract_corpus_entry_data(corpus_entry)
-    return Lemma(
+    aspect_form, aspect_tag = extract_alternative_aspect_data(corpus_entry)
+    lemma = Lemma(
         headword=headword,
         morph_cat=morph_cat,
         meanings=meanings,
-        raw_corpus_entry=corpus_entry,
-        dictionary_id=str(dictionary_id)
+        dictionary_id=str(dictionary_id),
+        aspect_form=aspect_form,
+        aspect_tag=aspect_tag,
     )
+    lemma.cross_references = extract_cross_references(corpus_entry, lemma.definitions)
+    return lemma
 
 
-def extract_head_words(corpus_data):
+def extract_head_words(corpus_data, discarded_entries_filename=None, keep_derived_only=False):
     """
-    Casts corpus data into Lemma objects, keeps track of discarded objects
+    Casts corpus data into Lemma objects, keeps count of discarded objects.
+    Corpus data can be any iterable of entries, f.e. the generator returned by load_corpus().
+    If a filename is given, discarded raw entries are streamed to it (for the stats) together
+    with the reason they were discarded, rather than being kept in memory.
+    With keep_derived_only, derived-only lemmas are still reported as discarded but returned too,
+    so that builds sharing the extraction can each decide whether to keep them
     """
     discarded = {
-        DISCARDED_INVALID_POS_VARNAME: [],
-        DISCARDED_DERIVED_VARNAME: [],
         DISCARDED_INVALID_POS_VARNAME + "_count": 0,
         DISCARDED_DERIVED_VARNAME + "_count": 0,
     }
     all_lemmas = []
-    for i, entry in tqdm(enumerate(corpus_data), desc="Extracting head words..."):
+    with DiscardedEntriesWriter(discarded_entries_filename) as discarded_writer:
+        for entry in corpus_data:
+            lemma = build_lemma_from_corpus_entry(entry)
+
+            check = check_lemma_is_invalid(lemma)
+            if check:
+                discarded_writer.write_entry(check, entry)
+                discarded[check + "_count"] += 1
+                if not (keep_derived_only and check == DISCARDED_DERIVED_VARNAME):
+                    continue
 
-        lemma = build_lemma_from_corpus_entry(entry)
+            all_lemmas.append(lemma)
 
-        check = check_lemma_is_invalid(lemma)
-        if check:
-            discarded[check].append(entry)
-            discarded[check + "_count"] += 1
-            continue
+    return all_lemmas, discarded
 
-        all_lemmas.append(lemma)
 
-    return all_lemmas, discarded
+class DiscardedEntriesWriter(object):
+    """
+    Streams discarded corpus entries to a gzipped JSONL file, one {"reason", "entry"} record per line.
+    Like the HTML chunks, the file is only put in place once complete.
+    Without a filename nothing is written
+    """
+    def __init__(self, filename=None):
+        super(DiscardedEntriesWriter, self).__init__()
+        self.filename = filename
+        self.myfile = None
+        if filename:
+            self.myfile = gzip.open(filename + ".tmp", "wt", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if self.myfile is not None:
+            self.myfile.close()
+            if exc_type is None:
+                os.replace(self.filename + ".tmp", self.filename)
+            else:
+                os.remove(self.filename + ".tmp")
+
+    def write_entry(self, reason, entry):
+        if self.myfile is not None:
+            self.myfile.write(json.dumps({"reason": reason, "entry": entry}, ensure_ascii=False) + "\n")
+
+
+def read_discarded_entries(filename, reason=None):
+    """
+    Lazily reads back the discarded entries, optionally only the ones discarded for the given reason
+    """
+    with gzip.open(filename, "rt", encoding="utf-8") as myfile:
+        for line in myfile:
+            record = json.loads(line)
+            if reason is None or record["reason"] == reason:
+                yield record
 
 
 def add_machine_translated_lemmas(machine_translated_corpus, base_lemmas):
     """
-    Adds machine-translated corpus from SGJP/GCP Translate API, prioritises base lemmas
+    Adds machine-translated corpus from SGJP/GCP Translate API, prioritises base lemmas.
+    The corpus can be any iterable of items, f.e. the generator returned by read_machine_translated_corpus(),
+    it is merged item by item against an index of the (lowercased) headwords already present
     """
-    existing_lemmas_headwords = set([lemma.headword for lemma in base_lemmas])
+    existing_lemmas_headwords = set(lemma.headword.lower() for lemma in base_lemmas)
     duplicate = 0
     no_trans = 0
-    for item in tqdm(machine_translated_corpus):
+    for item in tqdm(machine_translated_corpus, desc="Merging machine-translated corpus..."):
         # Discard duplicates, Wiktionary entries will generally be of better quality
-        if item["entry"] in existing_lemmas_headwords:
+        headword_key = item["entry"].lower()
+        if headword_key in existing_lemmas_headwords:
             duplicate += 1
             continue
         # Discard cases where the translation doesn't add anything
@@ -382,90 +927,605 @@ def add_machine_translated_lemmas(machine_translated_corpus, base_lemmas):
             morph_cat=SGJP_MORPH_CATEGORY_MAPPING.get(item["abbr_pos"], ""),
             meanings=[{CORPUS_DEFINITION_STR: [item.get("translation", [])]}],
             machine_translated=MACHINE_TRANSLATED_MESSAGE,
-            raw_corpus_entry={},
             dictionary_id=0
         )
         base_lemmas.append(lemma)
+        existing_lemmas_headwords.add(headword_key)
     print("Duplicate: {}, no translation: {}".format(str(duplicate), str(no_trans)))
     return base_lemmas
 
 
-def create_html_dictionary(create_with_stats=False, write=True):
-    DICTIONARY_BODY_TEMPLATE = """
-    <html xmlns:math="http://exslt.org/math" xmlns:svg="http://www.w3.org/2000/svg"
-    xmlns:tl="https://kindlegen.s3.amazonaws.com/AmazonKindlePublishingGuidelines.pdf"
-    xmlns:saxon="http://saxon.sf.net/" xmlns:xs="http://www.w3.org/2001/XMLSchema"
-    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-    xmlns:cx="https://kindlegen.s3.amazonaws.com/AmazonKindlePublishingGuidelines.pdf"
-    xmlns:dc="http://purl.org/dc/elements/1.1/"
-    xmlns:mbp="https://kindlegen.s3.amazonaws.com/AmazonKindlePublishingGuidelines.pdf"
-    xmlns:mmc="https://kindlegen.s3.amazonaws.com/AmazonKindlePublishingGuidelines.pdf"
-    xmlns:idx="https://kindlegen.s3.amazonaws.com/AmazonKindlePublishingGuidelines.pdf">
-    <head><meta http-equiv="Content-Type" content="text/html; charset=utf-8"></head>
-    <body>
-    <mbp:frameset>{dict_body}</mbp:frameset>
-    </body>
+def link_lemmas(sorted_lemmas):
+    """
+    Resolves the cross-references of all lemmas in a single pass, against an index that keeps
+    every entry of a headword (in dictionary order) rather than only the last one seen.
+    Returns how many links of each kind were resolved and how many weren't
     """
-    corpus_data = load_corpus()
-    lemmas, discarded_entries = extract_head_words(corpus_data)
+    lemmas_by_headword = defaultdict(list)
+    for lemma in sorted_lemmas:
+        lemmas_by_headword[lemma.headword].append(lemma)
+    link_counts = {}
+    for lemma in sorted_lemmas:
+        links = []
+        for reference in lemma.iterate_cross_references():
+            target = choose_link_target(lemma, reference, lemmas_by_headword.get(reference.headword, []))
+            links.append(
+                ResolvedLink(reference.kind, reference.tag, reference.headword, target.dictionary_id if target else "")
+            )
+            kind_counts = link_counts.setdefault(reference.kind, {"resolved": 0, "unresolved": 0})
+            kind_counts["resolved" if target else "unresolved"] += 1
+        lemma.links = tuple(links)
+    for kind, kind_counts in sorted(link_counts.items()):
+        print("{} links: {resolved} resolved, {unresolved} unresolved".format(kind, **kind_counts))
+    return link_counts
+
+
+def choose_link_target(lemma, reference, candidates):
+    """
+    Picks the entry a cross-reference points to among all the entries of its headword: one in the
+    expected part of speech (a verb for aspects, the lemma's own otherwise), preferring an entry
+    that links back to the lemma, then Wiktionary entries over machine-translated ones
+    """
+    candidates = [candidate for candidate in candidates if candidate is not lemma]
+    expected_morph_cat = CORPUS_MORPH_CAT_VERB_STR if reference.kind == CROSS_REFERENCE_ASPECT else lemma.morph_cat
+    matching = [candidate for candidate in candidates if candidate.morph_cat == expected_morph_cat]
+    if not matching and reference.kind != CROSS_REFERENCE_ASPECT:
+        matching = candidates
+    if not matching:
+        return None
+
+    def links_back(candidate):
+        return any(
+            candidate_reference.headword == lemma.headword
+            for candidate_reference in candidate.iterate_cross_references()
+        )
+
+    # min() keeps the first of equally good candidates, i.e. the first in dictionary order
+    return min(matching, key=lambda candidate: (not links_back(candidate), bool(candidate.machine_translated)))
+
+
+def fingerprint_file(filename):
+    """
+    Cheap identity of the content of a file, without reading it all: a hash of its size and of its first
+    and last FILE_FINGERPRINT_SAMPLE_SIZE bytes. Unlike its path or mtime, it stays the same when the same
+    file is downloaded again. None if the file doesn't exist
+    """
+    if not os.path.exists(filename):
+        return None
+    file_hash = hashlib.sha1()
+    with open(filename, "rb") as myfile:
+        file_size = os.fstat(myfile.fileno()).st_size
+        file_hash.update(str(file_size).encode("utf-8"))
+        file_hash.update(myfile.read(FILE_FINGERPRINT_SAMPLE_SIZE))
+        if file_size > FILE_FINGERPRINT_SAMPLE_SIZE:
+            myfile.seek(max(FILE_FINGERPRINT_SAMPLE_SIZE, file_size - FILE_FINGERPRINT_SAMPLE_SIZE))
+            file_hash.update(myfile.read())
+    return file_hash.hexdigest()
+
+
+def fetch_build_fingerprint(html_mode=HTML_TEMPLATE_MODE_DEFAULT, group_headwords=False):
+    """
+    Fingerprint of everything shared by all entries: the templates, the entry layout, the rendering code
+    version and the identity of the Morfeusz output (which is fully determined by the inflection cache key)
+    """
+    build_inputs = [
+        BUILD_MANIFEST_VERSION,
+        fetch_inflection_cache_key(),
+        list(HTML_TEMPLATE_MODES[html_mode]),
+        group_headwords,
+    ]
+    return hashlib.sha1(json.dumps(build_inputs).encode("utf-8")).hexdigest()
+
+
+def fingerprint_lemma(lemma, lemma_verb_dict):
+    """
+    Fingerprint of all the data that ends up in the rendered entry of a lemma,
+    including the resolved link to its other aspect
+    """
+    lemma_inputs = [
+        lemma.dictionary_id,
+        lemma.headword,
+        lemma.morph_cat,
+        lemma.definitions,
+        lemma.find_links(lemma_verb_dict),
+        lemma.machine_translated,
+    ]
+    return hashlib.sha1(json.dumps(lemma_inputs, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def fingerprint_lemma_chunk(lemma_chunk, lemma_verb_dict, build_fingerprint):
+    chunk_hash = hashlib.sha1(build_fingerprint.encode("utf-8"))
+    for lemma in lemma_chunk:
+        chunk_hash.update(fingerprint_lemma(lemma, lemma_verb_dict).encode("utf-8"))
+    return chunk_hash.hexdigest()
+
+
+def read_build_manifest():
+    """
+    Reads the chunk fingerprints of the previous build, if there was one
+    """
+    if not os.path.exists(BUILD_MANIFEST_FILENAME):
+        return {}
+    with open(BUILD_MANIFEST_FILENAME, "r", encoding="utf-8") as myfile:
+        return json.loads(myfile.read())["chunks"]
+
+
+def write_build_manifest(chunk_manifest):
+    with open(BUILD_MANIFEST_FILENAME, "w", encoding="utf-8") as myfile:
+        myfile.write(json.dumps({"chunks": chunk_manifest}, indent=1))
+
+
+def create_html_dictionary(
+    create_with_stats=False, write=True, jobs=1, inflection_cache_path=None, incremental=False, chunk_jobs=1,
+    chunk_iform_budget=DICT_CHUNK_IFORM_BUDGET, html_mode=HTML_TEMPLATE_MODE_DEFAULT, group_headwords=False
+):
+    discarded_entries_filename = None
+    if create_with_stats:
+        discarded_entries_filename = DISCARDED_ENTRIES_FILENAME.format(fetch_current_git_hash())
+    lemmas, discarded_entries = extract_head_words(load_corpus(), discarded_entries_filename)
     machine_translated_corpus = read_machine_translated_corpus()
     lemmas = add_machine_translated_lemmas(machine_translated_corpus, lemmas)
+    sorted_lemmas, lemma_verb_dict = sort_and_number_lemmas(lemmas)
+    link_counts = link_lemmas(sorted_lemmas)
+    with build_inflection_cache_path(inflection_cache_path) as build_cache_path:
+        iform_counts, inflection_cache_counts = count_derived_forms(
+            (lemma.headword for lemma in sorted_lemmas), build_cache_path, jobs
+        )
+        build_stats = render_html_dictionary(
+            sorted_lemmas, lemma_verb_dict, iform_counts, write, build_cache_path, incremental,
+            chunk_jobs, chunk_iform_budget, html_mode, group_headwords
+        )
+    build_stats["cross_references"] = link_counts
+    if inflection_cache_path:
+        build_stats["inflection_cache"] = inflection_cache_counts
+        print("Inflection cache hits: {hits}, misses: {misses}".format(**inflection_cache_counts))
+    if create_with_stats:
+        write_dict_stats(sorted_lemmas, discarded_entries, build_stats.pop("dict_lines"), build_stats)
+    return sorted_lemmas, lemma_verb_dict
+
+
+def sort_and_number_lemmas(lemmas):
+    """
+    Sorts the lemmas, assigns their dictionary IDs in that order and builds the verb lookup
+    """
     sorted_lemmas = sort_lemmas(lemmas)
     for i, lemma in enumerate(sorted_lemmas, start=1):
         setattr(lemma, 'dictionary_id', str(i))
-    lemma_verb_dict = build_verb_lemma_dictionary(sorted_lemmas)
-    split_lemma_chunks = chunks(sorted_lemmas, SAFE_DICT_CHUNK)
+    return sorted_lemmas, build_verb_lemma_dictionary(sorted_lemmas)
+
+
+@contextlib.contextmanager
+def build_inflection_cache_path(inflection_cache_path=None):
+    """
+    Yields the inflection cache to use for a build: the persistent one if given, otherwise
+    a temporary one, since chunk planning and rendering both need the inflections and
+    they should only be generated once
+    """
+    if inflection_cache_path:
+        yield inflection_cache_path
+        return
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield os.path.join(temp_dir, INFLECTION_CACHE_FILENAME)
+
+
+def count_derived_forms(headwords, inflection_cache_path, jobs=1):
+    """
+    Generates the inflections of all headwords ahead of rendering (storing them in the cache).
+    Returns how many inflected forms each headword has, and the inflection cache hit/miss counts
+    """
+    if jobs > 1:
+        inflection_pool = multiprocessing.Pool(jobs, initializer=init_inflection_worker)
+    else:
+        inflection_pool = contextlib.nullcontext()
+    iform_counts = {}
+    unique_headwords = list(dict.fromkeys(headwords))
+    with inflection_pool as pool, InflectionCache(inflection_cache_path) as cache:
+        for batch in tqdm(
+            chunks(unique_headwords, SAFE_DICT_CHUNK),
+            total=-(-len(unique_headwords) // SAFE_DICT_CHUNK),
+            desc="Generating inflections..."
+        ):
+            for headword, derived_forms in generate_derived_forms_by_headword(batch, pool, cache).items():
+                iform_counts[headword] = len(derived_forms)
+    return iform_counts, cache.counts
+
+
+def plan_dictionary_chunks(
+    sorted_lemmas, iform_counts, max_iforms=DICT_CHUNK_IFORM_BUDGET, max_lemmas=SAFE_DICT_CHUNK, group_headwords=False
+):
+    """
+    Splits the sorted lemmas into chunks of similar size: a chunk is closed once its entries
+    plus their inflected forms would exceed the iform budget, or once it holds max_lemmas entries.
+    When grouping by headword, the lemmas of a headword stay in the same chunk and share their inflected forms
+    """
+    if group_headwords:
+        lemma_groups = group_lemmas_by_headword(sorted_lemmas)
+    else:
+        lemma_groups = ([lemma] for lemma in sorted_lemmas)
+    chunk_start = 0
+    chunk_iforms = 0
+    i = 0
+    for lemmas in lemma_groups:
+        group_iforms = iform_counts[lemmas[0].headword] + len(lemmas)
+        if i > chunk_start and (chunk_iforms + group_iforms > max_iforms or i - chunk_start >= max_lemmas):
+            yield sorted_lemmas[chunk_start:i]
+            chunk_start = i
+            chunk_iforms = 0
+        chunk_iforms += group_iforms
+        i += len(lemmas)
+    if chunk_start < len(sorted_lemmas):
+        yield sorted_lemmas[chunk_start:]
+
+
+def render_html_dictionary(
+    sorted_lemmas, lemma_verb_dict, iform_counts, write, inflection_cache_path, incremental, chunk_jobs,
+    chunk_iform_budget, html_mode=HTML_TEMPLATE_MODE_DEFAULT, group_headwords=False
+):
+    """
+    Splits the lemmas into chunks, renders the ones that changed and writes the OPF manifest
+    listing all of them. Returns the build stats
+    """
+    build_manifest = read_build_manifest() if incremental else {}
+    chunk_manifest = {}
+    chunks_to_render = []
+    reused_chunks = []
+    build_fingerprint = fetch_build_fingerprint(html_mode, group_headwords)
+    split_lemma_chunks = plan_dictionary_chunks(
+        sorted_lemmas, iform_counts, chunk_iform_budget, SAFE_DICT_CHUNK, group_headwords
+    )
     for i, chunk in enumerate(split_lemma_chunks, start=1):
-        all_html_lemmas = []
         str_index = str(i)
-        for lemma in tqdm(chunk, desc="Generating HTML entries for chunk {}...".format(str_index)):
-            lemma_html = lemma.generate_lemma_html_entry(
-                lemma_verb_dict=lemma_verb_dict
+        chunk_fingerprint = fingerprint_lemma_chunk(chunk, lemma_verb_dict, build_fingerprint)
+        previous_chunk = build_manifest.get(str_index)
+        if (
+            previous_chunk and previous_chunk["fingerprint"] == chunk_fingerprint
+            and os.path.exists(DICTIONARY_HTML_FILENAME.format(str_index))
+        ):
+            reused_chunks.append(str_index)
+            chunk_manifest[str_index] = previous_chunk
+            continue
+        chunk_manifest[str_index] = {"fingerprint": chunk_fingerprint}
+        chunks_to_render.append((str_index, chunk))
+
+    if chunk_jobs > 1:
+        rendered_chunks = render_html_dictionary_chunks_in_parallel(
+            chunks_to_render, lemma_verb_dict, write, inflection_cache_path, chunk_jobs, html_mode, group_headwords
+        )
+    else:
+        rendered_chunks = render_html_dictionary_chunks(
+            chunks_to_render, lemma_verb_dict, write, inflection_cache_path, html_mode, group_headwords
+        )
+    failed_chunks = []
+    for chunk_no, chunk_lines, error in rendered_chunks:
+        if error:
+            failed_chunks.append(chunk_no)
+            del chunk_manifest[chunk_no]
+            print("Failed to render chunk {}:\n{}".format(chunk_no, error))
+            continue
+        chunk_manifest[chunk_no]["lines"] = chunk_lines
+
+    if write:
+        write_build_manifest(chunk_manifest)
+    if failed_chunks:
+        raise Exception("Failed to render dictionary chunks: {}".format(", ".join(sorted(failed_chunks, key=int))))
+    if write:
+        write_opf_manifest(len(chunk_manifest))
+    if incremental:
+        print("Reused chunks: {}".format(", ".join(reused_chunks) or "none"))
+    build_stats = {
+        "chunks_count": len(chunk_manifest),
+        "reused_chunks": reused_chunks,
+        "dict_lines": sum(chunk["lines"] for chunk in chunk_manifest.values()),
+        "html_mode": html_mode,
+        "entries_count": len(sorted_lemmas),
+    }
+    if group_headwords:
+        lemma_groups = group_lemmas_by_headword(sorted_lemmas)
+        build_stats["entries_count"] = len(lemma_groups)
+        build_stats["merged_entries"] = len(sorted_lemmas) - len(lemma_groups)
+        # Inflected forms that are now indexed once per headword instead of once per lemma
+        build_stats["merged_iforms"] = sum(
+            iform_counts[lemmas[0].headword] * (len(lemmas) - 1) for lemmas in lemma_groups
+        )
+        print("Merged entries: {merged_entries}, inflected forms no longer repeated: {merged_iforms}".format(
+            **build_stats
+        ))
+    if write:
+        build_stats["html_bytes"] = sum(
+            os.path.getsize(DICTIONARY_HTML_FILENAME.format(chunk_no)) for chunk_no in chunk_manifest
+        )
+    return build_stats
+
+
+def write_opf_manifest(chunks_count):
+    """
+    Writes the OPF file listing exactly the HTML chunks produced by the build
+    """
+    chunk_numbers = range(1, chunks_count + 1)
+    opf_contents = DICTIONARY_OPF_TEMPLATE.format(
+        manifest_items="\n".join(
+            DICTIONARY_OPF_MANIFEST_ITEM_TEMPLATE.format(
+                chunk_no=chunk_no, filename=DICTIONARY_HTML_FILENAME.format(chunk_no)
+            ) for chunk_no in chunk_numbers
+        ),
+        spine_items="\n".join(
+            DICTIONARY_OPF_SPINE_ITEM_TEMPLATE.format(chunk_no=chunk_no) for chunk_no in chunk_numbers
+        )
+    )
+    with open(DICTIONARY_OPF_FILENAME, "w", encoding="utf-8") as myfile:
+        myfile.write(opf_contents)
+
+
+def render_html_dictionary_chunks(
+    chunks_to_render, lemma_verb_dict, write, inflection_cache_path, html_mode, group_headwords
+):
+    """
+    Renders chunks one after the other in this process, with their inflections read from the cache.
+    Yields (chunk number, lines written, error) tuples
+    """
+    with InflectionCache(inflection_cache_path) as cache:
+        for chunk_no, chunk in chunks_to_render:
+            derived_forms = generate_derived_forms_by_headword((lemma.headword for lemma in chunk), cache=cache)
+            chunk_lines = write_html_dictionary_chunk(
+                chunk, chunk_no, lemma_verb_dict, derived_forms, write, templates=HTML_TEMPLATE_MODES[html_mode],
+                group_headwords=group_headwords
             )
-            all_html_lemmas.append(lemma_html)
-        dict_contents = DICTIONARY_BODY_TEMPLATE.format(
-            dict_body="<hr>".join(all_html_lemmas)
+            yield chunk_no, chunk_lines, None
+
+
+def init_chunk_worker(lemma_verb_dict, inflection_cache_path, html_mode, group_headwords):
+    """
+    Sets up a chunk rendering worker: its own Morfeusz instance and inflection cache connection,
+    plus the cross-chunk lookup data, which is shipped once per worker rather than once per chunk
+    """
+    init_inflection_worker()
+    CHUNK_WORKER_STATE.update(
+        lemma_verb_dict=lemma_verb_dict,
+        inflection_cache=InflectionCache(inflection_cache_path),
+        templates=HTML_TEMPLATE_MODES[html_mode],
+        group_headwords=group_headwords,
+    )
+
+
+def render_html_dictionary_chunk_in_worker(chunk_task):
+    """
+    Renders and writes a single chunk in a worker process. Errors are returned rather than raised,
+    so that a failing chunk is reported without affecting the others
+    """
+    chunk_no, chunk, write = chunk_task
+    cache = CHUNK_WORKER_STATE["inflection_cache"]
+    try:
+        derived_forms = generate_derived_forms_by_headword((lemma.headword for lemma in chunk), cache=cache)
+        chunk_lines = write_html_dictionary_chunk(
+            chunk, chunk_no, CHUNK_WORKER_STATE["lemma_verb_dict"], derived_forms, write, progress=False,
+            templates=CHUNK_WORKER_STATE["templates"], group_headwords=CHUNK_WORKER_STATE["group_headwords"]
+        )
+    except Exception:
+        return chunk_no, 0, traceback.format_exc()
+    return chunk_no, chunk_lines, None
+
+
+def render_html_dictionary_chunks_in_parallel(
+    chunks_to_render, lemma_verb_dict, write, inflection_cache_path, chunk_jobs, html_mode, group_headwords
+):
+    """
+    Renders and writes chunks concurrently, one worker process per output file at a time
+    """
+    with multiprocessing.Pool(
+        chunk_jobs, initializer=init_chunk_worker,
+        initargs=(lemma_verb_dict, inflection_cache_path, html_mode, group_headwords)
+    ) as pool:
+        chunk_tasks = [(chunk_no, chunk, write) for chunk_no, chunk in chunks_to_render]
+        yield from tqdm(
+            pool.imap_unordered(render_html_dictionary_chunk_in_worker, chunk_tasks),
+            total=len(chunk_tasks),
+            desc="Generating HTML chunks..."
         )
-        if write:
-            write_html_dictionary_chunk(dict_contents, str_index)
-    if create_with_stats:
-        write_dict_stats(sorted_lemmas, discarded_entries, dict_contents.count("\n"))
-    return sorted_lemmas, lemma_verb_dict
 
 
-def write_dict_stats(sorted_lemmas, discarded_entries, html_dict_len):
+def write_dict_stats(sorted_lemmas, discarded_entries, html_dict_len, build_stats=None):
     lemmas_per_letter = defaultdict(int)
+    definitions_count = 0
     for lemma in sorted_lemmas:
         headword_initial = lemma.headword[0]
         lemmas_per_letter[headword_initial] += 1
+        definitions_count += len(lemma.definitions)
     stats_dict = {
         "lemmas_count": len(sorted_lemmas),
         "lemmas_per_letter": dict(lemmas_per_letter),
+        "definitions_count": definitions_count,
         "dict_lines": html_dict_len,
-        "discarded_entries_counts": {
-            key: value for key, value in discarded_entries.items() if key.endswith("count")
-        },
+        "discarded_entries_counts": discarded_entries,
     }
+    if build_stats:
+        stats_dict.update(build_stats)
     with open(STATS_FILENAME.format(fetch_current_git_hash()), "w", encoding="utf-8") as myfile:
         myfile.write(json.dumps(stats_dict))
-    with open(DISCARDED_ENTRIES_FILENAME.format(fetch_current_git_hash()), "w", encoding="utf-8") as myfile:
-        myfile.write(json.dumps(discarded_entries))
+
+
+def run_kindlegen(opf_filename=DICTIONARY_OPF_FILENAME, kindlegen_path=KINDLEGEN_PATH, working_dir=None):
+    """
+    Compiles the .mobi dictionary, returns the kindlegen wall time and the size of its output.
+    The OPF file name is relative to the working directory, if one is given
+    """
+    start_time = time.perf_counter()
+    ret_obj = subprocess.run(
+        [
+            kindlegen_path,
+            opf_filename,
+            "-verbose",
+            "-dont_append_source"
+        ],
+        cwd=working_dir
+    )
+    if ret_obj.returncode not in (0, 1):
+        raise Exception("Failed to properly generate the dictionary")
+    mobi_filename = os.path.join(working_dir or "", os.path.splitext(opf_filename)[0] + ".mobi")
+    return {
+        "kindlegen_seconds": round(time.perf_counter() - start_time, 2),
+        "mobi_bytes": os.path.getsize(mobi_filename),
+    }
 
 
 def fetch_current_git_hash():
     return subprocess.check_output(["git", "describe", "--always"]).strip().decode()
 
 
-def write_html_dictionary(create_with_stats=False):
-    create_html_dictionary(create_with_stats, True)
+def write_html_dictionary(
+    create_with_stats=False, jobs=1, inflection_cache_path=None, incremental=False, chunk_jobs=1,
+    chunk_iform_budget=DICT_CHUNK_IFORM_BUDGET, html_mode=HTML_TEMPLATE_MODE_DEFAULT, group_headwords=False
+):
+    create_html_dictionary(
+        create_with_stats, True, jobs, inflection_cache_path, incremental, chunk_jobs, chunk_iform_budget,
+        html_mode, group_headwords
+    )
+
+
+class DictionaryChunkWriter(object):
+    """
+    Streams a single HTML dictionary chunk to a buffered file as entries are rendered,
+    instead of building the whole chunk in memory. Keeps count of the written lines.
+    Without a filename nothing is written, only the stats are gathered
+    """
+    def __init__(self, filename=None, templates=None):
+        super(DictionaryChunkWriter, self).__init__()
+        self.filename = filename
+        self.templates = templates or READABLE_HTML_TEMPLATES
+        self.myfile = None
+        if filename:
+            # Written under a temporary name and renamed once complete, so that an interrupted
+            # build never leaves a truncated chunk behind
+            self.myfile = open(filename + ".tmp", "w", encoding="utf-8", buffering=HTML_WRITE_BUFFER_SIZE)
+        self.lines = 0
+        self.entries = 0
+        self.write(self.templates.body_header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.write(self.templates.body_footer)
+        if self.myfile is not None:
+            self.myfile.close()
+            if exc_type is None:
+                os.replace(self.filename + ".tmp", self.filename)
+            else:
+                os.remove(self.filename + ".tmp")
+
+    def write(self, text):
+        self.lines += text.count("\n")
+        if self.myfile is not None:
+            self.myfile.write(text)
+
+    def write_entry(self, lemma_html):
+        if self.entries:
+            self.write(self.templates.entry_separator)
+        self.write(lemma_html)
+        self.entries += 1
+
+
+def write_html_dictionary_chunk(
+    lemma_chunk, chunk_no, lemma_verb_dict, derived_forms, write=True, progress=True, templates=None,
+    group_headwords=False
+):
+    """
+    Renders a chunk of lemmas into its own HTML file, returns the number of lines written.
+    When grouping by headword, the lemmas of a headword are rendered as a single entry
+    """
+    filename = DICTIONARY_HTML_FILENAME.format(chunk_no) if write else None
+    if group_headwords:
+        lemma_groups = group_lemmas_by_headword(lemma_chunk)
+    else:
+        lemma_groups = [[lemma] for lemma in lemma_chunk]
+    with DictionaryChunkWriter(filename, templates) as writer:
+        for lemmas in tqdm(
+            lemma_groups, desc="Generating HTML entries for chunk {}...".format(chunk_no), disable=not progress
+        ):
+            writer.write_entry(
+                generate_headword_html_entry(
+                    lemmas,
+                    lemma_verb_dict=lemma_verb_dict,
+                    derived_forms=derived_forms[lemmas[0].headword],
+                    templates=writer.templates
+                )
+            )
+    return writer.lines
 
 
-def write_html_dictionary_chunk(html_dict, chunk_no):
-    with open(DICTIONARY_HTML_FILENAME.format(chunk_no), "w", encoding="utf-8") as myfile:
-        myfile.write(html_dict)
+def read_machine_translated_corpus(filename=MACHINE_TRANSLATED_CORPUS_FILENAME):
+    """
+    Lazily reads the machine-translated corpus, one JSON item per line. A corpus still in
+    the legacy single-array format is converted first
+    """
+    if not os.path.exists(filename) and os.path.exists(LEGACY_MACHINE_TRANSLATED_CORPUS_FILENAME):
+        print("Converting {} to {}...".format(LEGACY_MACHINE_TRANSLATED_CORPUS_FILENAME, filename))
+        convert_machine_translated_corpus(LEGACY_MACHINE_TRANSLATED_CORPUS_FILENAME, filename)
+    with open(filename, "r", encoding="utf-8") as myfile:
+        for line in myfile:
+            if line.strip():
+                yield json.loads(line)
 
 
-def read_machine_translated_corpus():
-    with open(MACHINE_TRANSLATED_CORPUS_FILENAME, "r", encoding="utf-8") as myfile:
-        corpus = json.loads(myfile.read())
-    return corpus
+def iterate_json_array(myfile):
+    """
+    Yields the objects of a top-level JSON array one by one, decoding the file in fixed-size reads
+    so that neither the whole text nor the whole parsed array is ever held in memory
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    # Offset of the start of the buffer within the file, in characters
+    buffer_offset = 0
+    while not buffer:
+        data = myfile.read(JSON_STREAM_READ_SIZE)
+        if not data:
+            break
+        buffer = data.lstrip()
+        buffer_offset += len(data) - len(buffer)
+    if not buffer.startswith("["):
+        raise Exception("Expected a JSON array")
+    position = 1
+    while True:
+        # Skip the whitespace and commas between items
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer):
+                break
+            buffer_offset += len(buffer)
+            buffer = myfile.read(JSON_STREAM_READ_SIZE)
+            position = 0
+            if not buffer:
+                raise Exception("Truncated JSON array")
+        if buffer[position] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as exc:
+            # An item cut in half by the end of the buffer fails either in a string running up to the end,
+            # or within the few characters of a partial token (such as "fals") at the end
+            cut_off = exc.msg.startswith("Unterminated string") or exc.pos >= len(buffer) - len("false")
+            data = myfile.read(JSON_STREAM_READ_SIZE) if cut_off else ""
+            if not data:
+                raise Exception("Malformed JSON array item at offset {}: {}".format(
+                    buffer_offset + position, exc.msg
+                ))
+            buffer_offset += position
+            buffer = buffer[position:] + data
+            position = 0
+            continue
+        yield item
+        position = end
+
+
+def convert_machine_translated_corpus(
+    source_filename=LEGACY_MACHINE_TRANSLATED_CORPUS_FILENAME, target_filename=MACHINE_TRANSLATED_CORPUS_FILENAME
+):
+    """
+    Streams the legacy single-array machine-translated corpus into the line-delimited format
+    """
+    with open(source_filename, "r", encoding="utf-8") as source, \
+            open(target_filename + ".tmp", "w", encoding="utf-8") as target:
+        for item in iterate_json_array(source):
+            target.write(json.dumps(item, ensure_ascii=False) + "\n")
+    os.replace(target_filename + ".tmp", target_filename)
@@ -0,0 +1,339 @@
+import argparse
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import struct
+import time
+
+from tqdm import tqdm
+
+import dict_helpers
+
+# CONSTANTS
+LEMMA_SNAPSHOT_FILENAME = "lemma_snapshot.bin"
+LEMMA_SNAPSHOT_MAGIC = b"PLLS"
+# Bump whenever the layout of the file or of its records changes
+LEMMA_SNAPSHOT_VERSION = 1
+# Magic, version, source fingerprint (to detect a stale snapshot), number of lemmas, number of headwords,
+# whether inflections are included, start of the key blob and of the payload blob
+LEMMA_SNAPSHOT_HEADER = struct.Struct("<4sI20sIIBQQ")
+# Payload offset and length of a lemma record, in dictionary order
+LEMMA_SNAPSHOT_LEMMA_RECORD = struct.Struct("<QI")
+# Key offset and length, position and number of its lemmas, payload offset and length of its inflections,
+# sorted by headword
+LEMMA_SNAPSHOT_HEADWORD_RECORD = struct.Struct("<IHIHQI")
+# Decodes the JSON records directly, without the input type checks of json.loads()
+SNAPSHOT_RECORD_DECODER = json.JSONDecoder()
+LEMMA_SNAPSHOT_SOURCE_FILENAMES = [
+    dict_helpers.CORPUS_FILENAME, dict_helpers.MACHINE_TRANSLATED_CORPUS_FILENAME, dict_helpers.__file__
+]
+
+
+def fetch_snapshot_source_fingerprint(with_inflections):
+    """
+    Identifies everything the snapshot is made from: the corpora, the processing code
+    and, if inflections are included, the Morfeusz output
+    """
+    source_inputs = [
+        LEMMA_SNAPSHOT_VERSION,
+        [dict_helpers.fingerprint_file(filename) for filename in LEMMA_SNAPSHOT_SOURCE_FILENAMES],
+        dict_helpers.fetch_inflection_cache_key() if with_inflections else None,
+    ]
+    return hashlib.sha1(json.dumps(source_inputs).encode("utf-8")).digest()
+
+
+def encode_lemma(lemma):
+    return json.dumps(
+        [
+            lemma.headword,
+            lemma.morph_cat,
+            lemma.definitions,
+            lemma.dictionary_id,
+            lemma.aspect_form,
+            lemma.aspect_tag,
+            bool(lemma.machine_translated),
+            lemma.cross_references,
+            lemma.links,
+        ],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def decode_lemma(payload):
+    """
+    Rebuilds a lemma from its record. The record already holds the normalised definitions,
+    so the constructor (and the parsing of corpus senses it does) is skipped
+    """
+    (
+        headword, morph_cat, definitions, dictionary_id, aspect_form, aspect_tag, machine_translated,
+        cross_references, links
+    ) = SNAPSHOT_RECORD_DECODER.decode(payload.decode("utf-8"))
+    lemma = dict_helpers.Lemma.__new__(dict_helpers.Lemma)
+    lemma.headword = headword
+    lemma.morph_cat = morph_cat
+    lemma.definitions = tuple(itertools.starmap(dict_helpers.Definition, definitions))
+    lemma.dictionary_id = dictionary_id
+    lemma.aspect_form = aspect_form
+    lemma.aspect_tag = aspect_tag
+    lemma.machine_translated = dict_helpers.MACHINE_TRANSLATED_MESSAGE if machine_translated else ""
+    lemma.cross_references = tuple(itertools.starmap(dict_helpers.CrossReference, cross_references))
+    lemma.links = None if links is None else tuple(itertools.starmap(dict_helpers.ResolvedLink, links))
+    return lemma
+
+
+def encode_derived_forms(derived_forms):
+    return json.dumps(
+        [[derived_form["derived_form"], derived_form["tags"]] for derived_form in derived_forms],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def decode_derived_forms(payload):
+    return [
+        {"derived_form": derived_form, "tags": tags}
+        for derived_form, tags in SNAPSHOT_RECORD_DECODER.decode(payload.decode("utf-8"))
+    ]
+
+
+def write_lemma_snapshot(sorted_lemmas, filename=LEMMA_SNAPSHOT_FILENAME, inflection_cache_path=None):
+    """
+    Writes the sorted (and linked) lemmas to a snapshot, with the inflections of every headword
+    if an inflection cache is given. Lemma records are kept in dictionary order, followed by
+    a headword table sorted by headword and the keys themselves, then the encoded records
+    """
+    # Position of the first lemma of every headword and number of its lemmas
+    headword_groups = {}
+    position = 0
+    for lemmas in dict_helpers.group_lemmas_by_headword(sorted_lemmas):
+        if lemmas[0].headword in headword_groups:
+            raise Exception("The lemmas of {} are not next to each other".format(lemmas[0].headword))
+        headword_groups[lemmas[0].headword] = (position, len(lemmas))
+        position += len(lemmas)
+    with_inflections = inflection_cache_path is not None
+
+    payload = bytearray()
+    lemma_records = []
+    for lemma in tqdm(sorted_lemmas, desc="Encoding lemmas..."):
+        lemma_payload = encode_lemma(lemma)
+        lemma_records.append((len(payload), len(lemma_payload)))
+        payload += lemma_payload
+    headword_records = []
+    headwords = sorted(headword_groups, key=lambda headword: headword.encode("utf-8"))
+    if with_inflections:
+        with dict_helpers.InflectionCache(inflection_cache_path) as cache:
+            for batch in tqdm(
+                dict_helpers.chunks(headwords, dict_helpers.SAFE_DICT_CHUNK),
+                total=-(-len(headwords) // dict_helpers.SAFE_DICT_CHUNK),
+                desc="Encoding inflections..."
+            ):
+                derived_forms_by_headword = dict_helpers.generate_derived_forms_by_headword(batch, cache=cache)
+                for headword in batch:
+                    derived_forms_payload = encode_derived_forms(derived_forms_by_headword[headword])
+                    headword_records.append((headword, len(payload), len(derived_forms_payload)))
+                    payload += derived_forms_payload
+    else:
+        headword_records = [(headword, 0, 0) for headword in headwords]
+
+    keys_start = (
+        LEMMA_SNAPSHOT_HEADER.size + len(sorted_lemmas) * LEMMA_SNAPSHOT_LEMMA_RECORD.size
+        + len(headwords) * LEMMA_SNAPSHOT_HEADWORD_RECORD.size
+    )
+    keys = [headword.encode("utf-8") for headword in headwords]
+    payload_start = keys_start + sum(len(key) for key in keys)
+    with open(filename + ".tmp", "wb") as myfile:
+        myfile.write(LEMMA_SNAPSHOT_HEADER.pack(
+            LEMMA_SNAPSHOT_MAGIC, LEMMA_SNAPSHOT_VERSION, fetch_snapshot_source_fingerprint(with_inflections),
+            len(sorted_lemmas), len(headwords), with_inflections, keys_start, payload_start
+        ))
+        for payload_offset, payload_length in lemma_records:
+            myfile.write(LEMMA_SNAPSHOT_LEMMA_RECORD.pack(payload_offset, payload_length))
+        key_offset = 0
+        for key, (headword, payload_offset, payload_length) in zip(keys, headword_records):
+            position, lemmas_count = headword_groups[headword]
+            myfile.write(LEMMA_SNAPSHOT_HEADWORD_RECORD.pack(
+                key_offset, len(key), position, lemmas_count, payload_offset, payload_length
+            ))
+            key_offset += len(key)
+        for key in keys:
+            myfile.write(key)
+        myfile.write(payload)
+    os.replace(filename + ".tmp", filename)
+    return len(sorted_lemmas)
+
+
+def read_lemma_snapshot_header(filename):
+    with open(filename, "rb") as myfile:
+        header = myfile.read(LEMMA_SNAPSHOT_HEADER.size)
+    if len(header) < LEMMA_SNAPSHOT_HEADER.size:
+        return None
+    return LEMMA_SNAPSHOT_HEADER.unpack(header)
+
+
+def check_lemma_snapshot_is_current(filename=LEMMA_SNAPSHOT_FILENAME, with_inflections=False):
+    """
+    A snapshot is current if it was made by this code from the corpora as they are now,
+    and includes inflections if they are required
+    """
+    if not os.path.exists(filename):
+        return False
+    header = read_lemma_snapshot_header(filename)
+    if header is None:
+        return False
+    magic, version, source_fingerprint, _, _, has_inflections, _, _ = header
+    if magic != LEMMA_SNAPSHOT_MAGIC or version != LEMMA_SNAPSHOT_VERSION:
+        return False
+    if with_inflections and not has_inflections:
+        return False
+    return source_fingerprint == fetch_snapshot_source_fingerprint(bool(has_inflections))
+
+
+class LemmaSnapshot(object):
+    """
+    Read access to a lemma snapshot. The file is memory-mapped and lemmas are only decoded
+    when accessed, by position in dictionary order or by headword (a binary search over the headword table)
+    """
+    def __init__(self, filename=LEMMA_SNAPSHOT_FILENAME):
+        super(LemmaSnapshot, self).__init__()
+        if not check_lemma_snapshot_is_current(filename):
+            raise Exception("{} is missing or out of date with its sources, rebuild it".format(filename))
+        with open(filename, "rb") as myfile:
+            self.snapshot_map = mmap.mmap(myfile.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            _, _, _, self.lemmas_count, self.headwords_count, has_inflections, self.keys_start, self.payload_start
+        ) = LEMMA_SNAPSHOT_HEADER.unpack_from(self.snapshot_map)
+        self.has_inflections = bool(has_inflections)
+        self.headwords_start = LEMMA_SNAPSHOT_HEADER.size + self.lemmas_count * LEMMA_SNAPSHOT_LEMMA_RECORD.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.lemmas_count
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.lemmas_count:
+            raise IndexError(position)
+        payload_offset, payload_length = LEMMA_SNAPSHOT_LEMMA_RECORD.unpack_from(
+            self.snapshot_map, LEMMA_SNAPSHOT_HEADER.size + position * LEMMA_SNAPSHOT_LEMMA_RECORD.size
+        )
+        return decode_lemma(self.read_payload(payload_offset, payload_length))
+
+    def __iter__(self):
+        for position in range(self.lemmas_count):
+            yield self[position]
+
+    def close(self):
+        self.snapshot_map.close()
+
+    def read_payload(self, payload_offset, payload_length):
+        payload_start = self.payload_start + payload_offset
+        return self.snapshot_map[payload_start:payload_start + payload_length]
+
+    def read_headword_record(self, index):
+        key_offset, key_length, position, lemmas_count, payload_offset, payload_length = (
+            LEMMA_SNAPSHOT_HEADWORD_RECORD.unpack_from(
+                self.snapshot_map, self.headwords_start + index * LEMMA_SNAPSHOT_HEADWORD_RECORD.size
+            )
+        )
+        key_start = self.keys_start + key_offset
+        key = self.snapshot_map[key_start:key_start + key_length]
+        return key, position, lemmas_count, payload_offset, payload_length
+
+    def find_headword_record(self, headword):
+        key = headword.encode("utf-8")
+        low = 0
+        high = self.headwords_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.read_headword_record(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.headwords_count:
+            headword_record = self.read_headword_record(low)
+            if headword_record[0] == key:
+                return headword_record
+        return None
+
+    def find(self, headword):
+        """
+        Returns the lemmas of a headword, in dictionary order
+        """
+        headword_record = self.find_headword_record(headword)
+        if headword_record is None:
+            return []
+        _, position, lemmas_count, _, _ = headword_record
+        return [self[position + i] for i in range(lemmas_count)]
+
+    def find_derived_forms(self, headword):
+        """
+        Returns the inflections of a headword, as generate_headword_derived_forms() would
+        """
+        if not self.has_inflections:
+            raise Exception("This snapshot was written without inflections")
+        headword_record = self.find_headword_record(headword)
+        if headword_record is None:
+            return None
+        _, _, _, payload_offset, payload_length = headword_record
+        return decode_derived_forms(self.read_payload(payload_offset, payload_length))
+
+    def iterate_derived_forms(self):
+        """
+        Yields every headword with its inflections, in headword table order
+        """
+        if not self.has_inflections:
+            raise Exception("This snapshot was written without inflections")
+        for index in range(self.headwords_count):
+            key, _, _, payload_offset, payload_length = self.read_headword_record(index)
+            yield key.decode("utf-8"), decode_derived_forms(self.read_payload(payload_offset, payload_length))
+
+
+def build_lemma_snapshot(filename=LEMMA_SNAPSHOT_FILENAME, inflection_cache_path=None, jobs=1):
+    """
+    Processes the corpora the same way the dictionary build does and writes the result to a snapshot,
+    with inflections if an inflection cache is given (the missing ones are generated first)
+    """
+    lemmas, _ = dict_helpers.extract_head_words(dict_helpers.load_corpus())
+    lemmas = dict_helpers.add_machine_translated_lemmas(dict_helpers.read_machine_translated_corpus(), lemmas)
+    sorted_lemmas, _ = dict_helpers.sort_and_number_lemmas(lemmas)
+    dict_helpers.link_lemmas(sorted_lemmas)
+    if inflection_cache_path:
+        dict_helpers.count_derived_forms((lemma.headword for lemma in sorted_lemmas), inflection_cache_path, jobs)
+    return write_lemma_snapshot(sorted_lemmas, filename, inflection_cache_path)
+
+
+def open_lemma_snapshot(filename=LEMMA_SNAPSHOT_FILENAME, inflection_cache_path=None, jobs=1):
+    """
+    Opens the lemma snapshot, (re)building it first if it is missing or out of date with its sources.
+    Inflections are only required (and included in a rebuilt snapshot) if an inflection cache is given
+    """
+    if not check_lemma_snapshot_is_current(filename, with_inflections=inflection_cache_path is not None):
+        build_lemma_snapshot(filename, inflection_cache_path, jobs)
+    return LemmaSnapshot(filename)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prints processed lemmas from the lemma snapshot")
+    parser.add_argument("headwords", nargs="*", help="headwords to look up")
+    parser.add_argument(
+        "--inflection-cache", default=dict_helpers.INFLECTION_CACHE_FILENAME,
+        help="SQLite file caching generated inflections, used if the snapshot has to be rebuilt"
+    )
+    parser.add_argument("--rebuild", action="store_true", help="rebuild the snapshot even if it is up to date")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        build_lemma_snapshot(inflection_cache_path=args.inflection_cache)
+    start_time = time.perf_counter()
+    with open_lemma_snapshot(inflection_cache_path=args.inflection_cache) as lemma_snapshot:
+        print("Opened {} lemmas in {:.3f}s".format(len(lemma_snapshot), time.perf_counter() - start_time))
+        for headword in args.headwords:
+            for lemma in lemma_snapshot.find(headword):
+                print(lemma.generate_lemma_html_entry(derived_forms=lemma_snapshot.find_derived_forms(headword)))
@@ -0,0 +1,160 @@
+import argparse
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from urllib.parse import parse_qs, urlparse
+
+from tqdm import tqdm
+
+import dict_helpers
+from lemma_snapshot import LEMMA_SNAPSHOT_FILENAME, open_lemma_snapshot
+
+# CONSTANTS
+LOOKUP_SERVICE_HOST = "127.0.0.1"
+LOOKUP_SERVICE_PORT = 8765
+
+
+class DictionaryLookup(object):
+    """
+    In-memory indexes over a processed lemma set: headword to lemmas, and inflected form to the
+    headwords it belongs to. Entries are rendered on request exactly as they end up in the HTML
+    dictionary, from the inflections generated once while building the indexes
+    """
+    def __init__(self, sorted_lemmas, lemma_verb_dict, derived_forms):
+        super(DictionaryLookup, self).__init__()
+        self.lemma_verb_dict = lemma_verb_dict
+        self.derived_forms = derived_forms
+        self.lemmas_by_headword = defaultdict(list)
+        for lemma in sorted_lemmas:
+            self.lemmas_by_headword[lemma.headword].append(lemma)
+        self.headwords_by_iform = defaultdict(list)
+        for headword, headword_derived_forms in derived_forms.items():
+            for derived_form in headword_derived_forms:
+                self.headwords_by_iform[derived_form["derived_form"]].append(headword)
+
+    def render_entry(self, lemma):
+        return {
+            "headword": lemma.headword,
+            "morph_cat": lemma.morph_cat,
+            "dictionary_id": lemma.dictionary_id,
+            "html": lemma.generate_lemma_html_entry(self.lemma_verb_dict, self.derived_forms[lemma.headword]),
+        }
+
+    def lookup_headword(self, headword):
+        """
+        Returns the rendered entries of a headword
+        """
+        return [self.render_entry(lemma) for lemma in self.lemmas_by_headword.get(headword, [])]
+
+    def lookup_inflected_form(self, form):
+        """
+        Returns the headwords an inflected form resolves to
+        """
+        return list(self.headwords_by_iform.get(form, []))
+
+    def lookup(self, word):
+        """
+        Answers a lookup as the Kindle would: the entries of the word itself, plus the ones
+        of every headword that it is an inflected form of
+        """
+        inflected_form_of = [headword for headword in self.lookup_inflected_form(word) if headword != word]
+        entries = self.lookup_headword(word)
+        for headword in inflected_form_of:
+            entries.extend(self.lookup_headword(headword))
+        return {"word": word, "inflected_form_of": inflected_form_of, "entries": entries}
+
+
+def load_dictionary_lookup(inflection_cache_path=None, jobs=1):
+    """
+    Processes the corpora the same way the dictionary build does and indexes the result
+    """
+    lemmas, _ = dict_helpers.extract_head_words(dict_helpers.load_corpus())
+    lemmas = dict_helpers.add_machine_translated_lemmas(dict_helpers.read_machine_translated_corpus(), lemmas)
+    sorted_lemmas, lemma_verb_dict = dict_helpers.sort_and_number_lemmas(lemmas)
+    dict_helpers.link_lemmas(sorted_lemmas)
+    derived_forms = {}
+    with dict_helpers.build_inflection_cache_path(inflection_cache_path) as cache_path:
+        dict_helpers.count_derived_forms((lemma.headword for lemma in sorted_lemmas), cache_path, jobs)
+        with dict_helpers.InflectionCache(cache_path) as cache:
+            unique_headwords = list(dict.fromkeys(lemma.headword for lemma in sorted_lemmas))
+            for batch in tqdm(
+                dict_helpers.chunks(unique_headwords, dict_helpers.SAFE_DICT_CHUNK),
+                total=-(-len(unique_headwords) // dict_helpers.SAFE_DICT_CHUNK),
+                desc="Indexing inflections..."
+            ):
+                derived_forms.update(dict_helpers.generate_derived_forms_by_headword(batch, cache=cache))
+    return DictionaryLookup(sorted_lemmas, lemma_verb_dict, derived_forms)
+
+
+def load_dictionary_lookup_from_snapshot(
+    snapshot_filename=LEMMA_SNAPSHOT_FILENAME, inflection_cache_path=dict_helpers.INFLECTION_CACHE_FILENAME, jobs=1
+):
+    """
+    Indexes the lemmas and inflections saved in the lemma snapshot, which is (re)built first
+    if it is missing or out of date with the corpora
+    """
+    with open_lemma_snapshot(snapshot_filename, inflection_cache_path, jobs) as lemma_snapshot:
+        sorted_lemmas = list(tqdm(lemma_snapshot, total=len(lemma_snapshot), desc="Loading lemma snapshot..."))
+        derived_forms = dict(lemma_snapshot.iterate_derived_forms())
+    return DictionaryLookup(sorted_lemmas, dict_helpers.build_verb_lemma_dictionary(sorted_lemmas), derived_forms)
+
+
+class DictionaryLookupHandler(BaseHTTPRequestHandler):
+    """
+    GET /lookup?word=X answers a full lookup, GET /headword?headword=X only returns the entries of
+    a headword and GET /iform?form=X only the headwords an inflected form resolves to
+    """
+    dictionary_lookup = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/lookup" and "word" in query:
+            response = self.dictionary_lookup.lookup(query["word"])
+        elif url.path == "/headword" and "headword" in query:
+            response = self.dictionary_lookup.lookup_headword(query["headword"])
+        elif url.path == "/iform" and "form" in query:
+            response = self.dictionary_lookup.lookup_inflected_form(query["form"])
+        else:
+            self.send_error(404, "Unknown endpoint or missing parameter")
+            return
+        body = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def create_lookup_server(dictionary_lookup, host=LOOKUP_SERVICE_HOST, port=LOOKUP_SERVICE_PORT):
+    handler = type("BoundDictionaryLookupHandler", (DictionaryLookupHandler,), {"dictionary_lookup": dictionary_lookup})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves rendered dictionary entries over a local HTTP endpoint")
+    parser.add_argument("--host", default=LOOKUP_SERVICE_HOST, help="address to listen on")
+    parser.add_argument("--port", type=int, default=LOOKUP_SERVICE_PORT, help="port to listen on")
+    parser.add_argument(
+        "--jobs", type=int, default=1,
+        help="number of worker processes used to generate inflected forms"
+    )
+    parser.add_argument(
+        "--inflection-cache", default=dict_helpers.INFLECTION_CACHE_FILENAME,
+        help="SQLite file caching generated inflections between builds"
+    )
+    parser.add_argument(
+        "--no-snapshot", action="store_true",
+        help="reprocess the corpora instead of loading the lemma snapshot"
+    )
+    args = parser.parse_args()
+
+    if args.no_snapshot:
+        dictionary_lookup = load_dictionary_lookup(args.inflection_cache, args.jobs)
+    else:
+        dictionary_lookup = load_dictionary_lookup_from_snapshot(
+            inflection_cache_path=args.inflection_cache, jobs=args.jobs
+        )
+    lookup_server = create_lookup_server(dictionary_lookup, args.host, args.port)
+    print("Serving lookups on http://{}:{}/lookup?word=...".format(args.host, args.port))
+    lookup_server.serve_forever()
@@ -1,29 +1,142 @@
-import subprocess
-import sys
-from dict_helpers import write_html_dictionary
+import argparse
+import os
 
-create_with_stats = False
-make_mobi_dict = False
+from build_pipeline import (
+    BUILD_CHECKPOINT_DIR,
+    DICTIONARY_VARIANTS,
+    DictionaryBuild,
+    DictionaryVariantsBuild,
+    KINDLEGEN_JOBS,
+    VARIANTS_DIR,
+)
+from dict_helpers import (
+    DICT_CHUNK_IFORM_BUDGET,
+    HTML_TEMPLATE_MODE_DEFAULT,
+    HTML_TEMPLATE_MODES,
+    INFLECTION_CACHE_FILENAME,
+)
 
-if len(sys.argv) > 1 and sys.argv[1] == "stats":
-    create_with_stats = True
-
-
-if len(sys.argv) > 2 and sys.argv[2] == "make":
-    make_mobi_dict = True
-
-
-write_html_dictionary(create_with_stats)
-
-if make_mobi_dict:
-    ret_obj = subprocess.run(
-        [
-            "./kindlegen",
-            "./PL_EN_dict.opf",
-            "-verbose",
-            "-dont_append_source"
-        ]
+parser = argparse.ArgumentParser(description="Builds the Polish-English Kindle dictionary")
+parser.add_argument(
+    "actions", nargs="*", choices=["stats", "make", "stardict"],
+    help="'stats' writes the dictionary stats, 'make' compiles the .mobi file with kindlegen, "
+         "'stardict' also writes the dictionary in the StarDict format"
+)
+parser.add_argument(
+    "--jobs", type=int, default=1,
+    help="number of worker processes used to generate inflected forms"
+)
+parser.add_argument(
+    "--chunk-jobs", type=int, default=1,
+    help="number of worker processes rendering and writing HTML chunks concurrently"
+)
+parser.add_argument(
+    "--chunk-iforms", type=int, default=DICT_CHUNK_IFORM_BUDGET,
+    help="target number of entries plus inflected forms per HTML chunk"
+)
+parser.add_argument(
+    "--inflection-cache", default=INFLECTION_CACHE_FILENAME,
+    help="SQLite file caching generated inflections between builds"
+)
+parser.add_argument(
+    "--no-inflection-cache", action="store_true",
+    help="always regenerate inflections with Morfeusz"
+)
+parser.add_argument(
+    "--incremental", action="store_true",
+    help="only re-render the HTML chunks whose inputs changed since the last build"
+)
+parser.add_argument(
+    "--checkpoint-dir",
+    help="directory holding the state saved after every build stage (default: {}, or {} with --variants)".format(
+        BUILD_CHECKPOINT_DIR, os.path.join(VARIANTS_DIR, BUILD_CHECKPOINT_DIR)
     )
+)
+parser.add_argument(
+    "--no-resume", action="store_true",
+    help="run every build stage, ignoring the checkpoints of previous builds"
+)
+parser.add_argument(
+    "--profile", action="store_true",
+    help="write a CPU profile (.prof) and the peak memory and top allocation sites of every build stage "
+    "that runs (combine with --no-resume to profile them all)"
+)
+parser.add_argument(
+    "--html-mode", choices=sorted(HTML_TEMPLATE_MODES), default=HTML_TEMPLATE_MODE_DEFAULT,
+    help="'compact' strips all formatting whitespace from the HTML, 'readable' keeps it indented for debugging"
+)
+parser.add_argument(
+    "--compare-html-modes", action="store_true",
+    help="also build with the other HTML mode and add the output size (and kindlegen time) of both to the stats"
+)
+parser.add_argument(
+    "--group-headwords", action="store_true",
+    help="render all the entries of a headword (f.e. a noun and a verb) as a single entry with one section each"
+)
+parser.add_argument(
+    "--compare-headword-grouping", action="store_true",
+    help="also build with headword grouping toggled and add the entry counts, output size "
+         "(and kindlegen time and .mobi size) of both to the stats"
+)
+parser.add_argument(
+    "--no-snapshot", action="store_true",
+    help="don't write the lemma snapshot, which other tools load instead of reprocessing the corpora"
+)
+parser.add_argument(
+    "--variants", nargs="+", choices=sorted(DICTIONARY_VARIANTS),
+    help="build these variants of the dictionary (with or without the machine-translated lemmas and the "
+         "derived-only headwords) from a single corpus load and inflection run, each in {}/<variant>".format(
+             VARIANTS_DIR
+         )
+)
+parser.add_argument(
+    "--kindlegen-jobs", type=int, default=KINDLEGEN_JOBS,
+    help="maximum number of variants compiled by kindlegen at the same time"
+)
+args = parser.parse_args()
+
+create_with_stats = "stats" in args.actions
+make_mobi_dict = "make" in args.actions
+make_stardict_dict = "stardict" in args.actions
+if args.variants:
+    unsupported_options = [
+        option for option, is_set in [
+            ("'stardict'", make_stardict_dict),
+            ("--compare-html-modes", args.compare_html_modes),
+            ("--compare-headword-grouping", args.compare_headword_grouping),
+        ] if is_set
+    ]
+    if unsupported_options:
+        parser.error("--variants can't be combined with {}".format(", ".join(unsupported_options)))
 
-    if ret_obj.returncode not in (0, 1):
-        raise Exception("Failed to properly generate the dictionary")
+build_options = dict(
+    jobs=args.jobs,
+    inflection_cache_path=None if args.no_inflection_cache else args.inflection_cache,
+    incremental=args.incremental,
+    chunk_jobs=args.chunk_jobs,
+    chunk_iform_budget=args.chunk_iforms,
+    resume=not args.no_resume,
+    profile=args.profile,
+    html_mode=args.html_mode,
+    group_headwords=args.group_headwords,
+)
+if args.checkpoint_dir:
+    build_options["checkpoint_dir"] = args.checkpoint_dir
+if args.variants:
+    DictionaryVariantsBuild(
+        [DICTIONARY_VARIANTS[variant_name] for variant_name in args.variants],
+        create_with_stats,
+        make_mobi_dict,
+        kindlegen_jobs=args.kindlegen_jobs,
+        **build_options
+    ).run()
+else:
+    DictionaryBuild(
+        create_with_stats,
+        make_mobi_dict,
+        compare_html_modes=args.compare_html_modes,
+        compare_headword_grouping=args.compare_headword_grouping,
+        write_snapshot=not args.no_snapshot,
+        make_stardict_dict=make_stardict_dict,
+        **build_options
+    ).run()
@@ -0,0 +1,254 @@
+import gzip
+import os
+import shutil
+import struct
+import time
+import zlib
+
+from tqdm import tqdm
+
+import dict_helpers
+
+# CONSTANTS
+STARDICT_BASENAME = "PL_EN_dict"
+STARDICT_BOOKNAME = "Polski → English (v. 2.1)"
+STARDICT_DESCRIPTION = "Polish-English dictionary built from Wiktionary (kaikki.org) and SGJP"
+# 2.4.2 is the oldest version supporting .syn files, and the one readers support most widely
+STARDICT_VERSION = "2.4.2"
+STARDICT_IFO_TEMPLATE = """StarDict's dict ifo file
+version={version}
+bookname={bookname}
+wordcount={wordcount}
+synwordcount={synwordcount}
+idxfilesize={idxfilesize}
+sametypesequence=h
+description={description}
+"""
+# Offset and size of an entry within the .dict file, big-endian
+STARDICT_IDX_RECORD = struct.Struct(">II")
+# Position of the headword within the .idx file, big-endian
+STARDICT_SYN_RECORD = struct.Struct(">I")
+# Uncompressed size of every independently decompressible chunk of the .dict.dz file, as dictzip uses
+DICTZIP_CHUNK_LENGTH = 58315
+DICTZIP_COMPRESSION_LEVEL = 9
+# Gzip header with the FEXTRA flag, mtime, XFL (best compression) and OS (Unix)
+DICTZIP_GZIP_HEADER = struct.Struct("<2sBBIBB")
+# Random access subfield: ID, length, version, chunk length and chunk count, followed by the chunk sizes
+DICTZIP_RA_HEADER = struct.Struct("<2sHHHH")
+DICTZIP_MAX_CHUNKS = (0xFFFF - DICTZIP_RA_HEADER.size) // 2
+
+STARDICT_ENTRY_TEMPLATE = "<b>{word}</b>{sections}"
+STARDICT_SECTION_TEMPLATE = "<div><i>{morph}</i></div><ol>{definitions}</ol>{cross_references}{machine_translated}"
+STARDICT_CROSS_REFERENCE_TEMPLATE = '<div>{label}: <a href="bword://{headword}">{headword}</a></div>'
+
+
+def stardict_sort_key(word):
+    """
+    The order StarDict readers binary search the index in: ASCII case-insensitive comparison
+    of the UTF-8 bytes, ties broken by plain byte comparison
+    """
+    encoded = word.encode("utf-8")
+    return encoded.lower(), encoded
+
+
+class DictzipWriter(object):
+    """
+    Streams data to a dictzip file: a gzip file made of independently compressed chunks, listed in
+    the header, so that readers can decompress any entry without inflating everything before it.
+    The chunks go to a temporary file first, since the header holding their sizes comes before them
+    """
+    def __init__(self, filename, chunk_length=DICTZIP_CHUNK_LENGTH):
+        super(DictzipWriter, self).__init__()
+        self.filename = filename
+        self.chunk_length = chunk_length
+        self.body_file = open(filename + ".body.tmp", "wb")
+        self.compressor = zlib.compressobj(DICTZIP_COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.pending = bytearray()
+        self.chunk_sizes = []
+        self.crc = 0
+        self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.body_file.close()
+            os.remove(self.filename + ".body.tmp")
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.pending += data
+        while len(self.pending) >= self.chunk_length:
+            self.write_chunk(self.pending[:self.chunk_length], zlib.Z_FULL_FLUSH)
+            del self.pending[:self.chunk_length]
+
+    def write_chunk(self, data, flush_mode):
+        compressed = self.compressor.compress(data) + self.compressor.flush(flush_mode)
+        self.body_file.write(compressed)
+        self.chunk_sizes.append(len(compressed))
+        if len(self.chunk_sizes) > DICTZIP_MAX_CHUNKS:
+            raise Exception("Too much data for a single dictzip file")
+
+    def close(self):
+        self.write_chunk(self.pending, zlib.Z_FINISH)
+        self.body_file.close()
+        random_access = DICTZIP_RA_HEADER.pack(
+            b"RA", 6 + 2 * len(self.chunk_sizes), 1, self.chunk_length, len(self.chunk_sizes)
+        ) + struct.pack("<{}H".format(len(self.chunk_sizes)), *self.chunk_sizes)
+        with open(self.filename + ".tmp", "wb") as myfile:
+            myfile.write(DICTZIP_GZIP_HEADER.pack(b"\x1f\x8b", 8, gzip.FEXTRA, 0, 2, 3))
+            myfile.write(struct.pack("<H", len(random_access)) + random_access)
+            with open(self.filename + ".body.tmp", "rb") as body_file:
+                shutil.copyfileobj(body_file, myfile)
+            myfile.write(struct.pack("<II", self.crc, self.size & 0xFFFFFFFF))
+        os.remove(self.filename + ".body.tmp")
+        os.replace(self.filename + ".tmp", self.filename)
+
+
+class PlainDictWriter(object):
+    """
+    Streams data to an uncompressed .dict file, put in place once complete
+    """
+    def __init__(self, filename):
+        super(PlainDictWriter, self).__init__()
+        self.filename = filename
+        self.myfile = open(filename + ".tmp", "wb", buffering=dict_helpers.HTML_WRITE_BUFFER_SIZE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        self.myfile.close()
+        if exc_type is None:
+            os.replace(self.filename + ".tmp", self.filename)
+        else:
+            os.remove(self.filename + ".tmp")
+
+    def write(self, data):
+        self.myfile.write(data)
+
+
+def generate_stardict_cross_references_html(lemma, lemma_verb_dict):
+    cross_references_html = []
+    for link in lemma.find_links(lemma_verb_dict):
+        if link.kind == dict_helpers.CROSS_REFERENCE_ASPECT:
+            label = "{} form".format(link.tag)
+        elif link.target_id:
+            label = dict_helpers.CROSS_REFERENCE_LABELS[link.kind]
+        else:
+            continue
+        cross_references_html.append(STARDICT_CROSS_REFERENCE_TEMPLATE.format(label=label, headword=link.headword))
+    return "".join(cross_references_html)
+
+
+def generate_stardict_entry(lemmas, lemma_verb_dict):
+    """
+    Renders all the lemmas of a headword as a single StarDict entry, one section per lemma.
+    Links point to headwords, which is how StarDict readers resolve them
+    """
+    return STARDICT_ENTRY_TEMPLATE.format(
+        word=lemmas[0].headword,
+        sections="".join(
+            STARDICT_SECTION_TEMPLATE.format(
+                morph=lemma.morph_cat.capitalize(),
+                definitions="".join(lemma.generate_definitions_html_list(dict_helpers.COMPACT_HTML_TEMPLATES)),
+                cross_references=generate_stardict_cross_references_html(lemma, lemma_verb_dict),
+                machine_translated=lemma.machine_translated,
+            ) for lemma in lemmas
+        ),
+    )
+
+
+def write_stardict_dictionary(
+    sorted_lemmas, lemma_verb_dict, inflection_cache_path, basename=STARDICT_BASENAME, compress=True
+):
+    """
+    Writes the lemmas as a StarDict dictionary: .ifo, .idx, .dict(.dz) and .syn, the latter mapping
+    every inflected form to its headword. Headwords are put in StarDict order first, then every entry
+    is rendered, appended to the .dict file and indexed in a single streaming pass.
+    Returns the build stats
+    """
+    start_time = time.perf_counter()
+    lemma_groups = dict_helpers.group_lemmas_by_headword(sorted_lemmas)
+    lemma_groups.sort(key=lambda lemmas: stardict_sort_key(lemmas[0].headword))
+    dict_filename = basename + (".dict.dz" if compress else ".dict")
+    dict_writer = DictzipWriter(dict_filename) if compress else PlainDictWriter(dict_filename)
+    synonyms = []
+    dict_offset = 0
+    with dict_writer, open(basename + ".idx.tmp", "wb") as idx_file, \
+            dict_helpers.InflectionCache(inflection_cache_path) as cache:
+        for batch_start in tqdm(
+            range(0, len(lemma_groups), dict_helpers.SAFE_DICT_CHUNK), desc="Writing StarDict entries..."
+        ):
+            batch = lemma_groups[batch_start:batch_start + dict_helpers.SAFE_DICT_CHUNK]
+            derived_forms = dict_helpers.generate_derived_forms_by_headword(
+                (lemmas[0].headword for lemmas in batch), cache=cache
+            )
+            for word_index, lemmas in enumerate(batch, start=batch_start):
+                headword = lemmas[0].headword
+                entry = generate_stardict_entry(lemmas, lemma_verb_dict).encode("utf-8")
+                dict_writer.write(entry)
+                idx_file.write(headword.encode("utf-8") + b"\0" + STARDICT_IDX_RECORD.pack(dict_offset, len(entry)))
+                dict_offset += len(entry)
+                synonyms.extend(
+                    (derived_form["derived_form"], word_index) for derived_form in derived_forms[headword]
+                    if derived_form["derived_form"] != headword
+                )
+        idx_size = idx_file.tell()
+    if dict_offset > 0xFFFFFFFF:
+        raise Exception("The dictionary data is too large for 32-bit .idx offsets")
+    os.replace(basename + ".idx.tmp", basename + ".idx")
+
+    synonyms.sort(key=lambda synonym: stardict_sort_key(synonym[0]))
+    with open(basename + ".syn.tmp", "wb") as syn_file:
+        for synonym, word_index in synonyms:
+            syn_file.write(synonym.encode("utf-8") + b"\0" + STARDICT_SYN_RECORD.pack(word_index))
+    os.replace(basename + ".syn.tmp", basename + ".syn")
+
+    with open(basename + ".ifo", "w", encoding="utf-8") as myfile:
+        myfile.write(STARDICT_IFO_TEMPLATE.format(
+            version=STARDICT_VERSION,
+            bookname=STARDICT_BOOKNAME,
+            wordcount=len(lemma_groups),
+            synwordcount=len(synonyms),
+            idxfilesize=idx_size,
+            description=STARDICT_DESCRIPTION,
+        ))
+    return {
+        "stardict_words_count": len(lemma_groups),
+        "stardict_synonyms_count": len(synonyms),
+        "stardict_dict_bytes": os.path.getsize(dict_filename),
+        "stardict_seconds": round(time.perf_counter() - start_time, 2),
+    }
+
+
+def read_stardict_index(idx_data, record=STARDICT_IDX_RECORD):
+    """
+    Parses the records of a .idx (or, with the .syn record, of a .syn) file, as (word, values) tuples
+    """
+    position = 0
+    while position < len(idx_data):
+        word_end = idx_data.index(b"\0", position)
+        values = record.unpack_from(idx_data, word_end + 1)
+        yield idx_data[position:word_end].decode("utf-8"), values
+        position = word_end + 1 + record.size
+
+
+def read_dictzip_chunk(filename, chunk_no):
+    """
+    Decompresses a single chunk of a dictzip file, as a reader looking up an entry would
+    """
+    with open(filename, "rb") as myfile:
+        header = myfile.read(DICTZIP_GZIP_HEADER.size + 2)
+        extra_length = struct.unpack_from("<H", header, DICTZIP_GZIP_HEADER.size)[0]
+        extra = myfile.read(extra_length)
+        _, _, _, chunk_length, chunks_count = DICTZIP_RA_HEADER.unpack_from(extra)
+        chunk_sizes = struct.unpack_from("<{}H".format(chunks_count), extra, DICTZIP_RA_HEADER.size)
+        myfile.seek(sum(chunk_sizes[:chunk_no]), os.SEEK_CUR)
+        compressed = myfile.read(chunk_sizes[chunk_no])
+    return zlib.decompressobj(-zlib.MAX_WBITS).decompress(compressed)
+
@@ -1,13 +1,69 @@
+import gzip
+import io
+import json
+import locale
+import multiprocessing
+import os
+import pickle
+import pstats
+import re
+import shutil
+import subprocess
+import sys
+import threading
+from urllib.request import urlopen
+
+import pytest
+
+import dict_helpers
+import lemma_snapshot as lemma_snapshot_module
+import stardict_writer
+from benchmark_dictionary import generate_synthetic_corpus, run_benchmark
+from build_pipeline import DICTIONARY_VARIANTS, DictionaryBuild, DictionaryVariantsBuild
+from corpus_index import CorpusIndex, open_corpus_index
+from coverage_analyzer import analyze_text_coverage, build_form_index
 from dict_helpers import (
+    add_machine_translated_lemmas,
     build_lemma_from_corpus_entry,
     build_verb_lemma_dictionary,
     check_lemma_is_invalid,
-    DISCARDED_INVALID_POS_VARNAME,
+    COMPACT_HTML_TEMPLATES,
+    configure_morfeusz,
+    create_html_dictionary,
+    Definition,
+    DICTIONARY_BODY_TEMPLATE,
     DISCARDED_DERIVED_VARNAME,
+    DISCARDED_INVALID_POS_VARNAME,
     extract_corpus_entry_data,
     extract_head_words,
+    fetch_inflection_cache_key,
+    fingerprint_file,
+    generate_derived_forms_by_headword,
+    generate_headword_html_entry,
+    get_morfeusz,
+    HTML_TEMPLATE_MODE_READABLE,
+    InflectionCache,
+    init_inflection_worker,
+    link_lemmas,
+    load_corpus,
+    LOCALE_NAME,
+    MORFEUSZ_OPTIONS,
+    MORFEUSZ_STATE,
+    plan_dictionary_chunks,
+    read_discarded_entries,
+    read_machine_translated_corpus,
     sort_headwords,
     WIKTIONARY_HEAD_WORD_TYPES_TO_IGNORE,
+    write_html_dictionary_chunk,
+)
+from lemma_snapshot import LemmaSnapshot, open_lemma_snapshot
+from lookup_service import create_lookup_server, load_dictionary_lookup, load_dictionary_lookup_from_snapshot
+from stardict_writer import (
+    DictzipWriter,
+    read_dictzip_chunk,
+    read_stardict_index,
+    stardict_sort_key,
+    STARDICT_SYN_RECORD,
 )
 
 TEST_FULL_NOUN_ENTRY = {
@@ -217,6 +273,61 @@ def test_sort_headwords():
     assert sort_headwords(scrambled_chars) == expected_order
 
 
+TEST_COLLATION_WORDS = [
+    "psy",
+    "Pies",
+    "pies ogrodnika",
+    "pięć",
+    "piesek",
+    "pies",
+    "Łódź",
+    "łoś",
+    "lody",
+    "éa",
+    "eb",
+    "ea",
+    "2 maja",
+    "żaba",
+    "źle",
+    "zebra",
+]
+
+
+def test_sort_headwords_multi_level():
+    assert sort_headwords(TEST_COLLATION_WORDS) == [
+        "2 maja",
+        "ea",
+        "éa",
+        "eb",
+        "lody",
+        "łoś",
+        "Łódź",
+        "pies",
+        "Pies",
+        "piesek",
+        "pies ogrodnika",
+        "pięć",
+        "psy",
+        "zebra",
+        "źle",
+        "żaba",
+    ]
+
+
+def _has_polish_locale():
+    try:
+        locale.setlocale(locale.LC_COLLATE, LOCALE_NAME)
+    except locale.Error:
+        return False
+    return True
+
+
+@pytest.mark.skipif(not _has_polish_locale(), reason="Polish locale not installed")
+def test_sort_headwords_matches_locale():
+    locale.setlocale(locale.LC_COLLATE, LOCALE_NAME)
+    assert sort_headwords(TEST_COLLATION_WORDS) == sorted(TEST_COLLATION_WORDS, key=locale.strxfrm)
+
+
 def test_extract_corpus_entry_data():
     expected_result = (
         "noun",
@@ -236,11 +347,12 @@ def test_build_lemma_from_corpus_entry():
 
     assert lemma.headword == "pies"
     assert lemma.morph_cat == "noun"
-    assert lemma.meanings == [
-        {'tags': ['animate', 'masculine'], 'glosses': ['A dog (Canis lupus familiaris).'], 'id': 'pies-noun-zipbMNBV'},
-        {'tags': ['animate', 'masculine'], 'glosses': ['A male dog.'], 'id': 'pies-noun-DJsfS6hT'},
-        {'categories': ['Hunting'], 'topics': ['agriculture', 'hunting', 'lifestyle'], 'tags': ['animate', 'masculine'], 'glosses': ['A male fox or badger.'], 'id': 'pies-noun-3fKPhsEA'}
+    assert [definition.definition for definition in lemma.definitions] == [
+        'A dog (Canis lupus familiaris).',
+        'A male dog.',
+        'A male fox or badger.'
     ]
+    assert not hasattr(lemma, "__dict__")
 
 
 def test_check_lemma_is_invalid():
@@ -262,50 +374,104 @@ def test_extract_head_words():
     ]
     extracted, discarded = extract_head_words(corpus)
     assert len(extracted) == 1
-    assert len(discarded[DISCARDED_DERIVED_VARNAME]) == 1
-    assert len(discarded[DISCARDED_INVALID_POS_VARNAME]) == 1
     assert discarded[DISCARDED_DERIVED_VARNAME + "_count"] == 1
     assert discarded[DISCARDED_INVALID_POS_VARNAME + "_count"] == 1
     assert extracted[0].headword == "pies"
     assert extracted[0].morph_cat == "noun"
-    assert extracted[0].meanings == [
-        {'tags': ['animate', 'masculine'], 'glosses': ['A dog (Canis lupus familiaris).'], 'id': 'pies-noun-zipbMNBV'},
-        {'tags': ['animate', 'masculine'], 'glosses': ['A male dog.'], 'id': 'pies-noun-DJsfS6hT'},
-        {'categories': ['Hunting'], 'topics': ['agriculture', 'hunting', 'lifestyle'], 'tags': ['animate', 'masculine'], 'glosses': ['A male fox or badger.'], 'id': 'pies-noun-3fKPhsEA'}
+    assert [definition.definition for definition in extracted[0].definitions] == [
+        'A dog (Canis lupus familiaris).',
+        'A male dog.',
+        'A male fox or badger.'
     ]
-    assert discarded[DISCARDED_DERIVED_VARNAME][0] == TEST_DERIVED_ENTRY
-    assert discarded[DISCARDED_INVALID_POS_VARNAME][0] == TEST_INVALID_POS_ENTRY
+
+
+def test_extract_head_words_streams_discarded_entries(tmp_path):
+    discarded_entries_filename = str(tmp_path / "discarded_entries.jsonl.gz")
+    corpus = [TEST_FULL_NOUN_ENTRY, TEST_DERIVED_ENTRY, TEST_INVALID_POS_ENTRY]
+    _, discarded = extract_head_words(corpus, discarded_entries_filename)
+    assert discarded == {DISCARDED_INVALID_POS_VARNAME + "_count": 1, DISCARDED_DERIVED_VARNAME + "_count": 1}
+    assert list(read_discarded_entries(discarded_entries_filename)) == [
+        {"reason": DISCARDED_DERIVED_VARNAME, "entry": TEST_DERIVED_ENTRY},
+        {"reason": DISCARDED_INVALID_POS_VARNAME, "entry": TEST_INVALID_POS_ENTRY},
+    ]
+    assert [
+        record["entry"] for record in read_discarded_entries(discarded_entries_filename, DISCARDED_DERIVED_VARNAME)
+    ] == [TEST_DERIVED_ENTRY]
+
+
+def test_add_machine_translated_lemmas():
+    base_lemmas, _ = extract_head_words([TEST_FULL_NOUN_ENTRY])
+    machine_translated_corpus = iter([
+        {"entry": "Pies", "abbr_pos": "rz.", "translation": "Dog"},
+        {"entry": "kotek", "abbr_pos": "rz.", "translation": "kitty"},
+        {"entry": "Kotek", "abbr_pos": "rz.", "translation": "Kitty"},
+        {"entry": "radio", "abbr_pos": "rz.", "translation": "Radio"},
+    ])
+    lemmas = add_machine_translated_lemmas(machine_translated_corpus, base_lemmas)
+    assert [(lemma.headword, lemma.machine_translated != "") for lemma in lemmas] == [("pies", False), ("kotek", True)]
+
+
+def test_read_machine_translated_corpus_converts_legacy_format(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(dict_helpers, "JSON_STREAM_READ_SIZE", 16)
+    items = [{"entry": "kotek", "abbr_pos": "rz.", "translation": "kitty, [cat]"}, {"entry": "żółw", "abbr_pos": "rz."}]
+    (tmp_path / dict_helpers.LEGACY_MACHINE_TRANSLATED_CORPUS_FILENAME).write_text(
+        json.dumps(items, indent=2, ensure_ascii=False), encoding="utf-8"
+    )
+    assert list(read_machine_translated_corpus()) == items
+    assert (tmp_path / dict_helpers.MACHINE_TRANSLATED_CORPUS_FILENAME).read_text(encoding="utf-8").count("\n") == 2
+    assert list(read_machine_translated_corpus()) == items
+
+
+def test_iterate_json_array_stops_at_a_malformed_item(monkeypatch):
+    monkeypatch.setattr(dict_helpers, "JSON_STREAM_READ_SIZE", 16)
+    text = '[{"a": "kot"}, {"a": 1 x}, ' + ", ".join('{"a": "kot"}' for _ in range(1000)) + "]"
+    reads = []
+
+    class CountingReader(object):
+        def __init__(self):
+            self.myfile = io.StringIO(text)
+
+        def read(self, size):
+            reads.append(size)
+            return self.myfile.read(size)
+
+    items = dict_helpers.iterate_json_array(CountingReader())
+    assert next(items) == {"a": "kot"}
+    with pytest.raises(Exception, match="Malformed JSON array item at offset 15"):
+        next(items)
+    assert len(reads) < 5
+
+
+def test_load_corpus_streams_entries(tmp_path):
+    corpus_file = tmp_path / "corpus.json"
+    corpus_file.write_text(
+        "\n".join(json.dumps(entry) for entry in [TEST_FULL_NOUN_ENTRY, TEST_DERIVED_ENTRY]) + "\n\n",
+        encoding="utf-8"
+    )
+    corpus = load_corpus(str(corpus_file))
+    assert not isinstance(corpus, list)
+    assert next(corpus) == TEST_FULL_NOUN_ENTRY
+
+    extracted, discarded = extract_head_words(load_corpus(str(corpus_file)))
+    assert [lemma.headword for lemma in extracted] == ["pies"]
+    assert discarded[DISCARDED_DERIVED_VARNAME + "_count"] == 1
 
 
 def test_lemma_definitions():
     entry = TEST_FULL_NOUN_ENTRY
     lemma = build_lemma_from_corpus_entry(entry)
-    assert lemma.definitions == [
-        {
-            "definition": 'A dog (Canis lupus familiaris).',
-            "derived": False,
-            "derived_from": []
-        },
-        {
-            "definition": 'A male dog.',
-            "derived": False,
-            "derived_from": []
-        },
-        {
-            "definition": 'A male fox or badger.',
-            "derived": False,
-            "derived_from": []
-        },
-    ]
+    assert lemma.definitions == (
+        Definition(definition='A dog (Canis lupus familiaris).', derived=False, derived_from=""),
+        Definition(definition='A male dog.', derived=False, derived_from=""),
+        Definition(definition='A male fox or badger.', derived=False, derived_from=""),
+    )
     entry = TEST_DERIVED_ENTRY
     lemma = build_lemma_from_corpus_entry(entry)
-    assert lemma.definitions == [
-        {
-            "definition": 'accusative/genitive singular of pies',
-            "derived": True,
-            "derived_from": "pies"
-        },
-    ]
+    assert lemma.definitions == (
+        Definition(definition='accusative/genitive singular of pies', derived=True, derived_from="pies"),
+    )
+    assert lemma.definitions is lemma.definitions
 
 
 def test_find_correct_linked_aspect_entry():
@@ -319,6 +485,36 @@ def test_find_correct_linked_aspect_entry():
     assert lemma2.find_alternative_aspect(lemma_verb_dict) == ('', '', '')
 
 
+def test_link_lemmas():
+    piesek_entry = {"pos": "noun", "word": "piesek", "senses": [{"glosses": ["doggy"]}]}
+    piesek_adjective_entry = {"pos": "adj", "word": "piesek", "senses": [{"glosses": ["doggish"]}]}
+    podjac_noun_entry = {"pos": "noun", "word": "podjąć", "senses": [{"glosses": ["not a verb"]}]}
+    podjac_entry = {"pos": "verb", "word": "podjąć", "senses": [{"glosses": ["to take up"]}]}
+    podjac_linked_entry = dict(
+        podjac_entry, forms=[{"form": "podejmować", "tags": ["imperfective"]}], senses=[{"glosses": ["to pick up"]}]
+    )
+    lemmas = [
+        build_lemma_from_corpus_entry(entry, dictionary_id=i) for i, entry in enumerate([
+            TEST_FULL_NOUN_ENTRY, piesek_adjective_entry, piesek_entry, TEST_VERB_W_SYNONYMS_ENTRY,
+            podjac_noun_entry, podjac_entry, podjac_linked_entry,
+        ], start=1)
+    ]
+    link_counts = link_lemmas(lemmas)
+    assert link_counts == {
+        "aspect": {"resolved": 2, "unresolved": 0},
+        "diminutive": {"resolved": 1, "unresolved": 0},
+        "augmentative": {"resolved": 0, "unresolved": 1},
+    }
+    # Same POS as the noun, the verb that links back, and the verb itself from the other side
+    assert [link.target_id for link in lemmas[0].links] == ["3", ""]
+    assert lemmas[3].links[0].target_id == "7"
+    assert lemmas[6].links[0].target_id == "4"
+
+    entry_html = lemmas[0].generate_lemma_html_entry(derived_forms=[])
+    assert '<div>diminutive form: <a href="3">piesek</a></div>' in entry_html
+    assert "psisko" not in entry_html
+
+
 def test_lemma_generate_noun_lemma_html_entry():
     entry = TEST_FULL_NOUN_ENTRY
     lemma = build_lemma_from_corpus_entry(entry)
@@ -441,3 +637,562 @@ def test_lemma_generate_verb_lemma_html_entry():
         '\n    </ol></div>' +\
         '\n    \n    <div>frequentative form: <a href="">miewać</a></div>' +\
         '\n    \n    \n    </idx:short>\n    </idx:entry>\n    '
+
+
+def test_parallel_derived_forms_match_serial():
+    lemmas = [
+        build_lemma_from_corpus_entry(entry)
+        for entry in [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY, TEST_VERB_W_SYNONYMS_ENTRY, TEST_FULL_NOUN_ENTRY]
+    ]
+    headwords = [lemma.headword for lemma in lemmas]
+    serial = generate_derived_forms_by_headword(headwords)
+    with multiprocessing.Pool(2, initializer=init_inflection_worker) as pool:
+        parallel = generate_derived_forms_by_headword(headwords, pool)
+    assert list(parallel) == ["pies", "mieć", "podejmować"]
+    assert parallel == serial
+    for lemma in lemmas:
+        assert lemma.generate_lemma_html_entry(derived_forms=parallel[lemma.headword]) == \
+            lemma.generate_lemma_html_entry()
+
+
+def test_inflection_cache(tmp_path):
+    cache_file = str(tmp_path / "inflections.sqlite")
+    with InflectionCache(cache_file, cache_key="key1") as cache:
+        generated = generate_derived_forms_by_headword(["pies", "mieć"], cache=cache)
+        assert cache.counts == {"hits": 0, "misses": 2}
+    with InflectionCache(cache_file, cache_key="key1") as cache:
+        assert generate_derived_forms_by_headword(["mieć", "pies"], cache=cache) == generated
+        assert cache.counts == {"hits": 2, "misses": 0}
+    with InflectionCache(cache_file, cache_key="key2") as cache:
+        assert cache.get_many(["pies", "mieć"]) == {}
+        assert cache.counts == {"hits": 0, "misses": 2}
+
+
+def test_morfeusz_is_created_lazily():
+    imported = subprocess.run(
+        [sys.executable, "-c", "import dict_helpers; print(dict_helpers.MORFEUSZ_STATE['instance'])"],
+        capture_output=True, text=True, check=True,
+    )
+    assert imported.stdout.strip() == "None"
+
+
+def test_configure_morfeusz():
+    default_morfeusz = get_morfeusz()
+    assert get_morfeusz() is default_morfeusz
+    default_key = fetch_inflection_cache_key()
+    try:
+        configure_morfeusz(praet="split")
+        assert MORFEUSZ_STATE["instance"] is None
+        assert fetch_inflection_cache_key() != default_key
+        assert get_morfeusz() is not default_morfeusz
+    finally:
+        configure_morfeusz()
+    assert MORFEUSZ_STATE["options"] == MORFEUSZ_OPTIONS
+    assert fetch_inflection_cache_key() == default_key
+
+
+def test_write_html_dictionary_chunk(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    lemmas = [build_lemma_from_corpus_entry(entry) for entry in [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_SYNONYMS_ENTRY]]
+    derived_forms = generate_derived_forms_by_headword(lemma.headword for lemma in lemmas)
+    lines = write_html_dictionary_chunk(lemmas, "1", {}, derived_forms)
+
+    expected = DICTIONARY_BODY_TEMPLATE.format(
+        dict_body="<hr>".join(lemma.generate_lemma_html_entry() for lemma in lemmas)
+    )
+    assert (tmp_path / "PL_EN_dict1.html").read_text(encoding="utf-8") == expected
+    assert lines == expected.count("\n")
+    assert write_html_dictionary_chunk(lemmas, "2", {}, derived_forms, write=False) == lines
+    assert not (tmp_path / "PL_EN_dict2.html").exists()
+
+
+def test_compact_html_mode(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    entries = [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY, TEST_VERB_W_SYNONYMS_ENTRY]
+    lemmas = [build_lemma_from_corpus_entry(entry) for entry in entries]
+    lemma_verb_dict = build_verb_lemma_dictionary(lemmas)
+    derived_forms = generate_derived_forms_by_headword(lemma.headword for lemma in lemmas)
+    write_html_dictionary_chunk(lemmas, "1", lemma_verb_dict, derived_forms)
+    write_html_dictionary_chunk(lemmas, "2", lemma_verb_dict, derived_forms, templates=COMPACT_HTML_TEMPLATES)
+    readable_html = (tmp_path / "PL_EN_dict1.html").read_text(encoding="utf-8")
+    compact_html = (tmp_path / "PL_EN_dict2.html").read_text(encoding="utf-8")
+
+    assert len(compact_html) < len(readable_html)
+    assert compact_html.startswith(COMPACT_HTML_TEMPLATES.body_header)
+    assert compact_html.count("\n") == len(lemmas) - 1
+    # Same markup and text, only the formatting whitespace differs
+    def normalize(html):
+        return re.sub(r"\s*([<>])\s*", r"\1", re.sub(r"\s+", " ", html))
+    assert normalize(readable_html) == normalize(compact_html)
+
+
+def test_group_headwords(tmp_path, monkeypatch):
+    monkeypatch.setattr(dict_helpers, "fetch_current_git_hash", lambda: "abc123")
+    entries = [TEST_FULL_NOUN_ENTRY, dict(TEST_FULL_NOUN_ENTRY, pos="adj"), TEST_VERB_W_CONJ_ENTRY]
+    setup_test_build(tmp_path, monkeypatch, entries)
+    sorted_lemmas, lemma_verb_dict = create_html_dictionary(create_with_stats=True, group_headwords=True)
+    grouped_html = (tmp_path / "PL_EN_dict1.html").read_text(encoding="utf-8")
+
+    pies_derived_forms = generate_derived_forms_by_headword(["pies"])["pies"]
+    pies_lemmas = [lemma for lemma in sorted_lemmas if lemma.headword == "pies"]
+    assert grouped_html.count("<idx:entry") == 2
+    assert grouped_html.count('value="psa"') == 1
+    assert generate_headword_html_entry(
+        pies_lemmas, lemma_verb_dict, pies_derived_forms, COMPACT_HTML_TEMPLATES
+    ) in grouped_html
+    # Every lemma keeps its own anchor, so that links to it still resolve
+    for lemma in sorted_lemmas:
+        assert '<a id="{}"></a>'.format(lemma.dictionary_id) in grouped_html
+    mieć_lemma = next(lemma for lemma in sorted_lemmas if lemma.headword == "mieć")
+    assert generate_headword_html_entry([mieć_lemma], lemma_verb_dict) == mieć_lemma.generate_lemma_html_entry(
+        lemma_verb_dict
+    )
+
+    stats = json.loads((tmp_path / "dictionary_stats_abc123.json").read_text(encoding="utf-8"))
+    assert stats["entries_count"] == 2
+    assert stats["merged_entries"] == 1
+    assert stats["merged_iforms"] == len(pies_derived_forms)
+
+    # The lemmas of a headword are never split across chunks
+    chunks = plan_dictionary_chunks(sorted_lemmas, {"pies": 10, "mieć": 10}, 12, group_headwords=True)
+    assert [[lemma.headword for lemma in chunk] for chunk in chunks] == [["mieć"], ["pies", "pies"]]
+
+
+def write_test_corpus(directory, entries, machine_translated=()):
+    with open(directory / dict_helpers.CORPUS_FILENAME, "w", encoding="utf-8") as myfile:
+        for entry in entries:
+            myfile.write(json.dumps(entry) + "\n")
+    with open(directory / dict_helpers.MACHINE_TRANSLATED_CORPUS_FILENAME, "w", encoding="utf-8") as myfile:
+        for item in machine_translated:
+            myfile.write(json.dumps(item) + "\n")
+
+
+def setup_test_build(tmp_path, monkeypatch, entries, machine_translated=(), with_kindlegen=False):
+    """
+    Runs the rest of the test from tmp_path, holding the given corpora and, optionally,
+    a stand-in for kindlegen only producing the .mobi file next to the OPF file
+    """
+    monkeypatch.chdir(tmp_path)
+    write_test_corpus(tmp_path, entries, machine_translated)
+    if with_kindlegen:
+        kindlegen = tmp_path / "kindlegen"
+        kindlegen.write_text('#!/bin/sh\necho mobi > "${1%.opf}.mobi"\n')
+        kindlegen.chmod(0o755)
+
+
+def test_incremental_rebuild_reuses_unchanged_chunks(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(dict_helpers, "SAFE_DICT_CHUNK", 1)
+    entries = [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY, TEST_VERB_W_SYNONYMS_ENTRY]
+    setup_test_build(tmp_path, monkeypatch, entries)
+    create_html_dictionary(incremental=True)
+    first_build = {n: (tmp_path / "PL_EN_dict{}.html".format(n)).read_text(encoding="utf-8") for n in (1, 2, 3)}
+    capsys.readouterr()
+
+    create_html_dictionary(incremental=True)
+    assert "Reused chunks: 1, 2, 3" in capsys.readouterr().out
+
+    changed_verb = dict(TEST_VERB_W_CONJ_ENTRY, senses=[{"glosses": ["to own"]}])
+    write_test_corpus(tmp_path, [TEST_FULL_NOUN_ENTRY, changed_verb, TEST_VERB_W_SYNONYMS_ENTRY])
+    create_html_dictionary(incremental=True)
+    assert "Reused chunks: 2, 3" in capsys.readouterr().out
+    assert (tmp_path / "PL_EN_dict1.html").read_text(encoding="utf-8") != first_build[1]
+    assert (tmp_path / "PL_EN_dict2.html").read_text(encoding="utf-8") == first_build[2]
+
+
+def test_parallel_chunk_rendering(tmp_path, monkeypatch):
+    monkeypatch.setattr(dict_helpers, "SAFE_DICT_CHUNK", 1)
+    setup_test_build(tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY, TEST_VERB_W_SYNONYMS_ENTRY])
+    create_html_dictionary()
+    serial_build = [(tmp_path / "PL_EN_dict{}.html".format(n)).read_text(encoding="utf-8") for n in (1, 2, 3)]
+    create_html_dictionary(chunk_jobs=2)
+    assert [(tmp_path / "PL_EN_dict{}.html".format(n)).read_text(encoding="utf-8") for n in (1, 2, 3)] == serial_build
+
+    for n in (1, 2, 3):
+        (tmp_path / "PL_EN_dict{}.html".format(n)).unlink()
+    original_generate = dict_helpers.Lemma.generate_lemma_html_entry
+
+    def failing_generate(lemma, *args, **kwargs):
+        if lemma.headword == "pies":
+            raise ValueError("broken entry")
+        return original_generate(lemma, *args, **kwargs)
+
+    monkeypatch.setattr(dict_helpers.Lemma, "generate_lemma_html_entry", failing_generate)
+    with pytest.raises(Exception, match="Failed to render dictionary chunks: 2"):
+        create_html_dictionary(chunk_jobs=2)
+    assert sorted(path.name for path in tmp_path.glob("PL_EN_dict*.html*")) == ["PL_EN_dict1.html", "PL_EN_dict3.html"]
+
+
+def test_build_resumes_from_checkpoints(tmp_path, monkeypatch, capsys):
+    setup_test_build(tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY])
+    first_state = DictionaryBuild().run()
+    first_build = (tmp_path / "PL_EN_dict1.html").read_text(encoding="utf-8")
+    capsys.readouterr()
+
+    build = DictionaryBuild()
+    resumed_state = build.run()
+    assert "Stage render: resumed from checkpoint" in capsys.readouterr().out
+    assert build.stage_times == {"extract": None, "merge": None, "sort": None, "link": None, "inflect": None, "render": None}
+    # Every checkpoint only holds what its stage changed, the state is rebuilt from all of them
+    with open(tmp_path / "build_checkpoints" / "render.pickle", "rb") as myfile:
+        assert pickle.load(myfile)["changed_keys"] == ["build_stats"]
+        assert list(pickle.load(myfile)) == ["build_stats"]
+    assert sorted(resumed_state) == sorted(first_state)
+    assert [lemma.links for lemma in resumed_state["sorted_lemmas"]] == (
+        [lemma.links for lemma in first_state["sorted_lemmas"]]
+    )
+
+    # The corpus is identified by its content, a fresh copy of the same corpus reruns nothing
+    os.remove(dict_helpers.CORPUS_FILENAME)
+    write_test_corpus(tmp_path, [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY])
+    build = DictionaryBuild()
+    build.run()
+    assert build.stage_times["extract"] is None and build.stage_times["render"] is None
+
+    # Missing outputs invalidate the render checkpoint, but not the ones before it
+    (tmp_path / "PL_EN_dict1.html").unlink()
+    build = DictionaryBuild()
+    build.run()
+    assert build.stage_times["inflect"] is None and build.stage_times["render"] is not None
+    assert (tmp_path / "PL_EN_dict1.html").read_text(encoding="utf-8") == first_build
+
+    # A changed corpus reruns everything
+    write_test_corpus(tmp_path, [TEST_FULL_NOUN_ENTRY])
+    build = DictionaryBuild()
+    build.run()
+    assert None not in build.stage_times.values()
+    assert "mieć" not in (tmp_path / "PL_EN_dict1.html").read_text(encoding="utf-8")
+
+
+def test_build_reports_inflection_cache_counts_of_this_run_only(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(dict_helpers, "fetch_current_git_hash", lambda: "abc123")
+    setup_test_build(tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY])
+    DictionaryBuild(create_with_stats=True, inflection_cache_path="inflections.sqlite").run()
+    assert "Inflection cache hits: 0, misses: 2" in capsys.readouterr().out
+    assert "inflection_cache" in json.loads((tmp_path / "dictionary_stats_abc123.json").read_text(encoding="utf-8"))
+
+    DictionaryBuild(create_with_stats=True, inflection_cache_path="inflections.sqlite").run()
+    assert "Inflection cache hits" not in capsys.readouterr().out
+    assert "inflection_cache" not in json.loads((tmp_path / "dictionary_stats_abc123.json").read_text(encoding="utf-8"))
+
+
+def test_build_recreates_missing_outputs_of_earlier_stages(tmp_path, monkeypatch):
+    setup_test_build(tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY], with_kindlegen=True)
+    DictionaryBuild(make_mobi_dict=True, write_snapshot=True).run()
+
+    # The checkpoints of the later stages are all valid, but the build restarts from the earliest incomplete stage
+    (tmp_path / "PL_EN_dict1.html").unlink()
+    (tmp_path / "PL_EN_dict.mobi").unlink()
+    build = DictionaryBuild(make_mobi_dict=True, write_snapshot=True)
+    build.run()
+    assert build.stage_times["inflect"] is None
+    assert None not in [build.stage_times[stage_name] for stage_name in ("render", "kindlegen", "snapshot")]
+    assert (tmp_path / "PL_EN_dict1.html").exists()
+    assert (tmp_path / "PL_EN_dict.mobi").exists()
+
+    (tmp_path / "PL_EN_dict.mobi").unlink()
+    build = DictionaryBuild(make_mobi_dict=True, write_snapshot=True)
+    build.run()
+    assert build.stage_times["render"] is None and build.stage_times["kindlegen"] is not None
+    assert (tmp_path / "PL_EN_dict.mobi").exists()
+
+
+def test_build_variants(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(dict_helpers, "fetch_current_git_hash", lambda: "abc123")
+    setup_test_build(
+        tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, TEST_DERIVED_ENTRY, TEST_VERB_W_CONJ_ENTRY],
+        [{"entry": "kotek", "abbr_pos": "rz.", "translation": "kitty"}], with_kindlegen=True
+    )
+    variants = [DICTIONARY_VARIANTS["default"], DICTIONARY_VARIANTS["no_mt_derived"]]
+    build = DictionaryVariantsBuild(variants, create_with_stats=True, make_mobi_dict=True, kindlegen_jobs=2)
+    build.run()
+    assert list(build.stage_times) == ["extract", "merge", "select", "inflect", "render", "kindlegen"]
+
+    default_html = (tmp_path / "variants" / "default" / "PL_EN_dict1.html").read_text(encoding="utf-8")
+    derived_html = (tmp_path / "variants" / "no_mt_derived" / "PL_EN_dict1.html").read_text(encoding="utf-8")
+    assert "kotek" in default_html and "<b>psa</b>" not in default_html
+    assert "kotek" not in derived_html and "<b>psa</b>" in derived_html
+    for variant in variants:
+        variant_dir = tmp_path / "variants" / variant.name
+        assert (variant_dir / "PL_EN_dict.mobi").exists()
+        stats = json.loads((variant_dir / "dictionary_stats_abc123.json").read_text(encoding="utf-8"))
+        assert stats["variant"]["name"] == variant.name
+        assert stats["lemmas_count"] == 3
+        assert stats["mobi_bytes"] > 0
+        assert stats["discarded_entries_counts"][DISCARDED_DERIVED_VARNAME + "_count"] == int(not variant.derived_only)
+    capsys.readouterr()
+
+    DictionaryVariantsBuild(variants, create_with_stats=True, make_mobi_dict=True).run()
+    assert "Stage kindlegen: resumed from checkpoint" in capsys.readouterr().out
+
+    with pytest.raises(Exception, match="not supported when building variants: make_stardict_dict"):
+        DictionaryVariantsBuild(variants, make_stardict_dict=True)
+
+    # A deleted variant directory is rendered and compiled again
+    shutil.rmtree(tmp_path / "variants" / "no_mt_derived")
+    build = DictionaryVariantsBuild(variants, create_with_stats=True, make_mobi_dict=True)
+    build.run()
+    assert build.stage_times["inflect"] is None and build.stage_times["render"] is not None
+    assert (tmp_path / "variants" / "no_mt_derived" / "PL_EN_dict.mobi").exists()
+
+
+def test_build_compares_html_modes(tmp_path, monkeypatch):
+    monkeypatch.setattr(dict_helpers, "fetch_current_git_hash", lambda: "abc123")
+    setup_test_build(
+        tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY, TEST_VERB_W_SYNONYMS_ENTRY],
+        with_kindlegen=True
+    )
+    DictionaryBuild(
+        create_with_stats=True, make_mobi_dict=True, html_mode=HTML_TEMPLATE_MODE_READABLE, compare_html_modes=True
+    ).run()
+    # The build itself keeps the requested mode, the compact one is only built aside
+    readable_html = (tmp_path / "PL_EN_dict1.html").read_text(encoding="utf-8")
+    assert "\n    <idx:entry" in readable_html
+    assert sorted(path.name for path in tmp_path.glob("PL_EN_dict*.html")) == ["PL_EN_dict1.html"]
+
+    stats = json.loads((tmp_path / "dictionary_stats_abc123.json").read_text(encoding="utf-8"))
+    assert sorted(stats["html_modes"]) == ["compact", "readable"]
+    assert stats["html_modes"]["readable"]["html_bytes"] == stats["html_bytes"] == len(readable_html.encode("utf-8"))
+    assert stats["html_modes"]["compact"]["html_bytes"] < stats["html_modes"]["readable"]["html_bytes"]
+    for mode_stats in stats["html_modes"].values():
+        assert mode_stats["mobi_bytes"] > 0
+
+
+def test_build_compares_headword_grouping(tmp_path, monkeypatch):
+    monkeypatch.setattr(dict_helpers, "fetch_current_git_hash", lambda: "abc123")
+    setup_test_build(
+        tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, dict(TEST_FULL_NOUN_ENTRY, pos="adj"), TEST_VERB_W_CONJ_ENTRY],
+        with_kindlegen=True
+    )
+    DictionaryBuild(create_with_stats=True, make_mobi_dict=True, compare_headword_grouping=True).run()
+    assert (tmp_path / "PL_EN_dict1.html").read_text(encoding="utf-8").count("<idx:entry") == 3
+
+    stats = json.loads((tmp_path / "dictionary_stats_abc123.json").read_text(encoding="utf-8"))
+    assert sorted(stats["headword_grouping"]) == ["grouped", "ungrouped"]
+    assert stats["headword_grouping"]["ungrouped"]["entries_count"] == stats["entries_count"] == 3
+    assert stats["headword_grouping"]["grouped"]["entries_count"] <= (
+        stats["headword_grouping"]["ungrouped"]["entries_count"]
+    )
+    for layout_stats in stats["headword_grouping"].values():
+        assert layout_stats["mobi_bytes"] > 0
+
+
+def test_build_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(dict_helpers, "fetch_current_git_hash", lambda: "abc123")
+    setup_test_build(tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY])
+    DictionaryBuild(profile=True).run()
+    for stage_name in ("extract", "merge", "sort", "link", "inflect", "render"):
+        stats = pstats.Stats(str(tmp_path / "dictionary_profile_abc123_{}.prof".format(stage_name)))
+        assert stats.total_calls > 0
+    memory_profile = json.loads((tmp_path / "dictionary_memory_abc123.json").read_text(encoding="utf-8"))
+    assert memory_profile["render"]["peak_bytes"] > 0
+    assert memory_profile["render"]["top_allocations"]
+
+
+def test_corpus_index(tmp_path):
+    noun_adjective_entry = dict(TEST_FULL_NOUN_ENTRY, pos="adj")
+    entries = [TEST_VERB_W_CONJ_ENTRY, TEST_FULL_NOUN_ENTRY, TEST_DERIVED_ENTRY, noun_adjective_entry]
+    write_test_corpus(tmp_path, entries)
+    corpus_filename = str(tmp_path / dict_helpers.CORPUS_FILENAME)
+    index_filename = corpus_filename + ".idx"
+    with open_corpus_index(corpus_filename, index_filename) as corpus_index:
+        assert len(corpus_index) == 4
+        assert corpus_index.find("pies") == [noun_adjective_entry, TEST_FULL_NOUN_ENTRY]
+        assert corpus_index.find("pies", "noun") == [TEST_FULL_NOUN_ENTRY]
+        assert corpus_index.find("mieć") == [TEST_VERB_W_CONJ_ENTRY]
+        assert corpus_index.find("pie") == []
+        assert corpus_index.find("pies", "verb") == []
+
+    write_test_corpus(tmp_path, entries[:2])
+    with pytest.raises(Exception, match="out of date"):
+        CorpusIndex(corpus_filename, index_filename)
+    with open_corpus_index(corpus_filename, index_filename) as corpus_index:
+        assert len(corpus_index) == 2
+
+
+def test_lemma_snapshot(tmp_path, monkeypatch):
+    setup_test_build(
+        tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY, TEST_VERB_W_SYNONYMS_ENTRY],
+        [{"entry": "kotek", "abbr_pos": "rz.", "translation": "kitty"}]
+    )
+    state = DictionaryBuild(write_snapshot=True).run()
+    with LemmaSnapshot() as lemma_snapshot:
+        assert len(lemma_snapshot) == len(state["sorted_lemmas"]) == 4
+        for lemma, snapshot_lemma in zip(state["sorted_lemmas"], lemma_snapshot):
+            derived_forms = dict_helpers.generate_derived_forms_by_headword([lemma.headword])[lemma.headword]
+            assert lemma_snapshot.find_derived_forms(lemma.headword) == derived_forms
+            assert snapshot_lemma.generate_lemma_html_entry(derived_forms=derived_forms) == (
+                lemma.generate_lemma_html_entry(derived_forms=derived_forms)
+            )
+        assert [lemma.dictionary_id for lemma in lemma_snapshot.find("kotek")] == ["1"]
+        assert lemma_snapshot.find("kot") == []
+
+    dictionary_lookup = load_dictionary_lookup_from_snapshot()
+    assert dictionary_lookup.lookup("psa")["inflected_form_of"] == ["pies"]
+
+    # Editing the snapshot code only reruns the snapshot stage
+    snapshot_code_copy = tmp_path / "lemma_snapshot.py"
+    shutil.copy(lemma_snapshot_module.__file__, snapshot_code_copy)
+    monkeypatch.setattr(lemma_snapshot_module, "__file__", str(snapshot_code_copy))
+    with open(snapshot_code_copy, "a", encoding="utf-8") as myfile:
+        myfile.write("# edited\n")
+    build = DictionaryBuild(write_snapshot=True)
+    build.run()
+    assert build.stage_times["render"] is None and build.stage_times["snapshot"] is not None
+
+    # A changed corpus makes the snapshot stale, opening it again rebuilds it
+    write_test_corpus(tmp_path, [TEST_FULL_NOUN_ENTRY])
+    with pytest.raises(Exception, match="out of date"):
+        LemmaSnapshot()
+    with open_lemma_snapshot() as lemma_snapshot:
+        assert [lemma.headword for lemma in lemma_snapshot] == ["pies"]
+        with pytest.raises(Exception, match="without inflections"):
+            lemma_snapshot.find_derived_forms("pies")
+
+
+def test_stardict_dictionary(tmp_path, monkeypatch):
+    setup_test_build(
+        tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, dict(TEST_FULL_NOUN_ENTRY, pos="adj"), TEST_VERB_W_CONJ_ENTRY],
+        [{"entry": "Kot", "abbr_pos": "rz.", "translation": "cat"}]
+    )
+    DictionaryBuild(make_stardict_dict=True).run()
+
+    ifo = (tmp_path / "PL_EN_dict.ifo").read_text(encoding="utf-8").splitlines()
+    idx_data = (tmp_path / "PL_EN_dict.idx").read_bytes()
+    assert ifo[0] == "StarDict's dict ifo file"
+    assert "wordcount=3" in ifo and "idxfilesize={}".format(len(idx_data)) in ifo
+    words = list(read_stardict_index(idx_data))
+    assert [word for word, _ in words] == ["Kot", "mieć", "pies"]
+    dict_data = gzip.decompress((tmp_path / "PL_EN_dict.dict.dz").read_bytes())
+    offset, size = words[2][1]
+    pies_entry = dict_data[offset:offset + size].decode("utf-8")
+    assert pies_entry.startswith("<b>pies</b>") and pies_entry.count("<ol>") == 2
+    assert read_dictzip_chunk(str(tmp_path / "PL_EN_dict.dict.dz"), 0) == dict_data
+
+    synonyms = list(read_stardict_index((tmp_path / "PL_EN_dict.syn").read_bytes(), STARDICT_SYN_RECORD))
+    assert ("psa", (2,)) in synonyms
+    assert "synwordcount={}".format(len(synonyms)) in ifo
+    assert [word for word, _ in synonyms] == sorted((word for word, _ in synonyms), key=stardict_sort_key)
+
+    # Editing the writer only reruns the stardict stage
+    writer_copy = tmp_path / "stardict_writer.py"
+    shutil.copy(stardict_writer.__file__, writer_copy)
+    monkeypatch.setattr(stardict_writer, "__file__", str(writer_copy))
+    build = DictionaryBuild(make_stardict_dict=True)
+    build.run()
+    assert build.stage_times["stardict"] is None
+    with open(writer_copy, "a", encoding="utf-8") as myfile:
+        myfile.write("# edited\n")
+    build = DictionaryBuild(make_stardict_dict=True)
+    build.run()
+    assert build.stage_times["render"] is None and build.stage_times["stardict"] is not None
+
+
+def test_dictzip_chunks_decompress_independently(tmp_path):
+    data = "".join("{} zażółć gęślą jaźń\n".format(i) for i in range(200)).encode("utf-8")
+    filename = str(tmp_path / "test.dict.dz")
+    with DictzipWriter(filename, chunk_length=512) as writer:
+        for i in range(0, len(data), 100):
+            writer.write(data[i:i + 100])
+    assert gzip.decompress((tmp_path / "test.dict.dz").read_bytes()) == data
+    for chunk_no in range(-(-len(data) // 512)):
+        assert read_dictzip_chunk(filename, chunk_no) == data[chunk_no * 512:(chunk_no + 1) * 512]
+
+
+def test_dictionary_lookup(tmp_path, monkeypatch):
+    setup_test_build(tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY])
+    # The lookup service serves the readable HTML
+    create_html_dictionary(html_mode=HTML_TEMPLATE_MODE_READABLE)
+    rendered_html = (tmp_path / "PL_EN_dict1.html").read_text(encoding="utf-8")
+    dictionary_lookup = load_dictionary_lookup()
+
+    [entry] = dictionary_lookup.lookup_headword("pies")
+    assert entry["morph_cat"] == "noun"
+    assert entry["html"] in rendered_html
+    assert dictionary_lookup.lookup_inflected_form("psu") == ["pies"]
+    result = dictionary_lookup.lookup("psa")
+    assert result["inflected_form_of"] == ["pies"]
+    assert [entry["headword"] for entry in result["entries"]] == ["pies"]
+    assert dictionary_lookup.lookup("nieistniejący") == {"word": "nieistniejący", "inflected_form_of": [], "entries": []}
+
+    lookup_server = create_lookup_server(dictionary_lookup, port=0)
+    threading.Thread(target=lookup_server.serve_forever, daemon=True).start()
+    try:
+        with urlopen("http://127.0.0.1:{}/lookup?word=psa".format(lookup_server.server_port)) as response:
+            assert json.loads(response.read().decode("utf-8")) == result
+    finally:
+        lookup_server.shutdown()
+        lookup_server.server_close()
+
+
+def test_analyze_text_coverage():
+    form_index = {"pies": ("pies",), "psa": ("pies",), "mam": ("mieć", "mama"), "mieć": ("mieć",)}
+    coverage = analyze_text_coverage("Mam psa. Pies, psa i kota 2 razy!", form_index)
+    assert coverage["tokens_count"] == 7
+    assert coverage["unique_tokens_count"] == 6
+    assert coverage["covered_tokens_percentage"] == 57.14
+    assert coverage["covered_unique_tokens_percentage"] == 50.0
+    assert coverage["ambiguous_tokens_percentage"] == 14.29
+    assert [word["word"] for word in coverage["top_missing"]] == ["i", "kota", "razy"]
+    assert coverage["top_ambiguous"] == [{"word": "Mam", "count": 1, "headwords": ["mieć", "mama"]}]
+
+
+def test_build_form_index(tmp_path, monkeypatch):
+    setup_test_build(tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY])
+    form_index = build_form_index(load_dictionary_lookup())
+    assert form_index["pies"] == ("pies",)
+    assert form_index["psu"] == ("pies",)
+    assert form_index["mam"] == ("mieć",)
+
+
+def test_generate_synthetic_corpus(tmp_path):
+    generate_synthetic_corpus(tmp_path, 200, seed=1)
+    first_corpus = (tmp_path / dict_helpers.CORPUS_FILENAME).read_bytes()
+    generate_synthetic_corpus(tmp_path, 200, seed=1)
+    assert (tmp_path / dict_helpers.CORPUS_FILENAME).read_bytes() == first_corpus
+
+    lemmas, discarded = extract_head_words(load_corpus(str(tmp_path / dict_helpers.CORPUS_FILENAME)))
+    assert 0 < len(lemmas) < 200
+    assert discarded[DISCARDED_INVALID_POS_VARNAME + "_count"] > 0
+    assert discarded[DISCARDED_DERIVED_VARNAME + "_count"] > 0
+    assert any(lemma.aspect_form for lemma in lemmas)
+
+
+def test_run_benchmark():
+    results = run_benchmark(100)
+    assert list(results["stages"]) == ["load", "extract", "merge", "sort", "link", "inflect", "render"]
+    assert results["stages"]["load"]["items"] == 100
+    assert results["iforms"] > 0
+
+
+def test_fingerprint_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(dict_helpers, "FILE_FINGERPRINT_SAMPLE_SIZE", 4)
+    (tmp_path / "a.txt").write_text("0123456789")
+    (tmp_path / "b.txt").write_text("0123456789")
+    fingerprint = fingerprint_file(str(tmp_path / "a.txt"))
+    assert fingerprint_file(str(tmp_path / "b.txt")) == fingerprint
+    (tmp_path / "b.txt").write_text("012345678X")
+    assert fingerprint_file(str(tmp_path / "b.txt")) != fingerprint
+    assert fingerprint_file(str(tmp_path / "missing.txt")) is None
+
+
+def test_plan_dictionary_chunks():
+    lemmas = [
+        build_lemma_from_corpus_entry(dict(TEST_FULL_NOUN_ENTRY, word=word))
+        for word in ["a", "b", "c", "d", "e"]
+    ]
+    iform_counts = {"a": 10, "b": 60, "c": 5, "d": 5, "e": 100}
+    planned = plan_dictionary_chunks(lemmas, iform_counts, max_iforms=80, max_lemmas=2)
+    assert [[lemma.headword for lemma in chunk] for chunk in planned] == [["a", "b"], ["c", "d"], ["e"]]
+    planned = plan_dictionary_chunks(lemmas, iform_counts, max_iforms=20, max_lemmas=10)
+    assert [[lemma.headword for lemma in chunk] for chunk in planned] == [["a"], ["b"], ["c", "d"], ["e"]]
+
+
+def test_opf_manifest_lists_produced_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(dict_helpers, "SAFE_DICT_CHUNK", 2)
+    setup_test_build(tmp_path, monkeypatch, [TEST_FULL_NOUN_ENTRY, TEST_VERB_W_CONJ_ENTRY, TEST_VERB_W_SYNONYMS_ENTRY])
+    create_html_dictionary()
+    opf_contents = (tmp_path / "PL_EN_dict.opf").read_text(encoding="utf-8")
+    assert opf_contents.count('media-type="application/xhtml+xml"') == 2
+    assert 'href="PL_EN_dict2.html"' in opf_contents
+    assert '<itemref idref="DictBody2"/>' in opf_contents
+    assert "DictBody3" not in opf_contents